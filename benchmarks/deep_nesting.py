@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import argparse
+
+import gc
+
+import math
+
+import sys
+
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bitter.compiler import load_parser, create_target
+
+from bitter.terminal import error_collector
+
+def chain(depth: int) -> str:
+    # a left-leaning chain of operators, as machine-generated sums are
+    return f"y = {' + '.join(['x'] * (depth + 1))};"
+
+def parentheses(depth: int) -> str:
+    # a right-leaning chain, every operator in its own parentheses
+    return f"y = {'(x * ' * depth}x{')' * depth};"
+
+def statements(depth: int) -> str:
+    lines = []
+    for level in range(depth):
+        lines.append("if x < 1 {" if level % 2 == 0 else "repeat 2 {")
+    lines.append("y = 1;")
+    for level in reversed(range(depth)):
+        lines.append("} else { y = 2; }" if level % 2 == 0 else "}")
+
+    return "\n".join(lines)
+
+SHAPES = {
+    "chain": chain,
+    "parentheses": parentheses,
+    "statements": statements
+}
+
+def generate_source(shape: str, depth: int) -> str:
+    return f"onflag {{\nx = 1;\n{SHAPES[shape](depth)}\n}}\n"
+
+def measure(parser, source: str, repeats: int) -> float:
+    """
+    The best time parsing and lowering the source took, every pass included.
+    """
+
+    best = float('inf')
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        target = create_target(Path("deep.gs"), parser.parse(source), Path("."), 1)
+        target.build(parser)
+        best = min(best, time.perf_counter() - start)
+        del target
+
+    return best
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Lower ever deeper expressions and statements, and check that the time grows linearly with the depth.")
+    argument_parser.add_argument("--shape", choices=list(SHAPES), action="append", help="Shape of nesting to measure, can be repeated. Defaults to all.")
+    argument_parser.add_argument("-d", "--depths", type=int, nargs="+", default=[1250, 2500, 5000, 10000], help="Nesting depths to measure.")
+    argument_parser.add_argument("--repeats", type=int, default=3, help="The best of this many runs is reported.")
+    argument_parser.add_argument("--max-exponent", type=float, default=1.3, help="Fail if the time grows faster than depth to this power between the smallest and largest depth.")
+    args = argument_parser.parse_args()
+
+    parser, _ = load_parser("lalr", use_cache=False)
+
+    failed = False
+    for shape in args.shape or list(SHAPES):
+        print(f"{shape}:")
+        print(f"{'depth':>12} {'seconds':>10} {'us/level':>10}")
+
+        times = []
+        for depth in args.depths:
+            error_collector.errors = []
+            elapsed = measure(parser, generate_source(shape, depth), args.repeats)
+            if len(error_collector.errors) > 0:
+                error_collector.render()
+                sys.exit(1)
+
+            times.append(elapsed)
+            print(f"{depth:>12} {elapsed:>10.4f} {elapsed / depth * 1e6:>10.1f}")
+
+        if len(times) > 1 and args.depths[-1] > args.depths[0]:
+            exponent = math.log(times[-1] / times[0]) / math.log(args.depths[-1] / args.depths[0])
+            print(f"{'growth':>12} n^{exponent:.2f}")
+            failed |= exponent > args.max_exponent
+
+        print()
+
+    if failed:
+        print(f"Lowering grew faster than n^{args.max_exponent}.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
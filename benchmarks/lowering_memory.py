@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import argparse
+
+import gc
+
+import sys
+
+import time
+
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bitter.compiler import load_parser, create_target
+
+from bitter.sb3.passes import select_passes
+
+def generate_source(statements: int) -> str:
+    lines = ["def helper a, b {", "    goto $a, $b;", "}", "", "def bench x, y {"]
+    for index in range(statements):
+        match index % 5:
+            case 0:
+                lines.append(f"    v{index % 16} = $x + (p * 2) - $y / 4;")
+            case 1:
+                lines.append(f"    goto $x + p, $y - (p * {index % 7});")
+            case 2:
+                lines.append(f"    if p > {index % 10} {{ setpensize p * 2; pendown; }} else {{ penup; }}")
+            case 3:
+                lines.append(f"    repeat {index % 5 + 1} {{ move $x; turnright $y + 15; }}")
+            case 4:
+                lines.append(f"    helper $x * 2, {index % 9};")
+    lines.append("}")
+
+    return "\n".join(lines)
+
+def lower(parser, tree):
+    # nothing calls the generated function, so it would be removed as unused
+    target = create_target(Path("bench.gs"), tree, Path("."), 1, select_passes(disabled=('dead-procedures',)))
+    target.build(parser)
+    return target
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Measure the time and memory lowering and rendering a large target takes.")
+    argument_parser.add_argument("-s", "--statements", type=int, default=18000, help="Statements in the generated target, the default lowers to about 100k blocks.")
+    argument_parser.add_argument("--repeats", type=int, default=3, help="The best of this many runs is reported for time.")
+    args = argument_parser.parse_args()
+
+    parser, _ = load_parser("lalr", use_cache=False)
+    source = generate_source(args.statements)
+    tree = parser.parse(source)
+
+    best = float('inf')
+    best_render = float('inf')
+    for _ in range(args.repeats):
+        gc.collect()
+        start = time.perf_counter()
+        target = lower(parser, tree)
+        best = min(best, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in target.blocks.records():
+            pass
+        best_render = min(best_render, time.perf_counter() - start)
+        del target
+
+    gc.collect()
+    tracemalloc.start()
+    target = lower(parser, tree)
+    _, peak = tracemalloc.get_traced_memory()
+    statistics = tracemalloc.take_snapshot().statistics('filename')
+    tracemalloc.stop()
+
+    blocks = len(target.blocks.arena)
+    retained = sum(statistic.size for statistic in statistics)
+    allocations = sum(statistic.count for statistic in statistics)
+
+    print(f"{'blocks':>22} {blocks:>12}")
+    print(f"{'lowering seconds':>22} {best:>12.3f}")
+    print(f"{'us per block':>22} {best / blocks * 1e6:>12.2f}")
+    print(f"{'render seconds':>22} {best_render:>12.3f}")
+    print(f"{'peak MB':>22} {peak / 1e6:>12.1f}")
+    print(f"{'retained MB':>22} {retained / 1e6:>12.1f}")
+    print(f"{'retained allocations':>22} {allocations:>12}")
+    print(f"{'bytes per block':>22} {retained / blocks:>12.0f}")
+
+if __name__ == '__main__':
+    main()
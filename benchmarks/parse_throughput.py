@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import argparse
+
+import random
+
+import sys
+
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bitter.compiler import load_parser
+
+def generate_expression(rng: random.Random, depth: int) -> str:
+    if depth == 0:
+        return rng.choice(["$x", "$y", "p", "rad", "2", "0.5", "sin(45)", "mousex()"])
+
+    operator = rng.choice(["+", "-", "*", "/", "<", ">", "="])
+    left = generate_expression(rng, depth - 1)
+    right = generate_expression(rng, depth - 1)
+
+    if rng.random() < 0.3:
+        return f"({left} {operator} {right})"
+    return f"{left} {operator} {right}"
+
+def generate_source(statements: int, depth: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+
+    lines = ["costumes \"costume.svg\";", "", "def bench x, y {"]
+    for index in range(statements):
+        lines.append(f"    v{index % 16} = {generate_expression(rng, depth)};")
+    lines.append("}")
+
+    return "\n".join(lines)
+
+def measure(parser, source: str, repeats: int) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parser.parse(source)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Measure how parse time scales with the size of a .gs file.")
+    argument_parser.add_argument("-b", "--backend", choices=["lalr", "earley"], action="append", help="Parser backend to measure, can be repeated. Defaults to lalr only, since earley takes minutes on the larger sizes.")
+    argument_parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[250, 500, 1000, 2000, 4000], help="Statement counts to measure.")
+    argument_parser.add_argument("--depth", type=int, default=4, help="Operator depth of every generated expression.")
+    argument_parser.add_argument("--repeats", type=int, default=3, help="The best of this many runs is reported.")
+    args = argument_parser.parse_args()
+
+    for backend in args.backend or ["lalr"]:
+        parser, _ = load_parser(backend, use_cache=False)
+
+        print(f"{backend}:")
+        print(f"{'statements':>12} {'bytes':>10} {'seconds':>10} {'kB/s':>10} {'us/stmt':>10}")
+
+        for size in args.sizes:
+            source = generate_source(size, args.depth)
+            elapsed = measure(parser, source, args.repeats)
+            print(f"{size:>12} {len(source):>10} {elapsed:>10.4f} {len(source) / 1000 / elapsed:>10.1f} {elapsed / size * 1e6:>10.1f}")
+
+        print()
+
+if __name__ == '__main__':
+    main()
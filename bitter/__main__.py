@@ -6,6 +6,18 @@ from .terminal import error_collector
 
 from .compiler import compile_code
 
+from .watch import watch_project
+
+from .cache import run_cache_command
+
+from .bench import run_bench
+
+from .synthetic import Workload
+
+from .sb3.emitter import JSON_BACKENDS, orjson
+
+from .sb3.passes import DEFAULT_LEVEL, OPTIMISATION_LEVELS, PASS_NAMES, select_passes
+
 import cProfile
 
 import pstats
@@ -15,22 +27,119 @@ def main():
 
     parser.add_argument(
         "action", 
-        choices=["compile", "new"], 
+        choices=["compile", "watch", "cache", "bench", "new"], 
         help="Action to perform"
     )
     parser.add_argument(
         "path", 
         nargs="?", 
-        help="Path to the Goboscript code file"
+        help="Path to the Goboscript code file, or 'stats' or 'prune' for the 'cache' action. For 'bench', a project to measure instead of a synthetic one."
     )
     parser.add_argument(
-        "-d", "--debug", 
+        "-p", "--parser",
+        choices=["lalr", "earley"],
+        default="lalr",
+        help="Parser backend. 'lalr' is linear-time and used by default, 'earley' accepts the same grammar but is slower."
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes which parse and lower targets in parallel. The output is the same as with 1."
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Build every target from scratch and don't read or write any cache."
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        help="Seconds between checks for changed files in 'watch' mode."
+    )
+    parser.add_argument(
+        "--costume-cache-size",
+        type=float,
+        default=256,
+        help="Size limit of the processed costume cache in MiB. The least recently used costumes are evicted beyond it."
+    )
+    parser.add_argument(
+        "--json-backend",
+        choices=JSON_BACKENDS,
+        default="auto",
+        help="Serialiser for project.json. 'auto' uses orjson when it is installed. Every backend writes the same bytes."
+    )
+    parser.add_argument(
+        "--keep-unused",
+        action="store_true",
+        help="Keep functions which no script can call. By default they are removed from the project. The same as '--disable-pass dead-procedures'."
+    )
+    parser.add_argument(
+        "-O",
+        dest="optimisation_level",
+        type=int,
+        choices=OPTIMISATION_LEVELS,
+        default=DEFAULT_LEVEL,
+        help=f"Optimisation level. -O0 lowers the tree as it was parsed, -O1 folds constants and removes unused functions, -O2 also inlines, hoists loop invariants and eliminates common subexpressions. -O{DEFAULT_LEVEL} by default."
+    )
+    parser.add_argument(
+        "--enable-pass",
+        choices=PASS_NAMES,
+        action="append",
+        default=[],
+        help="Run an optimisation pass the optimisation level leaves out, can be repeated. Passes always run in their fixed order."
+    )
+    parser.add_argument(
+        "--disable-pass",
+        choices=PASS_NAMES,
+        action="append",
+        default=[],
+        help="Leave out an optimisation pass the optimisation level runs, can be repeated. Disabling wins over enabling."
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        nargs="?",
+        const=Path("trace.json"),
+        help="Write how long each phase, target and costume took to a Chrome trace event file, 'trace.json' by default. Open it in chrome://tracing or Perfetto."
+    )
+    parser.add_argument(
+        "--memprofile",
+        type=Path,
+        nargs="?",
+        const=Path("memprofile.json"),
+        help="Write the memory held after each phase and what each target retains to a JSON report, 'memprofile.json' by default. Builds serially and several times slower."
+    )
+    parser.add_argument(
+        "-d", "--debug",
         action="store_true", 
         help="Enable debug mode. This will write function timing data to 'profile.prof' (raw) and 'profile.txt' (readable). It will also dump the json to 'PROJECT_NAME.debug.json'.' "
     )
 
+
+    bench = parser.add_argument_group("bench", "Options of the 'bench' action, which times the parse, lower, assets and render phases of a build.")
+    bench.add_argument("--sprites", type=int, default=4, help="Sprites in the synthetic project.")
+    bench.add_argument("--functions", type=int, default=8, help="Functions in every synthetic sprite.")
+    bench.add_argument("--statements", type=int, default=40, help="Statements in every synthetic function.")
+    bench.add_argument("--depth", type=int, default=3, help="Operator depth of the synthetic expressions.")
+    bench.add_argument("--costumes", type=int, default=2, help="PNG costumes of every synthetic sprite.")
+    bench.add_argument("--seed", type=int, default=0, help="Seed the synthetic project is generated from.")
+    bench.add_argument("--scale", type=float, nargs="+", default=[1], help="Multiply the statements per function by each factor in turn and report how every phase scales.")
+    bench.add_argument("--repeats", type=int, default=5, help="Timed builds of every project, after one untimed warm up build.")
+    bench.add_argument("--baseline", type=Path, help="JSON file of median phase times to compare against. It is written if it doesn't exist.")
+    bench.add_argument("--save-baseline", action="store_true", help="Overwrite the baseline with this run instead of comparing against it.")
+    bench.add_argument("--tolerance", type=float, default=0.25, help="How much slower than the baseline a phase may be before the run fails, 0.25 is 25%%.")
+
     args = parser.parse_args()
 
+    costume_cache_size = int(args.costume_cache_size * 1024 * 1024)
+
+    passes = select_passes(args.optimisation_level, tuple(args.enable_pass), tuple(args.disable_pass + (['dead-procedures'] if args.keep_unused else [])))
+
+    if args.json_backend == "orjson" and orjson is None:
+        parser.error("The 'orjson' json backend requires orjson to be installed")
+
     if args.action == "compile":
         if not args.path:
             parser.error("Path argument is required for 'compile' action")
@@ -38,7 +147,7 @@ def main():
         if args.debug:
             pr = cProfile.Profile()
             pr.enable()
-            compile_code(Path(args.path), args.debug)
+            compile_code(Path(args.path), args.debug, args.parser, args.jobs, not args.no_cache, costume_cache_size, args.json_backend, passes, args.trace, args.memprofile)
             pr.disable()
             output_file = 'profile.prof'
             pr.dump_stats(output_file)
@@ -48,8 +157,26 @@ def main():
                 p.sort_stats('cumulative')
                 p.print_stats()
         else:
-            compile_code(Path(args.path), args.debug)
+            compile_code(Path(args.path), args.debug, args.parser, args.jobs, not args.no_cache, costume_cache_size, args.json_backend, passes, args.trace, args.memprofile)
         
+    elif args.action == "watch":
+        if not args.path:
+            parser.error("Path argument is required for 'watch' action")
+
+        watch_project(Path(args.path), args.parser, not args.no_cache, args.interval, costume_cache_size, args.json_backend, passes)
+
+    elif args.action == "cache":
+        if args.path not in ("stats", "prune"):
+            parser.error("The 'cache' action takes 'stats' or 'prune'")
+
+        run_cache_command(args.path, costume_cache_size)
+
+    elif args.action == "bench":
+        workload = Workload(args.sprites, args.functions, args.statements, args.depth, args.costumes, args.seed)
+        if not run_bench(Path(args.path) if args.path else None, args.parser, not args.no_cache, workload, args.scale, args.repeats, args.baseline, args.save_baseline, args.tolerance):
+            error_collector.render()
+            exit(1)
+
     elif args.action == "new":
         # TODO: Implement new
         pass
@@ -0,0 +1,227 @@
+from typing import Dict, List, Union
+
+from pathlib import Path
+
+from lark import Lark
+
+from time import perf_counter
+
+import json
+
+import math
+
+import tempfile
+
+from .compiler import load_parser, target_files, read_source, read_target, process_costumes
+
+from .sb3.project import Project
+
+from .synthetic import Workload, generate_project
+
+from .terminal import ANSI, pretty_count, error_collector
+
+from .cache import costume_cache
+
+PHASES = ('parse', 'lower', 'assets', 'render')
+
+BASELINE_VERSION = 1
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """
+    The value below which a fraction of the samples lie, interpolated between the two nearest.
+    """
+
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def time_build(parser: Lark, path: Path, destination: Path) -> Dict[str, float]:
+    """
+    Build a project from scratch, without any cache, and return the seconds each phase took.
+    """
+
+    times = {}
+
+    start = perf_counter()
+    targets = [read_target(parser, file, read_source(file), path, layer_order) for file, layer_order in target_files(path)]
+    times['parse'] = perf_counter() - start
+
+    project = Project()
+    for target in targets:
+        project.add_target(target)
+
+    start = perf_counter()
+    project.build(parser)
+    times['lower'] = perf_counter() - start
+
+    start = perf_counter()
+    process_costumes(project.targets)
+    times['assets'] = perf_counter() - start
+
+    start = perf_counter()
+    project.write(destination)
+    times['render'] = perf_counter() - start
+
+    return times
+
+class Measurement:
+    """
+    The phase times of repeated builds of one project.
+    """
+
+    def __init__(self, label: str, statements: int):
+        self.label: str = label
+        self.statements: int = statements
+        self.samples: Dict[str, List[float]] = {phase: [] for phase in (*PHASES, 'total')}
+
+    def add(self, times: Dict[str, float]):
+        for phase in PHASES:
+            self.samples[phase].append(times[phase])
+        self.samples['total'].append(sum(times.values()))
+
+    def median(self, phase: str) -> float:
+        return percentile(self.samples[phase], 0.5)
+
+    def medians(self) -> Dict[str, float]:
+        return {phase: self.median(phase) for phase in self.samples}
+
+def measure(parser: Lark, path: Path, label: str, statements: int, repeats: int) -> Union[None, Measurement]:
+    """
+    Build a project once to warm up, then time it the given number of times.
+    Returns None if the project has errors, which are left in the error collector.
+    """
+
+    measurement = Measurement(label, statements)
+    with tempfile.TemporaryDirectory() as output:
+        destination = Path(output) / "bench.sb3"
+
+        time_build(parser, path, destination)
+
+        # every build would report the same errors again
+        if len(error_collector.errors) > 0:
+            return None
+
+        for _ in range(repeats):
+            measurement.add(time_build(parser, path, destination))
+
+    return measurement
+
+def report_percentiles(measurement: Measurement):
+    print(f"{ANSI.bold}{measurement.label}{ANSI.reset} ({pretty_count(len(measurement.samples['total']), 'run')})")
+    print(f"{'phase':>10} {'min ms':>10} {'p50 ms':>10} {'p90 ms':>10} {'max ms':>10}")
+
+    for phase, samples in measurement.samples.items():
+        print(f"{phase:>10} {min(samples) * 1000:>10.1f} {percentile(samples, 0.5) * 1000:>10.1f} {percentile(samples, 0.9) * 1000:>10.1f} {max(samples) * 1000:>10.1f}")
+
+    print()
+
+def report_scaling(measurements: List[Measurement]):
+    """
+    Print the median time of every phase against the size of the project, and the
+    exponent of the growth between the smallest and largest size, where 1 is linear.
+    """
+
+    print(f"{ANSI.bold}Scaling{ANSI.reset}")
+    print(f"{'statements':>10} " + " ".join(f"{phase + ' ms':>10}" for phase in (*PHASES, 'total')) + f" {'us/stmt':>10}")
+
+    for measurement in measurements:
+        medians = measurement.medians()
+        print(f"{measurement.statements:>10} " + " ".join(f"{medians[phase] * 1000:>10.1f}" for phase in (*PHASES, 'total')) + f" {medians['total'] / measurement.statements * 1e6:>10.1f}")
+
+    smallest, largest = measurements[0], measurements[-1]
+    if largest.statements > smallest.statements:
+        size = math.log(largest.statements / smallest.statements)
+        exponents = [f"{phase} n^{math.log(largest.median(phase) / smallest.median(phase)) / size:.2f}" for phase in (*PHASES, 'total') if smallest.median(phase) > 0 and largest.median(phase) > 0]
+        print(f"{ANSI.fg_bright_black}Growth from {smallest.statements} to {largest.statements} statements: {', '.join(exponents)}.{ANSI.reset}")
+
+    print()
+
+def baseline_document(workload: Union[None, Workload], measurements: List[Measurement]) -> Dict:
+    return {
+        "version": BASELINE_VERSION,
+        "workload": workload.describe() if workload is not None else None,
+        "results": {measurement.label: measurement.medians() for measurement in measurements}
+    }
+
+def compare_to_baseline(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """
+    Compare the median phase times of a run with a stored baseline. Returns a
+    description of every phase which got slower by more than the tolerance.
+    """
+
+    if baseline.get("version") != BASELINE_VERSION or baseline.get("workload") != current["workload"]:
+        return ["The baseline was measured with a different workload or format, save a new one with --save-baseline."]
+
+    regressions = []
+    for label, medians in current["results"].items():
+        if label not in baseline["results"]:
+            regressions.append(f"{label} has no baseline, save a new one with --save-baseline.")
+            continue
+
+        for phase, seconds in medians.items():
+            before = baseline["results"][label].get(phase)
+            if before is not None and seconds > before * (1 + tolerance):
+                regressions.append(f"{label} {phase} took {seconds * 1000:.1f} ms, {(seconds / before - 1) * 100:.0f}% more than the baseline's {before * 1000:.1f} ms.")
+
+    return regressions
+
+def run_bench(path: Union[None, Path], parser_backend: str, use_cache: bool, workload: Workload, scales: List[float], repeats: int, baseline: Union[None, Path], save_baseline: bool, tolerance: float) -> bool:
+    """
+    Handle 'bench' from the command line. Builds a synthetic project of the workload's
+    shape at every scale, or the project at path, and times each phase of the build.
+    Returns False if the project has errors or a phase regressed against the baseline.
+    """
+
+    parser, _ = load_parser(parser_backend, use_cache)
+
+    # converting costumes is part of what is measured
+    costume_cache.configure(False)
+
+    measurements: List[Measurement] = []
+    if path is not None:
+        # lines stand in for statements, a project is only measured at one size
+        lines = sum(len(read_source(file).splitlines()) for file, _ in target_files(path))
+        measurement = measure(parser, path, path.name, lines, repeats)
+        if measurement is None:
+            return False
+
+        measurements.append(measurement)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            for scale in scales:
+                scaled = workload.scaled(scale)
+                project = Path(directory) / f"scale-{scale:g}"
+                generate_project(project, scaled)
+
+                measurement = measure(parser, project, f"x{scale:g}", scaled.total_statements(), repeats)
+                if measurement is None:
+                    return False
+
+                measurements.append(measurement)
+
+    for measurement in measurements:
+        report_percentiles(measurement)
+
+    if len(measurements) > 1:
+        report_scaling(measurements)
+
+    current = baseline_document(workload if path is None else None, measurements)
+    if baseline is None:
+        return True
+
+    if save_baseline or not baseline.is_file():
+        baseline.write_text(json.dumps(current, indent=4) + "\n")
+        print(f"{ANSI.fg_bright_black}Saved the baseline to {baseline}.{ANSI.reset}")
+        return True
+
+    regressions = compare_to_baseline(json.loads(baseline.read_text()), current, tolerance)
+    for regression in regressions:
+        print(f"{ANSI.fg_red}{ANSI.bold}Regression:{ANSI.reset} {regression}")
+
+    if len(regressions) == 0:
+        print(f"{ANSI.fg_green}No phase is more than {tolerance * 100:.0f}% slower than the baseline.{ANSI.reset}")
+
+    return len(regressions) == 0
@@ -0,0 +1,272 @@
+from pathlib import Path
+
+from typing import Dict, List, Set, Tuple, Union
+
+from hashlib import sha256
+
+import os
+
+import json
+
+import struct
+
+from .terminal import ANSI, pretty_count
+
+def cache_directory() -> Union[None, Path]:
+    """
+    The per-user directory bitter keeps its caches in, or None if it can't be created.
+    Honours BITTER_CACHE_DIR, then XDG_CACHE_HOME.
+    """
+
+    if "BITTER_CACHE_DIR" in os.environ:
+        directory = Path(os.environ["BITTER_CACHE_DIR"])
+    else:
+        directory = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "bitter"
+
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+
+    return directory
+
+def content_key(*parts: Union[str, bytes]) -> str:
+    """
+    Hash the supplied parts into a key which changes whenever any of them does.
+    """
+
+    digest = sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+
+    return digest.hexdigest()
+
+def compiler_version() -> str:
+    """
+    A fingerprint of the compiler's own sources, so that any change to lowering invalidates cached output.
+    """
+
+    package = Path(__file__).resolve().parent
+    return content_key(*(file.read_bytes() for file in sorted(package.rglob("*.py"))))
+
+class BuildCache:
+    """
+    Lowered targets from earlier builds, kept in the project's .bitter-cache directory.
+
+    An entry is reused when the target's source file, the grammar, the compiler and
+    every costume file the target declares are unchanged. Processed costume assets
+    are stored next to the entries so a reused target never touches PIL.
+    """
+
+    def __init__(self, working_directory: Path, grammar_data: str, options: Tuple[str, ...] = ()):
+        # options are the build settings which change the lowered output
+        self.directory: Path = working_directory / ".bitter-cache"
+        self.fingerprint: str = content_key(grammar_data, compiler_version(), *options)
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def key(self, source: str) -> str:
+        return content_key(source, self.fingerprint)
+
+    def entry_path(self, file: Path) -> Path:
+        return self.directory / "targets" / f"{file.name}.json"
+
+    def asset_path(self, md5_ext: str) -> Path:
+        return self.directory / "assets" / md5_ext
+
+    def load(self, file: Path, source: str, working_directory: Path) -> Union[None, Dict]:
+        try:
+            with self.entry_path(file).open("r") as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            entry = None
+
+        if entry is not None and entry.get("key") == self.key(source):
+            for costume in entry["costumes"]:
+                if not self.asset_path(costume["metadata"]["md5ext"]).is_file():
+                    break
+                if file_key(working_directory / costume["source"]) != costume["source_key"]:
+                    break
+            else:
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def assets(self, entry: Dict) -> Dict[str, Path]:
+        return {costume["metadata"]["md5ext"]: self.asset_path(costume["metadata"]["md5ext"]) for costume in entry["costumes"]}
+
+    def store(self, file: Path, source: str, target):
+        entry = target.freeze()
+        entry["key"] = self.key(source)
+
+        try:
+            (self.directory / "assets").mkdir(parents=True, exist_ok=True)
+            (self.directory / "targets").mkdir(parents=True, exist_ok=True)
+
+            for costume, frozen_costume in zip(target.costumes, entry["costumes"]):
+                asset = self.asset_path(costume.md5_ext)
+                if not asset.is_file():
+                    temporary = asset.with_name(f".{asset.name}.{os.getpid()}.tmp")
+                    with temporary.open("wb") as asset_file:
+                        for chunk in costume.asset.chunks():
+                            asset_file.write(chunk)
+                    os.replace(temporary, asset)
+
+                frozen_costume["source_key"] = file_key(target.working_directory / frozen_costume["source"])
+
+            self.entry_path(file).write_text(json.dumps(entry, separators=(',', ':')))
+
+        except OSError:
+            # a cache which can't be written only makes the next build slower
+            pass
+
+def file_key(path: Path) -> Union[None, str]:
+    try:
+        return content_key(path.read_bytes())
+    except OSError:
+        return None
+
+DEFAULT_COSTUME_CACHE_SIZE = 256 * 1024 * 1024
+
+class CostumeCache:
+    """
+    Processed bitmap costumes, stored in the cache directory under a hash of the
+    original file and the processing applied to it.
+
+    Every entry is a single file holding the unscaled size followed by the
+    processed image. Reading an entry refreshes its modification time, which is
+    what eviction uses to find the least recently used entries once the cache
+    grows past its size limit.
+    """
+
+    header_size: int = 8
+
+    def __init__(self):
+        self.directory: Union[None, Path] = None
+        self.max_bytes: int = DEFAULT_COSTUME_CACHE_SIZE
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def configure(self, enabled: bool, max_bytes: int = DEFAULT_COSTUME_CACHE_SIZE):
+        directory = cache_directory() if enabled else None
+        self.directory = directory / "costumes" if directory is not None else None
+        self.max_bytes = max_bytes
+
+    def key(self, raw: bytes, *parameters: str) -> str:
+        return content_key(raw, *parameters)
+
+    def load(self, key: str) -> Union[None, Tuple[Path, int, Tuple[int, int]]]:
+        """
+        Look up a processed costume. Returns the entry's path, the offset of the image
+        in it and the unscaled size, so the image itself can be streamed from the entry.
+        """
+
+        if self.directory is None:
+            return None
+
+        entry = self.directory / key
+        try:
+            with entry.open("rb") as file:
+                width, height = struct.unpack("<II", file.read(self.header_size))
+            os.utime(entry)
+        except (OSError, struct.error):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry, self.header_size, (width, height)
+
+    def store(self, key: str, data: bytes, size: Tuple[int, int]) -> Union[None, Tuple[Path, int]]:
+        """
+        Store a processed costume. Returns the entry's path and the offset of the image in it.
+        """
+
+        if self.directory is None:
+            return None
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            # write beside the entry and move it into place, so concurrent builds never read a partial entry
+            temporary = self.directory / f".{key}.{os.getpid()}.tmp"
+            temporary.write_bytes(struct.pack("<II", *size) + data)
+            os.replace(temporary, self.directory / key)
+
+        except OSError:
+            return None
+
+        return self.directory / key, self.header_size
+
+    def entries(self) -> List[Tuple[Path, os.stat_result]]:
+        if self.directory is None or not self.directory.is_dir():
+            return []
+
+        return [(entry, entry.stat()) for entry in self.directory.iterdir() if not entry.name.startswith(".")]
+
+    def stats(self) -> Tuple[int, int]:
+        """
+        The number of entries and their total size in bytes.
+        """
+
+        entries = self.entries()
+        return len(entries), sum(status.st_size for _, status in entries)
+
+    def prune(self, max_bytes: Union[None, int] = None, protected: Union[None, Set[Path]] = None) -> Tuple[int, int]:
+        """
+        Evict the least recently used entries until the cache fits in max_bytes.
+        Entries in protected are still read from and never evicted. Returns the
+        number of entries and bytes removed.
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = sorted(self.entries(), key=lambda entry: entry[1].st_mtime_ns)
+        total = sum(status.st_size for _, status in entries)
+
+        removed, removed_bytes = 0, 0
+        for entry, status in entries:
+            if total <= max_bytes:
+                break
+
+            if protected is not None and entry in protected:
+                continue
+
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+
+            total -= status.st_size
+            removed += 1
+            removed_bytes += status.st_size
+
+        return removed, removed_bytes
+
+costume_cache = CostumeCache()
+
+def run_cache_command(command: str, max_bytes: int):
+    """
+    Handle 'cache stats' and 'cache prune' from the command line.
+    """
+
+    costume_cache.configure(True, max_bytes)
+    if costume_cache.directory is None:
+        print("No cache directory is available.")
+        return
+
+    if command == "prune":
+        removed, removed_bytes = costume_cache.prune()
+        print(f"Removed {pretty_count(removed, 'costume')} ({removed_bytes / 1024 / 1024:.1f} MiB).")
+
+    entries, total = costume_cache.stats()
+    tables = list(costume_cache.directory.parent.glob("parser-*.lark"))
+
+    print(f"{ANSI.bold}Cache directory:{ANSI.reset} {costume_cache.directory.parent}")
+    print(f"{ANSI.bold}Costumes:{ANSI.reset} {pretty_count(entries, 'entry', 'entries')}, {total / 1024 / 1024:.1f} of {max_bytes / 1024 / 1024:.1f} MiB")
+    print(f"{ANSI.bold}Parser tables:{ANSI.reset} {pretty_count(len(tables), 'file')}, {sum(table.stat().st_size for table in tables) / 1024:.1f} KiB")
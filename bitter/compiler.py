@@ -1,8 +1,12 @@
+from typing import Dict, List, Set, Tuple, Union
+
 import os
 
-from lark import Lark, Tree
+import lark
+
+from lark import Lark, Token, Tree
 
-from lark.exceptions import UnexpectedToken, UnexpectedCharacters
+from lark.exceptions import UnexpectedInput, UnexpectedToken, UnexpectedCharacters, UnexpectedEOF
 
 import sys
 
@@ -12,77 +16,476 @@ import glob
 
 from pathlib import Path
 
-from .sb3.project import Project, Sprite, Stage
+from .sb3.project import Project, Sprite, Stage, Target
 
-from .terminal import pretty_join, error_collector, gSyntaxError
+from .sb3.costumes import Costume, cast_to_costume
 
-def tokenise(parser: Lark, source):
+from .sb3.utils import BLOCK_ID_LENGTH, SCRATCH_ID_LENGTH
+
+from .sb3.passes import DEFAULT_PASSES, PASSES
+
+from .terminal import ANSI, pretty_join, pretty_count, error_collector, gSyntaxError
+
+from .cache import BuildCache, cache_directory, content_key, costume_cache, DEFAULT_COSTUME_CACHE_SIZE
+
+from .trace import tracer
+
+from .memory import memory_profiler
+
+from time import perf_counter
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# tokens which can be inserted to get past a syntax error, in the order they are tried
+REPAIRS = {
+    'SEMICOLON': ';',
+    'RPAR': ')',
+    'RSQB': ']',
+    'RBRACE': '}',
+    'NUMBER': '0'
+}
+
+class SyntaxRecovery:
+    """
+    Collects every syntax error of a source in a single pass of the LALR parser.
+
+    At an unexpected token, up to two tokens which would let the parser take it are
+    inserted, a semicolon first. When a semicolon alone does, the error hints at it.
+    When nothing does, the token is skipped. Only the first error of a line is reported,
+    the rest usually follow from it.
+    """
+
+    def __init__(self, parser: Lark, source: str):
+        self.parser: Lark = parser
+        self.source: str = source
+        self.errors: List[gSyntaxError] = []
+        self.lines: Set[Union[None, int]] = set()
+
+    def describe(self, terminal: str) -> str:
+        pattern = self.parser.get_terminal(terminal).pattern
+        return repr(pattern.value) if pattern.type == 'str' else terminal
+
+    def expected(self, terminals) -> str:
+        return pretty_join(sorted(self.describe(terminal) for terminal in terminals), ' or ')
+
+    def missing_semicolon(self, position: int) -> str:
+        """
+        The hint for a semicolon missing at the end of the input before position.
+        """
+
+        end = position
+        while end > 0 and self.source[end - 1].isspace():
+            end -= 1
+
+        line = self.source.count('\n', 0, end) + 1
+        column = end - (self.source.rfind('\n', 0, end) + 1)
+
+        return error_collector.missing_semicolon(line, column)
+
+    def report(self, exception: UnexpectedInput, semicolon: bool):
+        """
+        Record the error an exception describes, with a hint if a semicolon is missing before it.
+        """
+
+        if isinstance(exception, UnexpectedToken) and exception.token.type != '$END':
+            error = gSyntaxError(
+                f"An unexpected token {repr(exception.token.value)} took the place of {self.expected(exception.expected)}.",
+                None,
+                (exception.line, exception.column)
+            )
+            position = exception.token.start_pos
+
+        elif isinstance(exception, UnexpectedCharacters):
+            error = gSyntaxError(
+                f"An unexpected character {repr(exception.char)} is unrelated to the expected tokens.",
+                None,
+                (exception.line, exception.column)
+            )
+            position = exception.pos_in_stream
+
+        else:
+            assert isinstance(exception, (UnexpectedToken, UnexpectedEOF))
+            error = gSyntaxError(f"The file ended where {self.expected(exception.expected)} was expected.", None, None)
+            position = len(self.source)
+
+        line = error.reference[0] if error.reference is not None else None
+        if line in self.lines:
+            return
+
+        self.lines.add(line)
+        if semicolon:
+            error.solution = self.missing_semicolon(position)
+        self.errors.append(error)
+
+    def repair(self, exception: UnexpectedToken) -> List[str]:
+        """
+        The shortest run of tokens which lets the parser take the unexpected token, or none.
+        """
+
+        candidates = [[first] for first in REPAIRS] + [[first, second] for first in REPAIRS for second in REPAIRS]
+        for inserted in candidates:
+            # reducing builds new nodes, so the attempts can share what was parsed so far
+            attempt = exception.interactive_parser.copy(deepcopy_values=False)
+            try:
+                for terminal in inserted:
+                    attempt.feed_token(Token(terminal, REPAIRS[terminal]))
+                attempt.feed_token(exception.token)
+            except UnexpectedInput:
+                continue
+
+            return inserted
+
+        return []
+
+    def on_error(self, exception: UnexpectedInput) -> bool:
+        if isinstance(exception, UnexpectedCharacters):
+            # the character is skipped, a semicolon in its place wouldn't be inserted
+            self.report(exception, False)
+            return True
+
+        assert isinstance(exception, UnexpectedToken)
+
+        # there is nothing left to resume from
+        if exception.token.type == '$END':
+            self.report(exception, self.repair(exception) == ['SEMICOLON'])
+            return False
+
+        inserted = self.repair(exception)
+        self.report(exception, inserted == ['SEMICOLON'])
+
+        # without a repair the token is skipped
+        if len(inserted) > 0:
+            for terminal in inserted:
+                exception.interactive_parser.feed_token(Token(terminal, REPAIRS[terminal]))
+            exception.interactive_parser.feed_token(exception.token)
+
+        return True
+
+def parse_source(parser: Lark, source) -> Union[None, Tree]:
+    """
+    Parse a source file, reporting every syntax error to the error collector and returning None if it has any.
+    Only the LALR parser can recover from an error, the Earley parser stops at the first one.
+    """
+
+    recovery = SyntaxRecovery(parser, source)
+    tree = None
     try:
-        return parser.parse(source)
-
-    except UnexpectedToken as exception:
-        error_collector.throw(gSyntaxError(
-            f"An unexpected token {repr(exception.token.value)} took the place of {pretty_join(list(exception.expected), ' or ')}.",
-            None, # error_collector.patch(last.line, last.column, last.value, parser),
-            (exception.line, exception.column)
-        ))
-
-    except UnexpectedCharacters as exception:
-        error_collector.throw(gSyntaxError(
-            f"An unexpected character {repr(exception.char)} is unrelated to the expected tokens.",
-            error_collector.patch_before(exception.line - 1, exception.column - 1, parser),
-            (exception.line, exception.column)
-        ))
+        if parser.options.parser == 'lalr':
+            tree = parser.parse(source, on_error=recovery.on_error)
+        else:
+            tree = parser.parse(source)
+
+    except UnexpectedInput as exception:
+        recovery.report(exception, not isinstance(exception, UnexpectedCharacters) and 'SEMICOLON' in getattr(exception, 'expected', ()))
+
+    for error in recovery.errors:
+        error_collector.throw(error)
+
+    return tree if len(recovery.errors) == 0 else None
+
+def tokenise(parser: Lark, source):
+    tree = parse_source(parser, source)
+    if tree is not None:
+        return tree
 
     error_collector.render()
     exit(1)
     
-def compile_code(path, debug_mode: bool):
+PARSER_BACKENDS = {
+    "lalr": {"parser": 'lalr', "lexer": 'contextual'},
+    "earley": {"parser": 'earley', "lexer": 'dynamic'}
+}
+
+def read_grammar() -> str:
     current_dir = os.path.dirname(os.path.abspath(__file__))
     grammar_file = os.path.join(current_dir, "syntax", "grammar.lark")
 
     with open(grammar_file, "r") as file:
-        grammar_data = file.read()
+        return file.read()
+
+def load_parser(backend: str = "lalr", use_cache: bool = True) -> Tuple[Lark, bool]:
+    """
+    Build the parser for the requested backend.
+
+    LALR parse tables are persisted in the cache directory under a key made of the
+    grammar, the backend options and the Lark version, so any change to either
+    rebuilds them. Returns the parser and whether it was loaded from the cache.
+    """
+
+    grammar_data = read_grammar()
+    options = PARSER_BACKENDS[backend]
+
+    directory = cache_directory() if use_cache and options["parser"] == 'lalr' else None
+    if directory is None:
+        return Lark(grammar_data, start='start', **options), False
+
+    key = content_key(grammar_data, repr(sorted(options.items())), lark.__version__)
+    cache_file = directory / f"parser-{key[:32]}.lark"
+    warm = cache_file.is_file()
+
+    return Lark(grammar_data, start='start', cache=str(cache_file), **options), warm
+
+def target_files(path: Path) -> List[Tuple[Path, int]]:
+    """
+    The source files of a project in build order, the stage first and then every
+    sprite, each paired with the layer order of its target.
+    """
 
-    parser = Lark(grammar_data, start='start')
+    files = []
+
+    stage = Path(path / "stage.gs")
+    if stage.is_file():
+        files.append((stage, 0))
+
+    # sorted, as the order glob lists files in differs between file systems
+    sprites = sorted(filter(lambda file: "stage.gs" not in file.name, path.glob("*.gs")))
+    for index, file in enumerate(sprites):
+        files.append((file, index + 1))
+
+    return files
+
+def read_source(file: Path) -> str:
+    with file.open("r") as file_object:
+        return file_object.read()
+
+def create_target(file: Path, tree, path: Path, layer_order: int, passes: Tuple[str, ...] = DEFAULT_PASSES) -> Target:
+    if file.name == "stage.gs":
+        target = Stage(tree, path)
+    else:
+        target = Sprite(file.name, tree, path)
+        target.layer_order = layer_order
+
+    target.source_file = file
+    target.passes = passes
+
+    return target
+
+def read_target(parser: Lark, file: Path, file_data: str, path: Path, layer_order: int, passes: Tuple[str, ...] = DEFAULT_PASSES) -> Target:
+    error_collector.set_file(file)
+    with tracer.span("Tokenise", "parse", file=file.name):
+        tree = tokenise(parser, file_data)
+
+    return create_target(file, tree, path, layer_order, passes)
+
+worker_parser: Union[None, Lark] = None
+
+def initialise_worker(parser_backend: str, use_cache: bool, tracing: bool):
+    global worker_parser
+    if tracing:
+        tracer.enable()
+
+    with tracer.span("Load grammar", "parse", backend=parser_backend):
+        worker_parser, _ = load_parser(parser_backend, use_cache)
+
+def build_target_worker(job: Tuple[Path, int, Path, Tuple[str, ...]]) -> Tuple[Target, List, List[Dict]]:
+    """
+    Parse and lower a single target inside a worker process. Returns the built target
+    together with the diagnostics it raised and the spans it traced. The diagnostics
+    name their file, the main process reads the lines they point at itself.
+    """
+
+    assert worker_parser is not None
+    file, layer_order, path, passes = job
+
+    error_collector.errors = []
+    target = read_target(worker_parser, file, read_source(file), path, layer_order, passes)
+    target.build(worker_parser)
+
+    return target, error_collector.errors, tracer.take()
+
+def build_targets_parallel(files: List[Tuple[Path, int]], path: Path, parser_backend: str, jobs: int, use_cache: bool, passes: Tuple[str, ...] = DEFAULT_PASSES) -> List[Target]:
+    """
+    Build every target in a pool of worker processes.
+    Results and diagnostics are merged in file order, so the project is the same as a serial build's.
+    """
+
+    targets = []
+    work = [(file, layer_order, path, passes) for file, layer_order in files]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initialise_worker, initargs=(parser_backend, use_cache, tracer.enabled)) as executor:
+        for target, errors, events in executor.map(build_target_worker, work):
+            targets.append(target)
+            error_collector.errors += errors
+            tracer.events += events
+
+    return targets
+
+def process_costumes(targets: List[Target]) -> List[Tuple[Path, float]]:
+    """
+    Convert the costumes every target declared while lowering, in a pool of threads.
+
+    Each file is converted once, even if several targets use it, and every target
+    receives its costumes in the order it declared them. Returns the time spent on
+    each file in seconds.
+    """
+
+    pending = [target for target in targets if not target.restored]
+
+    files: Dict[Path, Tuple[Path, Path]] = {}
+    for target in pending:
+        for source in target.costume_sources:
+            files.setdefault((target.working_directory / source).resolve(), (source, target.working_directory))
+
+    def convert(job: Tuple[Path, Path]) -> Tuple[Costume, float]:
+        start = perf_counter()
+        with tracer.span("Convert costume", "assets", file=str(job[0])):
+            costume = cast_to_costume(*job)
+        return costume, perf_counter() - start
+
+    # decoding, resizing and encoding are done in PIL's C code, which releases the GIL
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        converted = dict(zip(files.keys(), executor.map(convert, files.values())))
+
+    for target in pending:
+        target.costumes = [converted[(target.working_directory / source).resolve()][0] for source in target.costume_sources]
+
+    return [(file, elapsed) for file, (_, elapsed) in converted.items()]
+
+def report_costume_times(times: List[Tuple[Path, float]], elapsed: float, verbose: bool):
+    if len(times) == 0:
+        return
+
+    slowest = sorted(times, key=lambda time: time[1], reverse=True)
+    shown = slowest if verbose else slowest[:3]
+
+    print(f"{ANSI.fg_bright_black}Converted {pretty_count(len(times), 'costume')} in {elapsed * 1000:.1f} ms, {sum(time for _, time in times) * 1000:.1f} ms of work. {'Per asset' if verbose else 'Slowest'}: {', '.join(f'{file.name} {time * 1000:.1f} ms' for file, time in shown)}.{ANSI.reset}")
+
+def report_passes(targets: List[Target]):
+    statistics: Dict[str, Tuple[float, int]] = {}
+    for target in targets:
+        for name, (elapsed, nodes) in target.pass_statistics.items():
+            total_elapsed, total_nodes = statistics.get(name, (0.0, 0))
+            statistics[name] = (total_elapsed + elapsed, total_nodes + nodes)
+
+    if len(statistics) == 0:
+        return
+
+    # in pipeline order, a change of 0 nodes still shows the pass ran
+    passes = ', '.join(f"{optimisation.name} {statistics[optimisation.name][0] * 1000:.1f} ms {statistics[optimisation.name][1]:+} nodes" for optimisation in PASSES if optimisation.name in statistics)
+    print(f"{ANSI.fg_bright_black}Optimisation passes: {passes}.{ANSI.reset}")
+
+def report_blocks_removed(targets: List[Target]):
+    removed: Dict[str, int] = {}
+    for target in targets:
+        for optimisation, count in target.blocks_removed.items():
+            removed[optimisation] = removed.get(optimisation, 0) + count
+
+    for optimisation, count in removed.items():
+        print(f"{ANSI.fg_bright_black}{optimisation} removed {pretty_count(count, 'block')}.{ANSI.reset}")
+
+    hoisted = sum(target.invariants_hoisted for target in targets)
+    if hoisted > 0:
+        evaluations = sum(target.evaluations_removed for target in targets)
+        print(f"{ANSI.fg_bright_black}Hoisted {pretty_count(hoisted, 'loop-invariant expression')}, loop iterations evaluate {pretty_count(evaluations, 'block')} fewer.{ANSI.reset}")
+
+    for target in targets:
+        if len(target.removed_procedures) > 0:
+            print(f"{ANSI.fg_bright_black}Removed {pretty_count(len(target.removed_procedures), 'unused procedure')} from {target.name}: {', '.join(target.removed_procedures)}.{ANSI.reset}")
+
+        if len(target.inlined_procedures) > 0:
+            inlined = ', '.join(f"{name} ({count})" for name, count in target.inlined_procedures.items())
+            print(f"{ANSI.fg_bright_black}Inlined {pretty_count(sum(target.inlined_procedures.values()), 'call')} in {target.name}: {inlined}.{ANSI.reset}")
+
+def compile_code(path, debug_mode: bool, parser_backend: str = "lalr", jobs: int = 1, use_cache: bool = True, costume_cache_size: int = DEFAULT_COSTUME_CACHE_SIZE, json_backend: str = "auto", passes: Tuple[str, ...] = DEFAULT_PASSES, trace: Union[None, Path] = None, memprofile: Union[None, Path] = None):
+    if trace is not None:
+        tracer.enable()
+
+    if memprofile is not None:
+        memory_profiler.enable()
+
+    start = perf_counter()
+    with tracer.span("Load grammar", "parse", backend=parser_backend):
+        parser, warm = load_parser(parser_backend, use_cache)
+    memory_profiler.checkpoint("parser")
+    costume_cache.configure(use_cache, costume_cache_size)
+    print(f"{ANSI.fg_bright_black}Parser ready in {(perf_counter() - start) * 1000:.1f} ms ({'warm, from cache' if warm else 'cold'}).{ANSI.reset}")
 
     if path.is_dir():
         project = Project()
 
-        file = Path(path / "stage.gs")
-        if file.is_file():
-            with file.open("r") as file_object:
-                file_data = file_object.read()
-            
-            error_collector.set_source(file_data)
-            tree = tokenise(parser, file_data)
+        build_cache = BuildCache(path, read_grammar(), (f"passes={','.join(passes)}",)) if use_cache else None
+
+        # targets are restored from the build cache where possible, the rest are
+        # built below and slotted back into their place
+        targets: List[Union[None, Target]] = []
+        misses: List[Tuple[int, Path, int, str]] = []
+        for file, layer_order in target_files(path):
+            file_data = read_source(file)
+
+            entry = build_cache.load(file, file_data, path) if build_cache is not None else None
+            if entry is not None:
+                assert build_cache is not None
+                target = create_target(file, None, path, layer_order, passes)
+                target.restore(entry, build_cache.assets(entry))
+                targets.append(target)
+            else:
+                misses.append((len(targets), file, layer_order, file_data))
+                targets.append(None)
+
+        # the memory of worker processes can't be profiled
+        parallel = jobs > 1 and len(misses) > 1 and not memory_profiler.enabled
+        if parallel:
+            built = build_targets_parallel([(file, layer_order) for _, file, layer_order, _ in misses], path, parser_backend, jobs, use_cache, passes)
+        else:
+            built = [read_target(parser, file, file_data, path, layer_order, passes) for _, file, layer_order, file_data in misses]
+            memory_profiler.checkpoint("parse")
 
-            target = Stage(tree, path)
+        for (index, _, _, _), target in zip(misses, built):
+            targets[index] = target
 
+        for target in targets:
+            assert target is not None
             project.add_target(target)
 
-        files = filter(lambda file: "stage.gs" not in file.name, path.glob("*.gs"))
-        for index, file in enumerate(files):
-            with file.open("r") as file_object:
-                file_data = file_object.read()
+        if not parallel:
+            project.build(parser)
+            memory_profiler.checkpoint("lower")
 
-            error_collector.set_source(file_data)
-            tree = tokenise(parser, file_data)
+        start = perf_counter()
+        costume_times = process_costumes(project.targets)
+        report_costume_times(costume_times, perf_counter() - start, debug_mode)
+        memory_profiler.checkpoint("assets")
 
-            target = Sprite(file.name, tree, path)
-            target.layer_order = index + 1
+        if build_cache is not None:
+            print(f"{ANSI.fg_bright_black}Build cache: {pretty_count(build_cache.hits, 'hit')}, {pretty_count(build_cache.misses, 'miss', 'misses')}.{ANSI.reset}")
+            if costume_cache.hits + costume_cache.misses > 0:
+                print(f"{ANSI.fg_bright_black}Costume cache: {pretty_count(costume_cache.hits, 'hit')}, {pretty_count(costume_cache.misses, 'miss', 'misses')}.{ANSI.reset}")
 
-            project.add_target(target)
+            # a target with errors must be rebuilt next time so they are reported again
+            if len(error_collector.errors) == 0:
+                for (_, file, _, file_data), target in zip(misses, built):
+                    build_cache.store(file, file_data, target)
+
+        report_passes(built)
+        report_blocks_removed(built)
 
-        project.build(parser)
+        if len(built) > 0:
+            saved = sum(target.id_savings() for target in built)
+            print(f"{ANSI.fg_bright_black}Compact IDs: {pretty_count(sum(target.ids.issued for target in built), 'ID')} issued, project.json is {saved / 1000:.1f} kB smaller than with {BLOCK_ID_LENGTH} character block IDs and {SCRATCH_ID_LENGTH} character variable IDs.{ANSI.reset}")
         
-        debug, project_zip = project.render(debug_mode)
+        project.json_backend = json_backend
 
         if debug_mode:
-            assert debug is not None
             with open(f"{path.stem}.debug.json", 'w') as file:
-                file.write(debug)
+                file.write(project.render_debug())
 
         if len(error_collector.errors) == 0:
-            with open(f"{path.stem}.sb3", 'wb') as file:
-                file.write(project_zip.getvalue())
+            project.write(Path(f"{path.stem}.sb3"))
+            memory_profiler.checkpoint("render")
+
+        # once every phase is measured, the bookkeeping would count towards the last one
+        memory_profiler.attribute_targets(project.targets, [project, parser])
+        memory_profiler.attribute_assets(project.file_buffer)
+
+        # evict only once the project is written, it may stream costumes out of the cache
+        costume_cache.prune()
+
+    if memprofile is not None:
+        memory_profiler.write(memprofile)
+        for line in memory_profiler.summary():
+            print(f"{ANSI.fg_bright_black}{line}{ANSI.reset}")
+        print(f"{ANSI.fg_bright_black}Wrote the memory report to {memprofile}.{ANSI.reset}")
+
+    if trace is not None:
+        tracer.write(trace)
+        print(f"{ANSI.fg_bright_black}Wrote {pretty_count(len(tracer.events), 'span')} to {trace}.{ANSI.reset}")
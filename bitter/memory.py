@@ -0,0 +1,173 @@
+from typing import Dict, List, Set, Tuple, Union
+
+from pathlib import Path
+
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+import gc
+
+import json
+
+import sys
+
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# objects which belong to the interpreter rather than to the data of a build
+SHARED_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+def peak_rss() -> Union[None, int]:
+    """
+    The most memory the process has had resident, in bytes. None where it can't be read.
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, everything else KiB
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def retained_size(root: object, seen: Set[int]) -> int:
+    """
+    The bytes held by root and everything it references which is not in seen yet.
+    Every object it counts is added to seen, so an object shared by two structures
+    is counted for the first one measured.
+    """
+
+    size = 0
+    pending = [root]
+    while len(pending) > 0:
+        current = pending.pop()
+        if id(current) in seen or isinstance(current, SHARED_TYPES):
+            continue
+
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        pending += gc.get_referents(current)
+
+    return size
+
+class MemoryProfiler:
+    """
+    Records how much memory a build holds at the boundary of each phase, and which
+    structures of which target hold it. tracemalloc slows the build down several
+    times over, so it only runs while profiling.
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.phases: List[Dict] = []
+        self.targets: Dict[str, Dict[str, int]] = {}
+        self.assets: Dict[str, int] = {}
+
+        # the bytes and blocks allocated by each line at the last checkpoint
+        self.lines: Dict[Tuple[str, int], Tuple[int, int]] = {}
+
+        # objects already attributed to a target or asset
+        self.seen: Set[int] = set()
+
+    def enable(self):
+        self.enabled = True
+        tracemalloc.start()
+        self.lines = self.allocations_by_line()
+
+    def allocations_by_line(self) -> Dict[Tuple[str, int], Tuple[int, int]]:
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        # leaving out the profiler's own bookkeeping
+        return {(statistic.traceback[0].filename, statistic.traceback[0].lineno): (statistic.size, statistic.count) for statistic in statistics if statistic.traceback[0].filename not in (__file__, tracemalloc.__file__)}
+
+    def checkpoint(self, phase: str):
+        """
+        Record the memory held at the end of a phase, its peak during the phase and
+        the lines which allocated the most of what it left behind.
+        """
+
+        if not self.enabled:
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        lines = self.allocations_by_line()
+        growth = sorted(((line, size - self.lines.get(line, (0, 0))[0], count - self.lines.get(line, (0, 0))[1]) for line, (size, count) in lines.items()), key=lambda item: -item[1])[:10]
+        self.lines = lines
+
+        self.phases.append({
+            "phase": phase,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "rss_peak_bytes": peak_rss(),
+            "allocations": [
+                {"file": file, "line": line, "bytes": size, "count": count}
+                for (file, line), size, count in growth if size > 0
+            ]
+        })
+
+    def attribute_targets(self, targets: List, exclude: List[object]):
+        """
+        Record the bytes each target's structures retain. Objects in exclude, such as
+        the project or the parser, are never followed into.
+        """
+
+        if not self.enabled:
+            return
+
+        self.seen.update(id(target) for target in targets)
+        self.seen.update(id(target.blocks) for target in targets)
+        self.seen.update(id(excluded) for excluded in exclude)
+
+        for target in targets:
+            self.targets[target.name] = {
+                "tree": retained_size(target.blocks.tree, self.seen),
+                "blocks": retained_size(target.blocks.arena, self.seen),
+                "functions": retained_size([target.blocks.functions, target.blocks.function_mutators], self.seen),
+                "variables": retained_size(target.g_variables, self.seen),
+                "costumes": retained_size(target.costumes, self.seen),
+                "other": retained_size(vars(target), self.seen)
+            }
+
+    def attribute_assets(self, file_buffer: Dict):
+        """
+        Record the bytes each asset of the archive retains, beyond what the targets
+        were already attributed.
+        """
+
+        if not self.enabled:
+            return
+
+        for name, asset in file_buffer.items():
+            self.assets[name] = retained_size(asset, self.seen)
+
+    def write(self, destination: Path):
+        report = {
+            "phases": self.phases,
+            "targets": self.targets,
+            "assets": self.assets
+        }
+
+        with destination.open("w") as file:
+            json.dump(report, file, indent=4)
+
+    def summary(self) -> List[str]:
+        lines = []
+        if len(self.phases) > 0:
+            peak = max(self.phases, key=lambda phase: phase["traced_peak_bytes"])
+            line = f"Peak traced memory {peak['traced_peak_bytes'] / 1e6:.1f} MB during {peak['phase']}"
+            if (rss := self.phases[-1]["rss_peak_bytes"]) is not None:
+                line += f", peak RSS {rss / 1e6:.1f} MB"
+            lines.append(line + ".")
+
+        if len(self.targets) > 0:
+            name, structures = max(self.targets.items(), key=lambda item: sum(item[1].values()))
+            largest = ', '.join(f"{structure} {size / 1e6:.1f} MB" for structure, size in sorted(structures.items(), key=lambda item: -item[1])[:3])
+            lines.append(f"Largest target {name} retains {sum(structures.values()) / 1e6:.1f} MB: {largest}.")
+
+        return lines
+
+memory_profiler = MemoryProfiler()
@@ -1,4 +1,4 @@
-from typing import List, Union, Tuple, TypeAlias, Type, Literal, Callable
+from typing import Iterator, List, Union, Tuple, TypeAlias, Type, Literal, Callable
 
 from lark import Lark, Token, Transformer, Tree
 
@@ -8,26 +8,29 @@ from rich.console import Console
 
 from .primitives import *
 
+from .passes import PassManager
+
+from .traversal import Task, walk
+
+from .utils import BLOCK_ID_LENGTH, SCRATCH_ID_LENGTH
+
 from ..terminal import error_collector, ImpossibleError, UnknownObjectError
 
 class Blocks:
     def __init__(self, tree, target):
-        self.project = {
-            "blocks": {}
-        }
+        # every lowered block in the order it was lowered, each holding the IDs of its
+        # parent and next block
+        self.arena: List[Block] = []
 
         self.tree = tree
 
         self.target = target
 
+        # blocks which are lowered but not yet linked to their siblings, the open nests
+        # are stacked on top of each other and frames holds where each one starts
+        self.block_stack: List[Block] = []
         self.expr_stack: List[Expression] = []
-        self.block_stack = []
-        self.expr_stack = []
-
-        # when nesting, put the current block stack on hold
-        # in the nested stack
-        self.nested_block_stacks: List[List] = []
-        self.nested_expr_stacks: List[List] = []
+        self.frames: List[int] = []
 
         self.console = Console()
 
@@ -36,10 +39,13 @@ class Blocks:
 
     def build(self, parser):
         self.parser = parser
+        self.target.pass_statistics = PassManager(self.target.passes).run(self.tree, self.target)
+
         self.visit_declr(self.tree)
 
     def visit_declr(self, tree: Tree[Tree]):
-        node_has_name: Callable[[Tree[Tree]], bool] = lambda child: child.data == 'declr_function'
+        # an inline function which could not be inlined everywhere is lowered like any other
+        node_has_name: Callable[[Tree[Tree]], bool] = lambda child: child.data in ('declr_function', 'declr_function_inline')
         for function in list(filter(node_has_name, tree.children)):
             self.generate_function(function.children[0], function.children[1:-1], function.children[-1], False)
             
@@ -59,9 +65,9 @@ class Blocks:
                     # this implementation is naive because Lark should catch
                     # all possible errors in lexing
 
-                    uuid = uuid4().hex
+                    uuid = self.target.ids.allocate()
                     block = HatBlock('event_whenflagclicked', {}, {})
-                    block.next_block = self.foster_stack(uuid, node.children[0], None)
+                    block.next_block = walk(self.foster_stack(uuid, node.children[0], None))
                     block.uuid = uuid
 
                     self.block_stack.append(block)
@@ -72,6 +78,9 @@ class Blocks:
                 case 'declr_function_nowarp':
                     pass
 
+                case 'declr_function_inline':
+                    pass
+
                 case _:
                     error_collector.throw(ImpossibleError(
                         f"{repr(node_type)} is not a known declaration.", 
@@ -81,8 +90,8 @@ class Blocks:
         self.order()
 
     def generate_function(self, name, arguments, stack, nowarp):
-        definition_uuid = uuid4().hex
-        prototype_uuid = uuid4().hex
+        definition_uuid = self.target.ids.allocate()
+        prototype_uuid = self.target.ids.allocate()
 
         definition = HatBlock('procedures_definition', {'custom_block': FunctionReferencePrimitive(prototype_uuid)}, {})
         definition.uuid = definition_uuid
@@ -94,12 +103,12 @@ class Blocks:
         prototype.warp = not nowarp
 
         for argument in arguments:
-            prototype.add_argument(argument.value)
+            prototype.add_argument(argument.value, self.target.ids.allocate())
 
             self.nest()
-            argument_block = Block('argument_reporter_string_number', {}, {'VALUE': InputField(argument.value)})
+            argument_block = Block('argument_reporter_string_number', {}, {'VALUE': interned(InputField, argument.value)})
             argument_block.parent = prototype_uuid
-            argument_block.uuid = uuid4().hex
+            argument_block.uuid = self.target.ids.allocate()
             argument_block.shadow = True
             argument_block_reference = argument_block.uuid
             self.block_stack.append(argument_block)
@@ -111,18 +120,20 @@ class Blocks:
         self.order()
 
         self.functions.update({name.value: ['procedures_call', {prototype_id: 'string' for prototype_id in prototype.argumentids}]})
+        proccode = f"{prototype.name}{''.join((' %s' * len(prototype.argumentnames)))}"
         self.function_mutators.update(
             {
                 name: {
-                    'proccode': f"{prototype.name}{''.join((' %s' * len(prototype.argumentnames)))}",
+                    'proccode': proccode,
                     'argumentids': prototype.argumentids,
-                    'warp': prototype.warp
+                    'warp': prototype.warp,
+                    'mutation': call_mutation(proccode, prototype.argumentids, prototype.warp)
                 }   
             }
         )
         self.function_variables = [argument.value for argument in arguments]
 
-        definition.next_block = self.foster_stack(definition_uuid, stack, name.value)
+        definition.next_block = walk(self.foster_stack(definition_uuid, stack, name.value))
         self.block_stack.append(definition)
         self.order()
 
@@ -134,7 +145,7 @@ class Blocks:
                 #TODO: supply proper error
                 print("Please submit a string literal in declr_costumes.")
 
-    def visit_blocks(self, node, namespace):
+    def visit_blocks(self, node, namespace) -> Task[None]:
         for block in node:
             block_type = block.data
             match block_type:
@@ -142,7 +153,7 @@ class Blocks:
                     self.block_stack.append(self.generate_block(block, namespace)) 
 
                 case 'block_if_else':
-                    self.generate_branching_block(
+                    yield self.generate_branching_block(
                         block, 
                         'control_if_else',
                         [(1, 'SUBSTACK', 'substack'), (2, 'SUBSTACK2', 'substack'), (0, 'CONDITION', 'reference')],
@@ -150,7 +161,7 @@ class Blocks:
                     )
 
                 case 'repeat':
-                    self.generate_branching_block(
+                    yield self.generate_branching_block(
                         block, 
                         'control_repeat',
                         [(0, 'TIMES', 'positive_integer'), (1, 'SUBSTACK', 'substack')],
@@ -158,7 +169,7 @@ class Blocks:
                     )
 
                 case 'until':
-                    self.generate_branching_block(
+                    yield self.generate_branching_block(
                         block, 
                         'control_repeat_until',
                         [(0, 'CONDITION', 'reference'), (1, 'SUBSTACK', 'substack')],
@@ -166,7 +177,7 @@ class Blocks:
                     )
 
                 case 'forever':
-                    self.generate_branching_block(
+                    yield self.generate_branching_block(
                         block, 
                         'control_forever',
                         [(0, 'SUBSTACK', 'substack')],
@@ -174,7 +185,7 @@ class Blocks:
                     )
 
                 case 'localvar':
-                    uuid = uuid4().hex
+                    uuid = self.target.ids.allocate()
 
                     variable_name = block.children[0].value
                     variable_uuid = self.target.ensure_variable(variable_name, namespace)
@@ -183,13 +194,13 @@ class Blocks:
                     variable_data = self.foster_expr(uuid, block.children[1], 'string', namespace)
                     variable_data_primitive = validate_arg(variable_data, 'string', self.target)
 
-                    generated = Block('data_setvariableto', {'VALUE': variable_data_primitive}, {'VARIABLE': VariableField(f"{namespace}.{variable_name}", variable_uuid)})
+                    generated = Block('data_setvariableto', {'VALUE': variable_data_primitive}, {'VARIABLE': interned(VariableField, f"{namespace}.{variable_name}", variable_uuid)})
                     generated.uuid = uuid
 
                     self.block_stack.append(generated)
 
                 case 'varset':
-                    uuid = uuid4().hex
+                    uuid = self.target.ids.allocate()
 
                     variable_name = block.children[0].value
                     variable_uuid = self.target.ensure_variable(variable_name, None)
@@ -198,7 +209,7 @@ class Blocks:
                     variable_data = self.foster_expr(uuid, block.children[1], 'string', namespace)
                     variable_data_primitive = validate_arg(variable_data, 'string', self.target)
 
-                    generated = Block('data_setvariableto', {'VALUE': variable_data_primitive}, {'VARIABLE': VariableField(variable_name, variable_uuid)})
+                    generated = Block('data_setvariableto', {'VALUE': variable_data_primitive}, {'VARIABLE': interned(VariableField, variable_name, variable_uuid)})
                     generated.uuid = uuid
 
                     self.block_stack.append(generated)
@@ -209,8 +220,8 @@ class Blocks:
                         None
                     ))
 
-    def generate_branching_block(self, block, opcode: str, input_order: List[Tuple[int, str, str]], namespace):
-        uuid = uuid4().hex
+    def generate_branching_block(self, block, opcode: str, input_order: List[Tuple[int, str, str]], namespace) -> Task[None]:
+        uuid = self.target.ids.allocate()
 
         expressions = block.children
 
@@ -218,7 +229,7 @@ class Blocks:
         for key, name, g_type in input_order:
             expression = expressions[key]
             if g_type == 'substack':
-                reference = self.foster_stack(uuid, expression, namespace)
+                reference = yield self.foster_stack(uuid, expression, namespace)
                 g_type = 'reference'
 
             else:
@@ -233,6 +244,18 @@ class Blocks:
 
         self.block_stack.append(generated)
 
+    def missing_semicolon(self, block_name: Token, expressions: List) -> Union[None, str]:
+        """
+        The hint for a block which took the start of the next statement as its
+        arguments, which is when they begin on a later line than its name.
+        """
+
+        first = next(expressions[0].scan_values(lambda value: isinstance(value, Token)), None) if isinstance(expressions[0], Tree) else expressions[0]
+        if getattr(first, 'line', None) is None or block_name.end_line is None or first.line <= block_name.end_line:
+            return None
+
+        return error_collector.missing_semicolon(block_name.end_line, block_name.end_column - 1)
+
     def generate_block(self, block, namespace) -> Block:
         block_name = block.children[0]
         
@@ -241,7 +264,7 @@ class Blocks:
             expressions = block.children[1:-1]
         lcomment = block.children[-1]
         
-        uuid = uuid4().hex
+        uuid = self.target.ids.allocate()
 
         if block_name in BLOCKS:
             frame = BLOCKS[block_name]
@@ -261,7 +284,7 @@ class Blocks:
 
                 error_collector.throw(UnknownObjectError(
                     f"Block was supplied with too many arguments.\n{block_explanation}",
-                    error_collector.patch_after(block_name.line, block_name.column, block_name.value, self.parser),
+                    self.missing_semicolon(block_name, expressions),
                     (block_name.line, block_name.column)
                 ))
 
@@ -298,7 +321,7 @@ class Blocks:
 
                 error_collector.throw(UnknownObjectError(
                     f"Function was supplied with too many arguments.\n{block_explanation}",
-                    error_collector.patch_after(block_name.line, block_name.column, block_name.value, self.parser),
+                    self.missing_semicolon(block_name, expressions),
                     (block_name.line, block_name.column)
                 ))
 
@@ -330,127 +353,90 @@ class Blocks:
             return block
 
 
-    def generate_operator(self, block, namespace) -> Block:
-        block_name = block.children[0]
-        
-        expressions = []
-        if len(block.children) > 1:
-            expressions = block.children[1:]
-        uuid = uuid4().hex
-
-        if block_name in OPERATORS:
-            frame = OPERATORS[block_name]
-            input_types = list(frame[1].values())
-            input_names = list(frame[1].keys())
-
-            expression_primitives = []
-            for expression, target_type in zip(expressions, input_types):
-                expression_primitives.append(self.foster_expr(uuid, expression, target_type, namespace))
-
-            inputs = {input_names[index]: arg for index, arg in enumerate(validate_args(expression_primitives, input_types, self.target))}
+    def generate_operator(self, expr, uuid, primitives: List, target_type) -> Block:
+        """
+        The block of an operator, once its operands are fostered.
+        """
 
+        match expr.data:
+            case 'eq':
+                operand_1, operand_2 = validate_args(primitives, ('number', 'number'), self.target)
 
-            block = Block(frame[0], inputs, frame[2])
-            block.uuid = uuid
+                block = Block('operator_equals', {'OPERAND1': operand_1, 'OPERAND2': operand_2}, {})
 
-            return block
+            case 'minus': # minus is a special case operator when compiling for example '--1'
+                number_1, number_2 = validate_args((0, *primitives), ('number', 'number'), self.target)
 
-        else:
-            closest_match = difflib.get_close_matches(block_name, OPERATORS.keys(), n=1)
-            error_collector.throw(UnknownObjectError(
-                f"{repr(block_name.value)} is not a known operator.", 
-                f"Did you mean {repr(closest_match[0])}?" if len(closest_match) > 0 else None, 
-                (block_name.line, block_name.column)
-            ))
+                block = Block('operator_subtract', {'NUM1': number_1, 'NUM2': number_2}, {})
 
-            block = Block("error", {}, {})
-            block.uuid = uuid
+            case _:
+                frame = OPERATORS[expr.children[0] if expr.data == 'reporter' else expr.data]
+                input_types = list(frame[1].values())
+                input_names = list(frame[1].keys())
 
-            return block
+                inputs = {input_names[index]: arg for index, arg in enumerate(validate_args(primitives, input_types, self.target))}
 
-    def generate_inline_operator(self, block, namespace) -> Block:
-        block_name = block.data
-        
-        expressions = block.children
-        uuid = uuid4().hex
+                block = Block(frame[0], inputs, frame[2])
 
-        if block_name in OPERATORS:
-            frame = OPERATORS[block_name]
-            input_types = list(frame[1].values())
-            input_names = list(frame[1].keys())
+        block.uuid = uuid
 
-            expression_primitives = []
-            for expression, target_type in zip(expressions, input_types):
-                expression_primitives.append(self.foster_expr(uuid, expression, target_type, namespace))
-                try:
-                    assert expression_primitives[-1] is not None
-                except AssertionError as e:
-                    error_collector.throw(ImpossibleError(
-                        f"Expression primitive in inline operator had None value.",
-                        None, 
-                        None
-                    ))
+        return block
 
-            inputs = {input_names[index]: arg for index, arg in enumerate(validate_args(expression_primitives, input_types, self.target))}
+    def generate_unknown_operator(self, expr, uuid) -> Block:
+        block_name = expr.children[0] if expr.data == 'reporter' else expr.data
 
-            block = Block(frame[0], inputs, frame[2])
-            block.uuid = uuid
+        closest_match = difflib.get_close_matches(block_name, OPERATORS.keys(), n=1)
+        error_collector.throw(UnknownObjectError(
+            f"{repr(block_name.value if expr.data == 'reporter' else block_name)} is not a known operator.", 
+            f"Did you mean {repr(closest_match[0])}?" if len(closest_match) > 0 else None, 
+            (block_name.line, block_name.column) if expr.data == 'reporter' else None
+        ))
 
-            return block
+        block = Block("error", {}, {})
+        block.uuid = uuid
 
-        else:
-            closest_match = difflib.get_close_matches(block_name, OPERATORS.keys(), n=1)
-            error_collector.throw(UnknownObjectError(
-                f"{repr(block_name)} is not a known operator.", 
-                f"Did you mean {repr(closest_match[0])}?" if len(closest_match) > 0 else None, 
-                None
-            ))
+        return block
 
-            block = Block("error", {}, {})
-            block.uuid = uuid
+    def visit_expr(self, expr, parent_uuid, target_type, namespace) -> List[Tuple]:
+        """
+        Lower an expression which takes no operands, or start lowering an operator.
+        Returns the steps which lower the operands of an operator and then the
+        operator itself, the first step last.
+        """
 
-            return block
+        # parentheses are lowered as what they contain
+        while expr.data == 'expr' and isinstance(expr.children[0], Tree):
+            expr = expr.children[0]
 
-    def visit_expr(self, expr, parent_uuid, target_type, namespace):
         expr_type = expr.data
         match expr_type:
             case 'eq':
-                uuid = uuid4().hex
-
-                expr_1 = expr.children[0]
-                expr_2 = expr.children[1]
-
-                expr_1_primitive = self.foster_expr(uuid, expr_1, target_type, namespace)
-                expr_2_primitive = self.foster_expr(uuid, expr_2, target_type, namespace)
-
-                operand_1, operand_2 = validate_args((expr_1_primitive, expr_2_primitive), ('number', 'number'), self.target)
+                uuid = self.target.ids.allocate()
 
-                generated = Block('operator_equals', {'OPERAND1': operand_1, 'OPERAND2': operand_2}, {})
-                generated.uuid = uuid
-
-                self.block_stack.append(generated)
+                operands = [(expr.children[0], target_type), (expr.children[1], target_type)]
 
             case 'lt' | 'gt' | 'add' | 'sub' | 'mul' | 'div' | 'notop':
-                self.block_stack.append(self.generate_inline_operator(expr, namespace))
+                uuid = self.target.ids.allocate()
 
-            case 'minus': # minus is a special case operator when compiling for example '--1'
-                uuid = uuid4().hex
+                if expr_type not in OPERATORS:
+                    self.block_stack.append(self.generate_unknown_operator(expr, uuid))
+                    return []
 
-                expr_2 = expr.children[0]
+                operands = list(zip(expr.children, OPERATORS[expr_type][1].values()))
 
-                expr_1_primitive = 0
-                expr_2_primitive = self.foster_expr(uuid, expr_2, target_type, namespace)
+                # every operand must lower to something
+                steps: List[Tuple] = [('operator', expr, uuid, len(operands), target_type)]
+                for expression, operand_type in reversed(operands):
+                    steps += [('check',), ('foster', uuid, expression, operand_type)]
 
-                number_1, number_2 = validate_args((expr_1_primitive, expr_2_primitive), ('number', 'number'), self.target)
+                return steps
 
-                generated = Block('operator_subtract', {'NUM1': number_1, 'NUM2': number_2}, {})
-                generated.uuid = uuid
+            case 'minus':
+                uuid = self.target.ids.allocate()
 
-                self.block_stack.append(generated)
+                operands = [(expr.children[0], target_type)]
 
             case 'argument':
-                uuid = uuid4().hex
-
                 variable_token = expr.children[0]
                 variable_name = variable_token.value[1:]
 
@@ -459,9 +445,9 @@ class Blocks:
                     this_argument_id = argument_ids[self.function_variables.index(variable_name)]
 
                     self.nest()
-                    argument_block = Block('argument_reporter_string_number', {}, {'VALUE': InputField(variable_name)})
+                    argument_block = Block('argument_reporter_string_number', {}, {'VALUE': interned(InputField, variable_name)})
                     argument_block.parent = parent_uuid
-                    argument_block.uuid = uuid4().hex
+                    argument_block.uuid = self.target.ids.allocate()
                     argument_block_reference = argument_block.uuid
                     self.block_stack.append(argument_block)
                     self.unnest()
@@ -476,14 +462,14 @@ class Blocks:
                         (variable_token.line, variable_token.column)
                     ))
 
-            case 'var':
-                uuid = uuid4().hex
+                return []
 
+            case 'var':
                 variable_token = expr.children[0]
                 variable_name = variable_token.value
 
-                if self.target.local_variable_uuid_if_exists(variable_name, namespace) is not None:
-                    variable_primitive = VariablePrimitive(f"{namespace}.{variable_name}", uuid)
+                if (variable_uuid := self.target.local_variable_uuid_if_exists(variable_name, namespace)) is not None:
+                    variable_primitive = interned(VariablePrimitive, f"{namespace}.{variable_name}", variable_uuid)
                     
                     self.expr_stack.append(variable_primitive)
 
@@ -492,9 +478,9 @@ class Blocks:
                     this_argument_id = argument_ids[self.function_variables.index(variable_name)]
 
                     self.nest()
-                    argument_block = Block('argument_reporter_string_number', {}, {'VALUE': InputField(variable_name)})
+                    argument_block = Block('argument_reporter_string_number', {}, {'VALUE': interned(InputField, variable_name)})
                     argument_block.parent = parent_uuid
-                    argument_block.uuid = uuid4().hex
+                    argument_block.uuid = self.target.ids.allocate()
                     argument_block_reference = argument_block.uuid
                     self.block_stack.append(argument_block)
                     self.unnest()
@@ -504,13 +490,13 @@ class Blocks:
                     self.expr_stack.append(variable_primitive)
 
                 elif namespace is not None:
-                    self.target.ensure_variable(variable_name, None)
-                    variable_primitive = VariablePrimitive(variable_name, uuid)
-                    
+                    variable_uuid = self.target.ensure_variable(variable_name, None)
+                    variable_primitive = interned(VariablePrimitive, variable_name, variable_uuid)
+
                     self.expr_stack.append(variable_primitive)
 
-                elif self.target.global_variable_uuid_if_exists(variable_name) is not None:
-                    variable_primitive = VariablePrimitive(variable_name, uuid)
+                elif (variable_uuid := self.target.global_variable_uuid_if_exists(variable_name)) is not None:
+                    variable_primitive = interned(VariablePrimitive, variable_name, variable_uuid)
                     
                     self.expr_stack.append(variable_primitive)
                 else:
@@ -520,18 +506,25 @@ class Blocks:
                         (variable_token.line, variable_token.column)
                     ))
 
+                return []
+
             case 'reporter':
-                self.block_stack.append(self.generate_operator(expr, namespace)) 
+                uuid = self.target.ids.allocate()
+
+                if expr.children[0] not in OPERATORS:
+                    self.block_stack.append(self.generate_unknown_operator(expr, uuid))
+                    return []
+
+                operands = list(zip(expr.children[1:], OPERATORS[expr.children[0]][1].values()))
 
             case 'expr':
                 data = expr.children[0]
-                if isinstance(data, Tree):
-                    self.visit_expr(data, parent_uuid, target_type, namespace)
-                else:
-                    data_type = data.type
-                    literal = self.extract_literal(data.value, data_type)
-                    assert literal is not None
-                    self.expr_stack.append(literal)
+                data_type = data.type
+                literal = self.extract_literal(data.value, data_type)
+                assert literal is not None
+                self.expr_stack.append(literal)
+
+                return []
 
             case _:
                 error_collector.throw(ImpossibleError(
@@ -539,6 +532,14 @@ class Blocks:
                     None
                 ))
 
+                return []
+
+        steps = [('operator', expr, uuid, len(operands), target_type)]
+        for expression, operand_type in reversed(operands):
+            steps.append(('foster', uuid, expression, operand_type))
+
+        return steps
+
     def extract_literal(self, data, data_type):
         """
         Extract the inner data from a literal.
@@ -568,6 +569,7 @@ class Blocks:
         """
         Either turn an expression into blocks onto the project, or a returned literal.
         Sets the parent of the fostered expression to the uuid supplied to this function.
+        Every operand is fostered in turn by the operator which takes it.
 
         Returns
         -------
@@ -578,39 +580,61 @@ class Blocks:
                 a rendered literal of the child
         """
 
-        # nest
-        self.nested_block_stacks.append(self.block_stack)
-        self.block_stack = []
-        self.nested_expr_stacks.append(self.expr_stack)
-        self.expr_stack = []
+        # the operands of an operator are lowered from a work stack instead of by
+        # recursion, so there is no limit to how deeply expressions nest
+        fostered: List[Union[str, Expression, None]] = []
+        steps: List[Tuple] = [('foster', parent_uuid, expr, target_type)]
+        while len(steps) > 0:
+            step = steps.pop()
+            match step[0]:
+                case 'foster':
+                    _, parent, child, child_type = step
+
+                    # nest
+                    self.nest()
+                    steps.append(('adopt', parent, len(self.expr_stack)))
 
-        # recursively run everything on the child
-        self.visit_expr(expr, parent_uuid, target_type, namespace)
+                    steps += self.visit_expr(child, parent, child_type, namespace)
 
-        # make parent adopt child
-        if len(self.block_stack) > 0:
-            self.block_stack[-1].parent = parent_uuid
+                case 'adopt':
+                    _, parent, expressions = step
 
-            child_reference = ReferencePrimitive(self.block_stack[-1].uuid)
+                    # make parent adopt child
+                    if len(self.block_stack) > self.frames[-1]:
+                        self.block_stack[-1].parent = parent
 
-        elif len(self.expr_stack) > 0:
-            child_reference = self.expr_stack[-1]
+                        child_reference = ReferencePrimitive(self.block_stack[-1].uuid)
 
-        else:
-            child_reference = None
+                    elif len(self.expr_stack) > expressions:
+                        child_reference = self.expr_stack[-1]
 
-        # render child
-        self.order()
+                    else:
+                        child_reference = None
+
+                    # render child and exit nest
+                    del self.expr_stack[expressions:]
+                    self.unnest()
 
-        # exit nest
-        self.block_stack = self.nested_block_stacks[-1]
-        self.nested_block_stacks.pop(-1)
-        self.expr_stack = self.nested_expr_stacks[-1]
-        self.nested_expr_stacks.pop(-1)
+                    fostered.append(child_reference)
 
-        return child_reference
+                case 'check':
+                    if fostered[-1] is None:
+                        error_collector.throw(ImpossibleError(
+                            f"Expression primitive in inline operator had None value.",
+                            None
+                        ))
+
+                case 'operator':
+                    _, operator, uuid, count, operator_type = step
+
+                    primitives = fostered[len(fostered) - count:]
+                    del fostered[len(fostered) - count:]
+
+                    self.block_stack.append(self.generate_operator(operator, uuid, primitives, operator_type))
 
-    def foster_stack(self, parent_uuid, stack, namespace) -> Union[None, str]:
+        return fostered[0]
+
+    def foster_stack(self, parent_uuid, stack, namespace) -> Task[Union[None, str]]:
         """
         Render a stack onto the project.
         Sets the parent of the fostered expression to the uuid supplied to this function.
@@ -622,57 +646,92 @@ class Blocks:
         """
 
         # nest
-        self.nested_block_stacks.append(self.block_stack)
-        self.block_stack = []
+        self.nest()
 
-        # recursively run everything on the child
-        self.visit_blocks(stack.children, namespace)
+        # lower everything on the child, a nested stack waits on the work stack of walk
+        yield self.visit_blocks(stack.children, namespace)
 
         # make parent adopt child
-        if len(self.block_stack) > 0:
-            self.block_stack[0].parent = parent_uuid
+        if len(self.block_stack) > self.frames[-1]:
+            self.block_stack[self.frames[-1]].parent = parent_uuid
 
-            child_reference = self.block_stack[0].uuid
+            child_reference = self.block_stack[self.frames[-1]].uuid
         else:
             child_reference = None
 
-        # render child
-        self.order()
-
-        # exist nest
-        self.block_stack = self.nested_block_stacks[-1]
-        self.nested_block_stacks.pop(-1)
+        # render child and exit nest
+        self.unnest()
 
         return child_reference
 
     def order(self):
-        for succeeding, current, preceeding in zip(
-            [*self.block_stack, None, None][1:-1],
-            [None, *self.block_stack, None][1:-1],
-            [None, None, *self.block_stack][1:-1]
-        ):
+        """
+        Link the blocks of the innermost nest into a stack and move them to the arena.
+        """
+
+        start = self.frames[-1] if len(self.frames) > 0 else 0
+        stack = self.block_stack
+
+        for index in range(start, len(stack)):
+            current = stack[index]
+
             # At this point, some blocks already have their parent flag set, hence
-            # we don't replace the value with None from the Lists above 
-            if preceeding is not None:
-                if current.parent is None:
-                    current.parent = preceeding.uuid
-            if succeeding is not None:
-                if current.next_block is None:
-                    current.next_block = succeeding.uuid
-
-        render = {block.uuid: block.render().get(block.uuid) for block in self.block_stack}
-        self.project['blocks'].update(render)
-        self.block_stack = [] 
+            # they are only linked to their neighbours where they have no link yet
+            if index > start and current.parent is None:
+                current.parent = stack[index - 1].uuid
+            if index + 1 < len(stack) and current.next_block is None:
+                current.next_block = stack[index + 1].uuid
+
+        # blocks are kept as they are and only rendered when the project is emitted
+        self.arena.extend(stack[start:])
+        del stack[start:]
 
     def nest(self):
-        self.nested_block_stacks.append(self.block_stack)
-        self.block_stack = []
+        self.frames.append(len(self.block_stack))
 
     def unnest(self):
         self.order()
-        self.block_stack = self.nested_block_stacks[-1]
-        self.nested_block_stacks.pop(-1)
+        self.frames.pop(-1)
+
+    def records(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Render the blocks one at a time, in the order they were lowered.
+        """
+
+        for block in self.arena:
+            yield block.uuid, block.render()
+
+    def id_references(self) -> Iterator[Tuple[str, int]]:
+        """
+        Every ID the rendered blocks contain, once for each time it is written, with
+        the length the ID had before IDs were compact.
+        """
+
+        for block in self.arena:
+            yield block.uuid, BLOCK_ID_LENGTH
+            yield from ((reference, BLOCK_ID_LENGTH) for reference in (block.parent, block.next_block) if reference is not None)
+
+            for primitive in block.inputs.values():
+                for part in (primitive.front, primitive.back) if isinstance(primitive, Shadow) else (primitive,):
+                    if isinstance(part, (ReferencePrimitive, FunctionReferencePrimitive, BlockPrimitive)):
+                        yield part.uuid, BLOCK_ID_LENGTH
+                    elif isinstance(part, (VariablePrimitive, ListPrimitive)):
+                        yield part.uuid, SCRATCH_ID_LENGTH
+
+            yield from ((field.uuid, SCRATCH_ID_LENGTH) for field in block.fields.values() if isinstance(field, VariableField))
+
+            if isinstance(block, (ProcedurePrototype, ProcedureCall)):
+                # argument IDs name the inputs of the block as well as being listed in its mutation
+                yield from ((uuid, SCRATCH_ID_LENGTH) for uuid in block.argumentids)
+                yield from ((uuid, SCRATCH_ID_LENGTH) for uuid in block.inputs.keys())
+
+    def __getstate__(self):
+        # the tree, parser and console are only needed while lowering, and the
+        # parser and console can't be sent between processes
+        state = self.__dict__.copy()
+        state.update({'tree': None, 'parser': None, 'console': None})
+        return state
 
     def __rich_repr__(self) -> rich.repr.Result:
-        yield "blocks", self.project['blocks']
+        yield "blocks", self.arena
         
\ No newline at end of file
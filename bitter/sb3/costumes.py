@@ -6,23 +6,78 @@ import rich.repr
 
 from hashlib import md5
 
+from pathlib import Path
+
+from typing import Iterator, Tuple, Union
+
+from ..cache import costume_cache
+
+import PIL
+
+class Asset:
+    """
+    The contents of an asset file. Either held in memory, or a region of a file on
+    disk which is only read, in chunks, when it is hashed or written to the project.
+
+    A file in a cache can be evicted by another build before it is read. An asset
+    which knows the costume file and working directory it was converted from
+    converts it again instead.
+    """
+
+    chunk_size: int = 1024 * 1024
+
+    def __init__(self, data: Union[None, bytes] = None, path: Union[None, Path] = None, offset: int = 0, source: Union[None, Tuple[Path, Path]] = None):
+        assert (data is None) != (path is None)
+
+        self.data: Union[None, bytes] = data
+        self.path: Union[None, Path] = path
+        self.offset: int = offset
+        self.source: Union[None, Tuple[Path, Path]] = source
+
+    def chunks(self) -> Iterator[bytes]:
+        if self.data is not None:
+            yield self.data
+            return
+
+        assert self.path is not None
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            if self.source is None:
+                raise
+
+            yield costume_data(*self.source)
+            return
+
+        with file:
+            file.seek(self.offset)
+            while chunk := file.read(self.chunk_size):
+                yield chunk
+
+    def md5(self) -> str:
+        digest = md5()
+        for chunk in self.chunks():
+            digest.update(chunk)
+
+        return digest.hexdigest()
+
 class Costume:
-    def __init__(self, name: str, extension: str, data: bytes):
+    def __init__(self, name: str, extension: str, asset: Asset):
         self.name: str = name
         self.data_format: str = extension
-        self.asset_id: str = md5(data).hexdigest()
+        self.asset_id: str = asset.md5()
         self.md5_ext: str = f"{self.asset_id}.{self.data_format}"
         self.rotation_center_x: int = 0
         self.rotation_center_y: int = 0
 
-        self.data = data
+        self.asset = asset
 
 class Vector(Costume):
-    def __init__(self, name: str, extension: str, data: bytes):
-        super().__init__(name, extension, data)
+    def __init__(self, name: str, extension: str, asset: Asset):
+        super().__init__(name, extension, asset)
         
     def render(self, file_buffer):
-        file_buffer.update({self.md5_ext: self.data})
+        file_buffer.update({self.md5_ext: self.asset})
 
         return {
             "name": self.name,
@@ -42,14 +97,14 @@ class Vector(Costume):
         yield "rotation_center_y", self.rotation_center_y
 
 class Bitmap(Costume):
-    def __init__(self, name: str, extension: str, data: bytes, size):
-        super().__init__(name, extension, data)
+    def __init__(self, name: str, extension: str, asset: Asset, size):
+        super().__init__(name, extension, asset)
         self.bitmap_resolution = 2
         self.rotation_center_x = size[0]
         self.rotation_center_y = size[1]
 
     def render(self, file_buffer):
-        file_buffer.update({self.md5_ext: self.data})
+        file_buffer.update({self.md5_ext: self.asset})
 
         return {
             "name": self.name,
@@ -61,6 +116,39 @@ class Bitmap(Costume):
             "rotationCenterY": self.rotation_center_y
         }
 
+FORMAT_ALIAS = {
+    "jpeg": 'JPEG',
+    "jpg": "JPEG",
+    "png": "PNG",
+    "qoi": "PNG"
+}
+
+def convert_bitmap(file_bytes: bytes, file_type: str) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    Scale a bitmap up for Scratch's bitmap resolution of 2. Returns the processed
+    image and the unscaled size.
+    """
+
+    with Image.open(BytesIO(file_bytes)) as img:
+        unscaled_size = img.size
+        img = img.resize((unscaled_size[0] * 2, unscaled_size[1] * 2), resample=Image.Resampling.NEAREST)
+
+        output_buffer = BytesIO()
+        img.save(output_buffer, FORMAT_ALIAS[file_type], optimize=True)
+
+    return output_buffer.getvalue(), unscaled_size
+
+def costume_data(file: Path, working_directory: Path) -> bytes:
+    """
+    The processed contents of a costume file, converted without the costume cache.
+    """
+
+    file_bytes = (working_directory / file).read_bytes()
+    if file.suffix[1:] in FORMAT_ALIAS:
+        return convert_bitmap(file_bytes, file.suffix[1:])[0]
+
+    return file_bytes
+
 def cast_to_costume(file, working_directory):
     file_type = file.suffix[1:]
     file_name = file.stem
@@ -68,31 +156,43 @@ def cast_to_costume(file, working_directory):
         
     match file_type:
         case 'svg':
-            with open(file_path, 'rb') as file:
-                file_bytes = file.read()
-
-            costume = Vector(file_name, file_type, file_bytes)
+            costume = Vector(file_name, file_type, Asset(path=file_path))
 
         case 'jpeg' | 'jpg' | 'png' | 'qoi':
-            format_alias = {
-                "jpeg": 'JPEG',
-                "jpg": "JPEG",
-                "png": "PNG",
-                "qoi": "PNG"
-            }
-            
-            with Image.open(file_path) as img:
-                unscaled_size = img.size
-                img = img.resize((unscaled_size[0] * 2, unscaled_size[1] * 2), resample=Image.Resampling.NEAREST)
-                
-                output_buffer = BytesIO()
-                img.save(output_buffer, format_alias[file_type], optimize=True)
-
-            costume = Bitmap(file_name, file_type, output_buffer.getvalue(), unscaled_size)
+            file_bytes = file_path.read_bytes()
+
+            # everything which affects the processed image is part of the key
+            key = costume_cache.key(file_bytes, FORMAT_ALIAS[file_type], "scale=2", "resample=nearest", "optimize", PIL.__version__)
+
+            if (cached := costume_cache.load(key)) is not None:
+                entry, offset, unscaled_size = cached
+                asset = Asset(path=entry, offset=offset, source=(file, working_directory))
+
+            else:
+                data, unscaled_size = convert_bitmap(file_bytes, file_type)
+
+                # once the cache has a copy, read it from there when writing so the bytes needn't stay in memory
+                if (stored := costume_cache.store(key, data, unscaled_size)) is not None:
+                    entry, offset = stored
+                    asset = Asset(path=entry, offset=offset, source=(file, working_directory))
+                else:
+                    asset = Asset(data=data)
+
+            costume = Bitmap(file_name, file_type, asset, unscaled_size)
 
         case _:
             #TODO: supply proper error message
             print(f"{repr(file_type)} is not a valid costume file type")
             exit(1)
 
-    return costume
\ No newline at end of file
+    return costume
+
+def restore_costume(metadata, asset: Asset):
+    """
+    Rebuild a costume from the metadata it rendered and its processed asset.
+    """
+
+    if "bitmapResolution" in metadata:
+        return Bitmap(metadata["name"], metadata["dataFormat"], asset, (metadata["rotationCenterX"], metadata["rotationCenterY"]))
+
+    return Vector(metadata["name"], metadata["dataFormat"], asset)
@@ -0,0 +1,111 @@
+from typing import Any, Callable, IO, Iterable, Tuple
+
+import json
+
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKENDS = ["auto", "json", "orjson"]
+
+# outside of strings json is ascii, so every match is a character of a string
+NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+def escape_non_ascii(data: bytes) -> bytes:
+    """
+    Escape the characters orjson writes as UTF-8 the way the json module does.
+    """
+
+    if data.isascii():
+        return data
+
+    return NON_ASCII.sub(lambda match: json.dumps(match.group())[1:-1], data.decode()).encode()
+
+def select_dumps(backend: str = "auto") -> Callable[[Any], bytes]:
+    """
+    The serialiser for single values. orjson is used when requested or, for 'auto',
+    when it is installed. Both produce the same minimal json, with non-ascii
+    characters escaped as the json module does by default.
+    """
+
+    if backend == "orjson" or (backend == "auto" and orjson is not None):
+        assert orjson is not None, "the orjson backend was requested but orjson is not installed"
+        return lambda value: escape_non_ascii(orjson.dumps(value))
+
+    encoder = json.JSONEncoder(separators=(',', ':'), check_circular=False)
+    return lambda value: encoder.encode(value).encode()
+
+class StreamedObject:
+    """
+    A json object whose members are produced one at a time while it is emitted.
+    """
+
+    def __init__(self, members: Iterable[Tuple[str, Any]]):
+        self.members = members
+
+class StreamedArray:
+    """
+    A json array whose items are produced one at a time while it is emitted.
+    """
+
+    def __init__(self, items: Iterable[Any]):
+        self.items = items
+
+class JsonEmitter:
+    """
+    Writes json to a binary stream without building the document in memory first.
+
+    Streamed objects and arrays are walked here, every other value is handed to the
+    serialiser whole. Output is gathered into chunks of buffer_size bytes before it
+    reaches the stream.
+    """
+
+    buffer_size: int = 64 * 1024
+
+    def __init__(self, stream: IO[bytes], backend: str = "auto"):
+        self.stream = stream
+        self.dumps = select_dumps(backend)
+
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data: bytes):
+        self.buffer.append(data)
+        self.buffered += len(data)
+
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.stream.write(b"".join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def emit(self, value: Any):
+        if isinstance(value, StreamedObject):
+            self.write(b"{")
+            for index, (key, member) in enumerate(value.members):
+                if index > 0:
+                    self.write(b",")
+                self.write(self.dumps(key))
+                self.write(b":")
+                self.emit(member)
+            self.write(b"}")
+
+        elif isinstance(value, StreamedArray):
+            self.write(b"[")
+            for index, item in enumerate(value.items):
+                if index > 0:
+                    self.write(b",")
+                self.emit(item)
+            self.write(b"]")
+
+        else:
+            self.write(self.dumps(value))
+
+    def emit_document(self, value: Any):
+        self.emit(value)
+        self.flush()
@@ -0,0 +1,464 @@
+from typing import Dict, List, Tuple, Union
+
+import math
+
+import re
+
+from lark import Token, Tree
+
+from .primitives import BLOCKS, OPERATORS, ErrorPrimitive, cast_arg
+
+from .traversal import Task, walk
+
+Constant = Union[float, str, bool]
+
+# every node which lowers to a block of its own
+LOWERED_NODES = {
+    'block', 'varset', 'localvar', 'block_if', 'block_if_else', 'repeat', 'until', 'forever',
+    'eq', 'lt', 'gt', 'add', 'sub', 'mul', 'div', 'notop', 'minus', 'reporter', 'argument'
+}
+
+# the input types of the operators which are lowered outside of the OPERATORS table
+INPUT_TYPES = {
+    'eq':    ['number', 'number'],
+    'minus': ['number'],
+}
+
+# the inputs which only display their value, so a boolean shows as its text there
+TEXT_INPUTS = {('say', 'MESSAGE')}
+
+JS_NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?|[+-]?Infinity|0[xX][0-9a-fA-F]+|0[oO][0-7]+|0[bB][01]+")
+
+def js_number(text: str) -> float:
+    """
+    Number() of a string as in javascript, NaN when it isn't numeric.
+    """
+
+    text = text.strip()
+    if text == "":
+        return 0.0
+
+    if JS_NUMBER.fullmatch(text) is None:
+        return math.nan
+
+    if text[:2].lower() in ("0x", "0o", "0b"):
+        return float(int(text, 0))
+
+    return float(text.replace("Infinity", "inf"))
+
+def js_string(value: Constant) -> Union[None, str]:
+    """
+    String() of a value as in javascript, None where Python formats it differently.
+    """
+
+    if isinstance(value, bool):
+        return "true" if value else "false"
+
+    if isinstance(value, str):
+        return value
+
+    if not math.isfinite(value):
+        return None
+
+    if value == int(value) and abs(value) < 1e21:
+        # like javascript, repr keeps only the digits which tell the value apart, but
+        # from 1e16 on it writes them with an exponent, which javascript pads with zeros
+        mantissa, _, exponent = repr(abs(value)).partition('e')
+        if exponent == '':
+            return str(int(value))
+
+        digits = mantissa.replace('.', '')
+        return ('-' if value < 0 else '') + digits + '0' * (int(exponent) + 1 - len(digits))
+
+    text = repr(value)
+    return None if 'e' in text else text
+
+def to_number(value: Constant) -> float:
+    """
+    Cast.toNumber of the Scratch VM, anything which isn't a number is 0.
+    """
+
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+
+    number = js_number(value) if isinstance(value, str) else value
+    return 0.0 if math.isnan(number) else number
+
+def to_boolean(value: Constant) -> bool:
+    if isinstance(value, bool):
+        return value
+
+    if isinstance(value, str):
+        return value not in ("", "0") and value.lower() != "false"
+
+    return value != 0 and not math.isnan(value)
+
+def compare(first: Constant, second: Constant) -> Union[None, float]:
+    """
+    Cast.compare of the Scratch VM, None where the result depends on the locale.
+    """
+
+    numbers = []
+    for value in (first, second):
+        number = (1.0 if value else 0.0) if isinstance(value, bool) else js_number(value) if isinstance(value, str) else value
+        if isinstance(value, str) and value.strip() == "":
+            number = math.nan
+        numbers.append(number)
+
+    if any(math.isnan(number) for number in numbers):
+        texts = [js_string(value) for value in (first, second)]
+        if any(text is None or not text.isascii() for text in texts):
+            return None
+
+        first_text, second_text = (text.lower() for text in texts)
+        return (first_text > second_text) - (first_text < second_text)
+
+    if numbers[0] == numbers[1]:
+        return 0
+
+    return numbers[0] - numbers[1]
+
+def js_round(value: float) -> float:
+    return math.floor(value + 0.5)
+
+def token_value(token: Token) -> Union[None, Constant]:
+    match token.type:
+        case 'NUMBER' | 'FLOAT':
+            return float(token.value)
+        case 'STRING':
+            return token.value[1:-1]
+
+    return None
+
+def literal(value: Constant, input_type: str) -> Union[None, Tree]:
+    """
+    A literal node of the value, if it is accepted by an input of input_type.
+    Only a 'text' input, which displays what it is given, reads a boolean the same
+    as its text. Anywhere else the VM casts a boolean block to a number or keeps it
+    as it is, so it can't be replaced.
+    """
+
+    if isinstance(value, bool):
+        if input_type != 'text':
+            return None
+        return Tree('expr', [Token('STRING', f"\"{js_string(value)}\"")])
+
+    if isinstance(value, str):
+        return Tree('expr', [Token('STRING', f"\"{value}\"")]) if input_type in ('string', 'text', 'value') else None
+
+    text = js_string(value)
+    if text is None:
+        return None
+
+    integral = value == int(value)
+    accepted = {
+        'number': True,
+        'string': True,
+        'text': True,
+        'value': True,
+        'positive_number': value >= 0,
+        'integer': integral,
+        'positive_integer': integral and value >= 0,
+        'angle': integral and 0 <= value <= 360
+    }
+    if not accepted.get(input_type, False):
+        return None
+
+    return Tree('expr', [Token('FLOAT' if '.' in text else 'NUMBER', text)])
+
+def operand_types(expression: Tree) -> List[str]:
+    """
+    The input types lowering checks the operands of an operator against.
+    """
+
+    if expression.data in INPUT_TYPES:
+        return INPUT_TYPES[expression.data]
+
+    if expression.data == 'reporter':
+        return list(OPERATORS[expression.children[0]][1].values()) if expression.children[0] in OPERATORS else []
+
+    return list(OPERATORS[expression.data][1].values()) if expression.data in OPERATORS else []
+
+def accepted(operand: Union[None, Tree, Token], input_type: str) -> bool:
+    """
+    Whether lowering accepts an operand for an input of input_type. It only checks
+    literals, an operator is always accepted whatever it reports.
+    """
+
+    while isinstance(operand, Tree) and operand.data == 'expr' and isinstance(operand.children[0], Tree):
+        operand = operand.children[0]
+
+    if not isinstance(operand, Tree) or operand.data != 'expr':
+        return True
+
+    # a boolean input only takes a block
+    if input_type == 'block':
+        return False
+
+    # the text of the literal as lowering extracts it
+    token = operand.children[0]
+    text = token.value.strip("\"") if token.type == 'STRING' else token.value
+
+    return not isinstance(cast_arg(text, input_type, None), ErrorPrimitive)
+
+def count_blocks(tree: Tree) -> int:
+    """
+    How many blocks a subtree lowers to.
+    """
+
+    return sum(1 for subtree in tree.iter_subtrees_topdown() if subtree.data in LOWERED_NODES)
+
+class ConstantFolder:
+    """
+    Evaluates the operators of a target whose inputs are all literals at compile time,
+    as the Scratch VM would, and replaces them with their result. An if whose condition
+    is constant is replaced by the branch it takes, an until by nothing or a forever.
+    """
+
+    def __init__(self, tree: Tree):
+        self.tree: Tree = tree
+        self.removed: int = 0
+
+        self.functions: Dict[str, int] = {
+            declaration.children[0].value: len([argument for argument in declaration.children[1:-1] if argument is not None])
+            for declaration in tree.children
+            if declaration.data in ('declr_function', 'declr_function_nowarp', 'declr_function_inline')
+        }
+
+        # keyed by id, each value is kept with its node so the id can't be reused
+        self.values: Dict[int, Tuple[Tree, Union[None, Constant]]] = {}
+
+    def fold(self) -> int:
+        for declaration in self.tree.children:
+            if declaration.data in ('declr_onflag', 'declr_function', 'declr_function_nowarp', 'declr_function_inline'):
+                walk(self.fold_stack(declaration.children[-1]))
+
+        return self.removed
+
+    def fold_stack(self, stack: Tree, last: bool = True) -> Task[None]:
+        """
+        Fold the statements of a stack in place. last tells whether the stack ends the
+        script, which a branch spliced into its parent stack might not.
+        """
+
+        statements = []
+        for index, statement in enumerate(stack.children):
+            statements += yield self.fold_statement(statement, last and index == len(stack.children) - 1)
+
+        stack.children = statements
+
+    def fold_statement(self, statement: Tree, last: bool) -> Task[List[Tree]]:
+        """
+        The statements a statement is replaced by.
+        """
+
+        children = statement.children
+        match statement.data:
+            case 'block':
+                name = children[0]
+                if name in BLOCKS:
+                    input_types = ['text' if (name, input_name) in TEXT_INPUTS else input_type for input_name, input_type in BLOCKS[name][1].items()]
+                elif name in self.functions:
+                    input_types = ['value'] * self.functions[name]
+                else:
+                    return [statement]
+
+                for index, input_type in zip(range(1, len(children) - 1), input_types):
+                    children[index] = self.fold_input(children[index], input_type)
+
+            case 'varset' | 'localvar':
+                children[1] = self.fold_input(children[1], 'value')
+
+            case 'repeat':
+                children[0] = self.fold_input(children[0], 'positive_integer')
+                yield self.fold_stack(children[1])
+
+            case 'forever':
+                yield self.fold_stack(children[0])
+
+            case 'block_if' | 'block_if_else':
+                condition = self.evaluate(children[0])
+                if condition is None:
+                    children[0] = self.fold_input(children[0], 'reference')
+                    for stack in children[1:]:
+                        yield self.fold_stack(stack)
+                    return [statement]
+
+                taken = children[1] if to_boolean(condition) else children[2] if len(children) > 2 else None
+                self.removed += count_blocks(statement) - (count_blocks(taken) if taken is not None else 0)
+
+                if taken is None:
+                    return []
+
+                yield self.fold_stack(taken, last)
+                return taken.children
+
+            case 'until':
+                condition = self.evaluate(children[0])
+                if condition is None:
+                    children[0] = self.fold_input(children[0], 'reference')
+                    yield self.fold_stack(children[1])
+                    return [statement]
+
+                if to_boolean(condition):
+                    # the loop is left before its body first runs
+                    self.removed += count_blocks(statement)
+                    return []
+
+                yield self.fold_stack(children[1])
+
+                # a forever can't have blocks after it, so an endless until is only
+                # replaced at the end of a stack
+                if not last:
+                    return [statement]
+
+                self.removed += count_blocks(children[0])
+                return [Tree('forever', [children[1]])]
+
+        return [statement]
+
+    def fold_input(self, expression: Union[None, Tree], input_type: str) -> Union[None, Tree]:
+        """
+        The expression with its constant parts folded, as it is used for an input of input_type.
+        """
+
+        # the expression is held like any operand, so it is replaced the same way
+        holder = Tree('input', [expression])
+
+        pending = [(holder, 0, input_type)]
+        while len(pending) > 0:
+            parent, index, input_type = pending.pop()
+
+            expression = parent.children[index]
+            if not isinstance(expression, Tree) or self.is_literal(expression):
+                continue
+
+            value = self.evaluate(expression)
+            if value is not None and (folded := literal(value, input_type)) is not None:
+                self.removed += count_blocks(expression)
+                parent.children[index] = folded
+                continue
+
+            children = expression.children
+            match expression.data:
+                case 'expr':
+                    pending.append((expression, 0, input_type))
+
+                case 'reporter':
+                    if children[0] in OPERATORS:
+                        for operand, operand_type in enumerate(OPERATORS[children[0]][1].values(), 1):
+                            if operand < len(children):
+                                pending.append((expression, operand, operand_type))
+
+                case operator if operator in INPUT_TYPES or operator in OPERATORS:
+                    operand_types = INPUT_TYPES[operator] if operator in INPUT_TYPES else list(OPERATORS[operator][1].values())
+                    for operand, operand_type in enumerate(operand_types):
+                        pending.append((expression, operand, operand_type))
+
+        return holder.children[0]
+
+    def is_literal(self, expression: Tree) -> bool:
+        return expression.data == 'expr' and isinstance(expression.children[0], Token)
+
+    def evaluate(self, expression: Union[None, Tree, Token]) -> Union[None, Constant]:
+        """
+        The value of an expression built only from literals, None if it isn't one.
+        """
+
+        if not isinstance(expression, Tree):
+            return None
+
+        key = id(expression)
+        if key not in self.values:
+            # the operands which aren't evaluated yet, operators before their operands
+            unevaluated = []
+            pending = [expression]
+            while len(pending) > 0:
+                node = pending.pop()
+                if id(node) not in self.values:
+                    unevaluated.append(node)
+                    pending += [child for child in node.children if isinstance(child, Tree)]
+
+            # so that computing an operator never recurses
+            for node in reversed(unevaluated):
+                self.values[id(node)] = (node, self.compute(node))
+
+        return self.values[key][1]
+
+    def compute(self, expression: Tree) -> Union[None, Constant]:
+        """
+        The value of an expression whose operands are already evaluated.
+        """
+
+        children = expression.children
+
+        # an operator lowering would reject must not be folded away, or the
+        # optimisation level would decide whether a program compiles
+        operands = children[1:] if expression.data == 'reporter' else children
+        if not all(accepted(operand, input_type) for operand, input_type in zip(operands, operand_types(expression))):
+            return None
+
+        match expression.data:
+            case 'expr':
+                data = children[0]
+                if isinstance(data, Tree):
+                    return self.evaluate(data)
+
+                return token_value(data)
+
+            case 'add' | 'sub' | 'mul' | 'div':
+                operands = [self.evaluate(child) for child in children]
+                if None in operands:
+                    return None
+
+                first, second = (to_number(operand) for operand in operands)
+                match expression.data:
+                    case 'add':
+                        result = first + second
+                    case 'sub':
+                        result = first - second
+                    case 'mul':
+                        result = first * second
+                    case 'div':
+                        # Infinity and NaN have no literal
+                        if second == 0:
+                            return None
+                        result = first / second
+
+                return result if math.isfinite(result) else None
+
+            case 'minus':
+                operand = self.evaluate(children[0])
+                return None if operand is None else 0 - to_number(operand)
+
+            case 'eq' | 'lt' | 'gt':
+                operands = [self.evaluate(child) for child in children]
+                if None in operands or (difference := compare(*operands)) is None:
+                    return None
+
+                match expression.data:
+                    case 'eq':
+                        return difference == 0
+                    case 'lt':
+                        return difference < 0
+                    case 'gt':
+                        return difference > 0
+
+            case 'notop':
+                # not only takes a boolean block, so its operand must have been an operator
+                operand = self.evaluate(children[0])
+                return (not operand) if isinstance(operand, bool) else None
+
+            case 'reporter':
+                if children[0] == 'sin' and len(children) == 2 and (operand := self.evaluate(children[1])) is not None:
+                    return js_round(math.sin(math.pi * to_number(operand) / 180) * 1e10) / 1e10
+
+        return None
+
+def fold_constants(tree: Tree) -> int:
+    """
+    Fold the constant expressions and branches of a target's tree in place.
+    Returns the number of blocks which no longer have to be lowered.
+    """
+
+    return ConstantFolder(tree).fold()
@@ -0,0 +1,243 @@
+from typing import Dict, List, Set, Tuple, Union
+
+from lark import Token, Tree
+
+from .folding import count_blocks
+
+from .procedures import FUNCTION_DECLARATIONS, declared_functions, called_functions
+
+from .traversal import Shapes, Task, walk
+
+LOOPS = ('repeat', 'until', 'forever')
+
+# operators worth a temporary of their own, the boolean ones aren't as a variable
+# can't be put into a condition
+HOISTABLE = {'add', 'sub', 'mul', 'div', 'minus'}
+
+# the same operators, which only read their operands
+PURE = {'add', 'sub', 'mul', 'div', 'minus', 'eq', 'lt', 'gt', 'notop'}
+
+PURE_REPORTERS = {'sin'}
+
+class Function:
+    """
+    A function or hat script, and how a variable read in it resolves. A hat
+    script has no name, its locals are globals.
+    """
+
+    def __init__(self, declaration: Tree):
+        is_function = declaration.data in FUNCTION_DECLARATIONS
+        self.name: Union[None, str] = declaration.children[0].value if is_function else None
+        self.parameters: List[str] = [argument.value for argument in declaration.children[1:-1] if argument is not None] if is_function else []
+        self.local_names: Set[str] = {node.children[0].value for node in declaration.children[-1].iter_subtrees_topdown() if node.data == 'localvar'}
+
+        # how many temporaries the loops around the current one hold, a temporary
+        # is only read in its own loop so loops after it reuse its name
+        self.live: int = 0
+
+    def variables(self, name: str) -> Set[str]:
+        """
+        The variables a read of name could resolve to, as they are written.
+        A local read before its declaration resolves to the global of the same name.
+        """
+
+        if name in self.local_names:
+            return {self.local(name), name}
+
+        if name in self.parameters:
+            return set()
+
+        return {name}
+
+    def local(self, name: str) -> str:
+        """
+        The variable a local of this function is declared as.
+        """
+
+        return name if self.name is None else f"{self.name}.{name}"
+
+    def temporary(self, index: int) -> str:
+        """
+        The variable the index'th temporary of this function is declared as.
+        """
+
+        return self.local(f"#{index}")
+
+def written_variables(node: Tree, function: Function) -> Set[str]:
+    """
+    The variables the statements below node set, as a read of them resolves.
+    """
+
+    written = set()
+    for subtree in node.iter_subtrees_topdown():
+        match subtree.data:
+            case 'varset':
+                written.add(subtree.children[0].value)
+            case 'localvar':
+                written.add(function.local(subtree.children[0].value))
+
+    return written
+
+class LoopInvariantHoister:
+    """
+    Moves the operators in a loop which give the same result on every iteration
+    into a temporary variable set before the loop. An operator is invariant when it
+    only reads literals, arguments and variables nothing in the loop writes to,
+    including the functions the loop calls.
+
+    Only loops of functions which run without screen refresh are hoisted from, as
+    no other script can change a variable or temporary between two iterations there.
+    """
+
+    def __init__(self, tree: Tree):
+        self.tree: Tree = tree
+        self.functions: Dict[str, Tree] = declared_functions(tree)
+
+        # the functions each function calls, directly or through the functions it calls
+        self.reachable: Dict[str, Set[str]] = {name: called_functions(declaration.children[-1], self.functions) for name, declaration in self.functions.items()}
+        self.writes: Dict[str, Set[str]] = {name: written_variables(declaration.children[-1], Function(declaration)) for name, declaration in self.functions.items()}
+        self.close_over_calls()
+
+        self.hoisted: int = 0
+        self.evaluations: int = 0
+        self.temporaries: List[str] = []
+
+    def close_over_calls(self):
+        """
+        Extend the functions and variables each function reaches with those of the functions it calls.
+        """
+
+        changed = True
+        while changed:
+            changed = False
+            for name in self.functions:
+                for callee in list(self.reachable[name]):
+                    if not (self.reachable[callee] <= self.reachable[name] and self.writes[callee] <= self.writes[name]):
+                        self.reachable[name] |= self.reachable[callee]
+                        self.writes[name] |= self.writes[callee]
+                        changed = True
+
+    def hoist(self) -> Tuple[int, int, List[str]]:
+        for declaration in self.tree.children:
+            if declaration.data in ('declr_function', 'declr_function_inline'):
+                walk(self.hoist_stack(declaration.children[-1], Function(declaration)))
+
+        return self.hoisted, self.evaluations, self.temporaries
+
+    def hoist_stack(self, stack: Tree, function: Function) -> Task[None]:
+        """
+        Hoist from the loops of a stack, the outer loops first so that an operator
+        is moved out of as many loops as it is invariant in.
+        """
+
+        statements = []
+        for statement in stack.children:
+            live = function.live
+            if statement.data in LOOPS:
+                hoisted = self.hoist_loop(statement, function)
+                function.live += len(hoisted)
+                statements += hoisted
+            statements.append(statement)
+
+            for child in statement.children:
+                if isinstance(child, Tree) and child.data == 'stack':
+                    yield self.hoist_stack(child, function)
+
+            function.live = live
+
+        stack.children = statements
+
+    def hoist_loop(self, loop: Tree, function: Function) -> List[Tree]:
+        """
+        Replace the invariant operators of a loop with temporaries, and return the
+        statements which set them.
+        """
+
+        written = written_variables(loop, function)
+        for subtree in loop.iter_subtrees_topdown():
+            if subtree.data == 'block' and subtree.children[0] in self.functions:
+                # a recursive call would set the temporaries of this loop again
+                if subtree.children[0] == function.name or function.name in self.reachable[subtree.children[0]]:
+                    return []
+
+                written |= self.writes[subtree.children[0]]
+
+        # the times of a repeat are only evaluated once
+        parts = loop.children[1:] if loop.data == 'repeat' else loop.children
+
+        shapes = Shapes()
+        occurrences: Dict[int, List[Tuple[Tree, int]]] = {}
+        for part in parts:
+            self.collect(part, written, function, shapes, occurrences)
+
+        statements = []
+        for places in occurrences.values():
+            temporary = function.temporary(function.live + len(statements) + 1)
+            if temporary not in self.temporaries:
+                self.temporaries.append(temporary)
+
+            first_parent, first_index = places[0]
+            statements.append(Tree('varset', [Token('NAME', temporary), first_parent.children[first_index]]))
+
+            for parent, index in places:
+                self.evaluations += count_blocks(parent.children[index])
+                parent.children[index] = Tree('var', [Token('NAME', temporary)])
+
+            self.hoisted += 1
+
+        return statements
+
+    def collect(self, node: Tree, written: Set[str], function: Function, shapes: Shapes, occurrences: Dict[int, List[Tuple[Tree, int]]]):
+        """
+        Find the largest invariant operators below node, grouped by what they compute.
+        """
+
+        invariant = self.invariants(node, written, function)
+
+        pending = [(node, index, child) for index, child in reversed(list(enumerate(node.children))) if isinstance(child, Tree)]
+        while len(pending) > 0:
+            parent, index, child = pending.pop()
+            if child.data in HOISTABLE and invariant[id(child)]:
+                occurrences.setdefault(shapes.number(child), []).append((parent, index))
+            else:
+                pending += [(child, index, grandchild) for index, grandchild in reversed(list(enumerate(child.children))) if isinstance(grandchild, Tree)]
+
+    def invariants(self, node: Tree, written: Set[str], function: Function) -> Dict[int, bool]:
+        """
+        Whether each subtree of node gives the same result on every iteration, keyed by id.
+        """
+
+        invariant: Dict[int, bool] = {}
+        is_invariant = lambda child: not isinstance(child, Tree) or invariant[id(child)]
+
+        # operands before the operators which read them
+        for subtree in node.iter_subtrees():
+            match subtree.data:
+                case 'expr':
+                    invariant[id(subtree)] = is_invariant(subtree.children[0])
+
+                case 'argument':
+                    invariant[id(subtree)] = True
+
+                case 'var':
+                    invariant[id(subtree)] = function.variables(subtree.children[0].value).isdisjoint(written)
+
+                case 'reporter':
+                    invariant[id(subtree)] = subtree.children[0] in PURE_REPORTERS and all(is_invariant(child) for child in subtree.children[1:])
+
+                case operator if operator in PURE:
+                    invariant[id(subtree)] = all(is_invariant(child) for child in subtree.children)
+
+                case _:
+                    invariant[id(subtree)] = False
+
+        return invariant
+
+def hoist_loop_invariants(tree: Tree) -> Tuple[int, int, List[str]]:
+    """
+    Hoist the invariant operators out of the loops of a target's tree in place.
+    Returns how many operators were hoisted, how many fewer blocks a loop iteration
+    evaluates, and the temporaries which hold them.
+    """
+
+    return LoopInvariantHoister(tree).hoist()
@@ -0,0 +1,394 @@
+from typing import Dict, Iterator, List, Set, Tuple, Union
+
+from lark import Token, Tree
+
+from .folding import INPUT_TYPES, count_blocks, literal, token_value
+
+from .primitives import BLOCKS, OPERATORS
+
+from .procedures import FUNCTION_DECLARATIONS, declared_functions
+
+from .traversal import Task, copy_tree, walk
+
+# functions whose body lowers to at most this many blocks are inlined wherever they are called
+INLINE_SIZE = 12
+
+LOOPS = ('repeat', 'until', 'forever')
+
+# blocks which give other scripts a turn even outside of a loop
+YIELDING_BLOCKS = ('wait', 'glide')
+
+class Scope:
+    """
+    The script or function a call is inlined into: whether it runs without screen
+    refresh, and the names a variable read there resolves to before a global.
+    """
+
+    def __init__(self, warp: bool, shadowing: Set[str]):
+        self.warp: bool = warp
+        self.shadowing: Set[str] = shadowing
+
+class Callee:
+    """
+    What inlining a function needs to know about its body, found once it is final.
+    """
+
+    def __init__(self, declaration: Tree, local_names: Set[str]):
+        self.declaration: Tree = declaration
+        self.stack: Tree = declaration.children[-1]
+        self.parameters: List[str] = [argument.value for argument in declaration.children[1:-1] if argument is not None]
+        self.warp: bool = declaration.data != 'declr_function_nowarp'
+        self.local_names: Set[str] = local_names
+
+        # the globals the body reads, and the input types each argument is read as
+        self.reads: Set[str] = set()
+        self.input_types: Dict[str, Set[str]] = {}
+
+        self.yields: bool = False
+        self.inlinable: bool = False
+
+class ProcedureInliner:
+    """
+    Replaces calls to small functions, functions called once and `inline def`
+    functions with a copy of the function's body. Arguments are substituted where
+    they are read, through a temporary variable unless they are literals every
+    input they reach accepts. The locals of the function keep their namespaced
+    variables, so an inlined body reads and writes the same variables a call would.
+
+    A call is only inlined where that can't change when other scripts run: a
+    function with screen refresh turned off is only inlined into a script with
+    screen refresh if its body never yields.
+    """
+
+    def __init__(self, tree: Tree):
+        self.tree: Tree = tree
+        self.functions: Dict[str, Tree] = declared_functions(tree)
+
+        names = [declaration.children[0].value for declaration in tree.children if declaration.data in FUNCTION_DECLARATIONS]
+        self.duplicates: Set[str] = {name for name in set(names) if names.count(name) > 1}
+
+        # the functions each function declaration calls, keyed by the id of the declaration
+        self.calls: Dict[int, Set[str]] = {}
+        self.call_sites: Dict[str, int] = {}
+        for declaration in tree.children:
+            calls = self.calls.setdefault(id(declaration), set())
+            for subtree in declaration.iter_subtrees_topdown():
+                if subtree.data == 'block' and subtree.children[0] in self.functions:
+                    calls.add(subtree.children[0].value)
+                    self.call_sites[subtree.children[0].value] = self.call_sites.get(subtree.children[0].value, 0) + 1
+
+        self.recursive: Set[str] = self.recursive_functions()
+
+        self.expanded: Set[int] = set()
+        self.locals: Dict[int, Set[str]] = {}
+        self.callees: Dict[str, Callee] = {}
+
+        self.inlined: Dict[str, int] = {}
+
+        # lowering a function declares the globals it reads, inlined copies of it still need them
+        self.globals: Set[str] = set()
+
+    def recursive_functions(self) -> Set[str]:
+        calls = {name: self.calls[id(declaration)] for name, declaration in self.functions.items()}
+
+        recursive = set()
+        for name in calls:
+            seen: Set[str] = set()
+            pending = list(calls[name])
+            while len(pending) > 0:
+                callee = pending.pop()
+                if callee == name:
+                    recursive.add(name)
+                    break
+
+                if callee not in seen:
+                    seen.add(callee)
+                    pending += calls[callee]
+
+        return recursive
+
+    def inline(self) -> Dict[str, int]:
+        for declaration in self.tree.children:
+            if declaration.data in FUNCTION_DECLARATIONS:
+                walk(self.expand_declaration(declaration))
+
+        for declaration in self.tree.children:
+            if declaration.data not in FUNCTION_DECLARATIONS and len(declaration.children) > 0 and isinstance(declaration.children[-1], Tree):
+                walk(self.expand_stack(declaration.children[-1], Scope(False, set())))
+
+        return self.inlined
+
+    def expand_declaration(self, declaration: Tree) -> Task[None]:
+        """
+        Inline the calls in a function, after the calls in the functions it calls,
+        so that a body is only copied once it is complete.
+        """
+
+        if id(declaration) in self.expanded:
+            return
+        self.expanded.add(id(declaration))
+
+        stack = declaration.children[-1]
+        for callee in self.calls[id(declaration)]:
+            yield self.expand_declaration(self.functions[callee])
+
+        arguments = [argument.value for argument in declaration.children[1:-1] if argument is not None]
+        yield self.expand_stack(stack, Scope(declaration.data != 'declr_function_nowarp', self.local_names(stack) | set(arguments)))
+
+    def expand_stack(self, stack: Tree, scope: Scope) -> Task[None]:
+        statements = []
+        for statement in stack.children:
+            if statement.data == 'block' and (inlined := (yield self.expand_call(statement, scope))) is not None:
+                statements += inlined
+                continue
+
+            for child in statement.children:
+                if isinstance(child, Tree) and child.data == 'stack':
+                    yield self.expand_stack(child, scope)
+
+            statements.append(statement)
+
+        stack.children = statements
+
+    def expand_call(self, call: Tree, scope: Scope) -> Task[Union[None, List[Tree]]]:
+        """
+        The statements a call is replaced by, None if it is kept as a call.
+        """
+
+        name = call.children[0]
+        if name not in self.functions or not (callee := self.callee(name.value)).inlinable:
+            return None
+
+        values = [value for value in call.children[1:-1] if value is not None]
+        if len(values) != len(callee.parameters):
+            return None
+
+        # a global the body reads would resolve to a local or argument of the caller instead
+        if not callee.reads.isdisjoint(scope.shadowing):
+            return None
+
+        temporaries = [
+            parameter for parameter, value in zip(callee.parameters, values)
+            if parameter in callee.input_types and not self.is_substitutable(value, callee.input_types[parameter])
+        ]
+
+        # without screen refresh a body runs to its end before any other script, a
+        # temporary is only safe to share between call sites under the same promise
+        if not scope.warp and callee.yields and (callee.warp or len(temporaries) > 0):
+            return None
+
+        statements = []
+        replacements: Dict[str, Tree] = {}
+        for parameter, value in zip(callee.parameters, values):
+            if parameter in temporaries:
+                temporary = Token.new_borrow_pos('NAME', f"{name}.${parameter}", name)
+                statements.append(Tree('varset', [temporary, value]))
+                replacements[parameter] = Tree('var', [temporary])
+            else:
+                replacements[parameter] = value
+
+        for statement in callee.stack.children:
+            statements.append((yield self.rewrite(statement, name.value, replacements, callee.local_names)))
+
+        self.inlined[name.value] = self.inlined.get(name.value, 0) + 1
+
+        return statements
+
+    def rewrite(self, node: Union[None, Tree, Token], function: str, replacements: Dict[str, Tree], local_names: Set[str]) -> Task[Union[None, Tree, Token]]:
+        """
+        A copy of a node of a function's body as it reads outside of the function.
+        """
+
+        if not isinstance(node, Tree):
+            return node
+
+        match node.data:
+            case 'argument':
+                return copy_tree(replacements[node.children[0].value[1:]])
+
+            case 'var':
+                variable = node.children[0]
+                if variable.value in local_names:
+                    return Tree('var', [Token.new_borrow_pos('NAME', f"{function}.{variable.value}", variable)])
+
+                if variable.value in replacements:
+                    return copy_tree(replacements[variable.value])
+
+                self.globals.add(variable.value)
+                return Tree('var', [variable])
+
+            case 'localvar':
+                # a varset of the namespaced name sets the variable a local declares in the function
+                variable = node.children[0]
+                return Tree('varset', [
+                    Token.new_borrow_pos('NAME', f"{function}.{variable.value}", variable),
+                    (yield self.rewrite(node.children[1], function, replacements, local_names))
+                ])
+
+        children = []
+        for child in node.children:
+            children.append((yield self.rewrite(child, function, replacements, local_names)) if isinstance(child, Tree) else child)
+
+        return Tree(node.data, children)
+
+    def callee(self, name: str) -> Callee:
+        """
+        The summary of a function, which is only asked for once its body is final.
+        """
+
+        if name not in self.callees:
+            declaration = self.functions[name]
+            stack = declaration.children[-1]
+            callee = Callee(declaration, self.local_names(stack))
+
+            arguments: List[str] = []
+            for node in stack.iter_subtrees_topdown():
+                match node.data:
+                    case 'var' if node.children[0].value not in callee.local_names and node.children[0].value not in callee.parameters:
+                        callee.reads.add(node.children[0].value)
+                    case 'argument':
+                        arguments.append(node.children[0].value[1:])
+
+            walk(self.argument_types(stack, None, callee.parameters, callee.local_names, callee.input_types))
+            callee.yields = self.can_yield(stack)
+
+            callee.inlinable = (
+                name not in self.duplicates
+                and name not in self.recursive
+                and all(argument in callee.parameters for argument in arguments)
+                and not self.reads_before_declaration(stack, callee.local_names)
+                and (declaration.data == 'declr_function_inline' or count_blocks(stack) <= INLINE_SIZE or self.call_sites.get(name, 0) == 1)
+            )
+
+            self.callees[name] = callee
+
+        return self.callees[name]
+
+    def reads_before_declaration(self, stack: Tree, local_names: Set[str]) -> bool:
+        """
+        Whether a local is read before it is declared, in the order the function is
+        lowered. Such a read resolves to a global, which can't be told apart once inlined.
+        """
+
+        declared = set()
+        for node in self.lowering_order(stack):
+            if node.data == 'localvar':
+                declared.add(node.children[0].value)
+            elif node.data == 'var' and node.children[0].value in local_names and node.children[0].value not in declared:
+                return True
+
+        return False
+
+    def lowering_order(self, node: Tree) -> Iterator[Tree]:
+        pending = [node]
+        while len(pending) > 0:
+            node = pending.pop()
+            yield node
+
+            children = node.children
+            if node.data == 'block_if_else':
+                # both branches are lowered before the condition
+                children = [children[1], children[2], children[0]]
+
+            pending += reversed([child for child in children if isinstance(child, Tree)])
+
+    def can_yield(self, stack: Tree) -> bool:
+        """
+        Whether a body may let other scripts run before it ends, when it runs with
+        screen refresh.
+        """
+
+        for node in stack.iter_subtrees_topdown():
+            if node.data in LOOPS:
+                return True
+
+            if node.data == 'block':
+                name = node.children[0]
+                if name in YIELDING_BLOCKS or (name in self.functions and self.functions[name].data == 'declr_function_nowarp'):
+                    return True
+
+        return False
+
+    def argument_types(self, node: Union[None, Tree, Token], input_type: Union[None, str], parameters: List[str], local_names: Set[str], types: Dict[str, Set[str]]) -> Task[None]:
+        """
+        Collect the input types each argument of a function is read as into types.
+        An input type of None is anything which isn't an input.
+        """
+
+        if not isinstance(node, Tree):
+            return
+
+        children = node.children
+        match node.data:
+            case 'argument':
+                types.setdefault(children[0].value[1:], set()).add(input_type)
+                return
+
+            case 'var':
+                if children[0].value in parameters and children[0].value not in local_names:
+                    types.setdefault(children[0].value, set()).add(input_type)
+                return
+
+            case 'expr':
+                child_types = [input_type]
+
+            case 'block':
+                if children[0] in BLOCKS:
+                    child_types = [None, *BLOCKS[children[0]][1].values()]
+                elif children[0] in self.functions:
+                    child_types = [None, *(['value'] * (len(children) - 2))]
+                else:
+                    child_types = []
+
+            case 'varset' | 'localvar':
+                child_types = [None, 'value']
+
+            case 'repeat':
+                child_types = ['positive_integer']
+
+            case 'until' | 'block_if' | 'block_if_else':
+                child_types = ['reference']
+
+            case 'reporter':
+                child_types = [None, *OPERATORS[children[0]][1].values()] if children[0] in OPERATORS else []
+
+            case operator if operator in INPUT_TYPES or operator in OPERATORS:
+                child_types = INPUT_TYPES[operator] if operator in INPUT_TYPES else list(OPERATORS[operator][1].values())
+
+            case _:
+                child_types = []
+
+        for index, child in enumerate(children):
+            if isinstance(child, Tree):
+                yield self.argument_types(child, child_types[index] if index < len(child_types) else None, parameters, local_names, types)
+
+    def is_substitutable(self, value: Tree, input_types: Set[str]) -> bool:
+        """
+        Whether an argument can be substituted wherever it is read: an argument of the
+        caller, which can't change during a call, or a literal each input accepts.
+        """
+
+        while value.data == 'expr' and isinstance(value.children[0], Tree):
+            value = value.children[0]
+
+        if value.data == 'expr':
+            constant = token_value(value.children[0])
+            return constant is not None and all(literal(constant, input_type) is not None for input_type in input_types)
+
+        return value.data == 'argument'
+
+    def local_names(self, stack: Tree) -> Set[str]:
+        # inlining never adds locals to a function, so they are only collected once
+        if id(stack) not in self.locals:
+            self.locals[id(stack)] = {node.children[0].value for node in stack.iter_subtrees_topdown() if node.data == 'localvar'}
+
+        return self.locals[id(stack)]
+
+def inline_procedures(tree: Tree) -> Tuple[Dict[str, int], Set[str]]:
+    """
+    Inline the calls of a target's tree in place. Returns how many calls to each
+    function were inlined, and the global variables the inlined bodies read.
+    """
+
+    inliner = ProcedureInliner(tree)
+    return inliner.inline(), inliner.globals
@@ -0,0 +1,117 @@
+from typing import Callable, Dict, List, Tuple
+
+from dataclasses import dataclass
+
+from time import perf_counter
+
+from lark import Tree
+
+from .folding import fold_constants
+
+from .procedures import eliminate_dead_procedures
+
+from .inlining import inline_procedures
+
+from .hoisting import hoist_loop_invariants
+
+from .subexpressions import eliminate_common_subexpressions
+
+from ..trace import tracer
+
+def fold(tree: Tree, target):
+    target.blocks_removed["Constant folding"] = target.blocks_removed.get("Constant folding", 0) + fold_constants(tree)
+
+def inline(tree: Tree, target):
+    target.inlined_procedures, read_globals = inline_procedures(tree)
+    for name in sorted(read_globals):
+        target.ensure_variable(name, None)
+
+def refold(tree: Tree, target):
+    # literal arguments may have made more of an inlined body constant
+    if len(target.inlined_procedures) > 0:
+        fold(tree, target)
+
+def remove_dead_procedures(tree: Tree, target):
+    removed, target.removed_procedures = eliminate_dead_procedures(tree)
+    target.blocks_removed["Dead procedure elimination"] = removed
+
+def hoist(tree: Tree, target):
+    target.invariants_hoisted, target.evaluations_removed, temporaries = hoist_loop_invariants(tree)
+    for name in temporaries:
+        target.ensure_variable(name, None)
+
+def eliminate_subexpressions(tree: Tree, target):
+    removed, temporaries = eliminate_common_subexpressions(tree)
+    target.blocks_removed["Common subexpression elimination"] = removed
+    for name in temporaries:
+        target.ensure_variable(name, None)
+
+@dataclass(frozen=True, slots=True)
+class Pass:
+    """
+    A transformation of a target's tree between parsing and lowering. It runs at its
+    optimisation level and every level above it, and records what it did on the target.
+    """
+
+    name: str
+    title: str
+    level: int
+    run: Callable[[Tree, object], None]
+
+# every pass in the order they run
+PASSES: List[Pass] = [
+    Pass('fold', "Constant folding", 1, fold),
+    Pass('inline', "Inlining", 2, inline),
+    Pass('refold', "Constant folding of inlined bodies", 2, refold),
+    # after folding and inlining, which can drop the only call to a function
+    Pass('dead-procedures', "Dead procedure elimination", 1, remove_dead_procedures),
+    Pass('licm', "Loop-invariant code motion", 2, hoist),
+    # after hoisting, an operator moved out of a loop isn't repeated in it anymore
+    Pass('cse', "Common subexpression elimination", 2, eliminate_subexpressions)
+]
+
+PASS_NAMES: List[str] = [optimisation.name for optimisation in PASSES]
+
+OPTIMISATION_LEVELS = [0, 1, 2]
+
+DEFAULT_LEVEL = 2
+
+def select_passes(level: int = DEFAULT_LEVEL, enabled: Tuple[str, ...] = (), disabled: Tuple[str, ...] = ()) -> Tuple[str, ...]:
+    """
+    The names of the passes a build runs, in the order they run. A pass which is both
+    enabled and disabled is disabled.
+    """
+
+    return tuple(optimisation.name for optimisation in PASSES if (optimisation.level <= level or optimisation.name in enabled) and optimisation.name not in disabled)
+
+DEFAULT_PASSES = select_passes()
+
+def count_nodes(tree: Tree) -> int:
+    return sum(1 for _ in tree.iter_subtrees_topdown())
+
+class PassManager:
+    """
+    Runs the selected passes over a target's tree, timing each and counting how many
+    nodes of the tree it added or removed.
+    """
+
+    def __init__(self, names: Tuple[str, ...]):
+        self.passes: List[Pass] = [optimisation for optimisation in PASSES if optimisation.name in names]
+
+    def run(self, tree: Tree, target) -> Dict[str, Tuple[float, int]]:
+        """
+        Returns the seconds each pass took and the nodes it changed the tree by, by name.
+        """
+
+        statistics: Dict[str, Tuple[float, int]] = {}
+        nodes = count_nodes(tree) if len(self.passes) > 0 else 0
+        for optimisation in self.passes:
+            start = perf_counter()
+            with tracer.span(optimisation.title, "lower", target=target.name):
+                optimisation.run(tree, target)
+            elapsed = perf_counter() - start
+
+            before, nodes = nodes, count_nodes(tree)
+            statistics[optimisation.name] = (elapsed, nodes - before)
+
+        return statistics
@@ -6,17 +6,38 @@ from rich.console import Console
 
 from json import dumps
 
-from uuid import uuid4
-
 import difflib
 
 import rich.repr
 
-from .utils import uid
+from functools import lru_cache
 
 from ..terminal import *
 
-@dataclass
+@lru_cache(maxsize=None, typed=True)
+def interned(kind, *fields):
+    """
+    The one shared instance of a frozen primitive, so a literal or reference that is
+    repeated across a project is only stored once.
+    """
+
+    return kind(*fields)
+
+class RenderedOnce:
+    """
+    A primitive which always renders the same way, and is therefore rendered only
+    once, when it is created. The rendered form is shared and must not be modified.
+    """
+
+    __slots__ = ()
+
+    def __post_init__(self):
+        object.__setattr__(self, 'rendered', self.render_once())
+
+    def render(self):
+        return self.rendered
+
+@dataclass(frozen=True, slots=True)
 class FunctionReferencePrimitive:
     uuid: str
     
@@ -26,7 +47,7 @@ class FunctionReferencePrimitive:
             self.uuid
         ]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ReferencePrimitive:
     uuid: str
     
@@ -36,11 +57,12 @@ class ReferencePrimitive:
             self.uuid
         ]
 
-@dataclass
-class NumberPrimitive:
+@dataclass(frozen=True, slots=True)
+class NumberPrimitive(RenderedOnce):
     value: Union[float, int]
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -49,11 +71,12 @@ class NumberPrimitive:
             ]
         ]
 
-@dataclass
-class PositiveNumberPrimitive:
+@dataclass(frozen=True, slots=True)
+class PositiveNumberPrimitive(RenderedOnce):
     value: Union[float, int]
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -62,11 +85,12 @@ class PositiveNumberPrimitive:
             ]
         ]
 
-@dataclass
-class IntegerPrimitive:
+@dataclass(frozen=True, slots=True)
+class IntegerPrimitive(RenderedOnce):
     value: int
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -75,11 +99,12 @@ class IntegerPrimitive:
             ]
         ]
 
-@dataclass
-class PositiveIntegerPrimitive:
+@dataclass(frozen=True, slots=True)
+class PositiveIntegerPrimitive(RenderedOnce):
     value: int
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -88,11 +113,12 @@ class PositiveIntegerPrimitive:
             ]
         ]
 
-@dataclass
-class AnglePrimitive:
+@dataclass(frozen=True, slots=True)
+class AnglePrimitive(RenderedOnce):
     value: int
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -101,13 +127,14 @@ class AnglePrimitive:
             ]
         ]
 
-@dataclass
-class ColorPrimitive:
+@dataclass(frozen=True, slots=True)
+class ColorPrimitive(RenderedOnce):
     r: int
     g: int
     b: int
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -116,11 +143,12 @@ class ColorPrimitive:
             ]
         ]
 
-@dataclass
-class StringPrimitive:
+@dataclass(frozen=True, slots=True)
+class StringPrimitive(RenderedOnce):
     value: str
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             1,
             [
@@ -129,7 +157,7 @@ class StringPrimitive:
             ]
         ]
         
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BroadcastPrimitive:
     name: str
     uuid: str
@@ -144,12 +172,13 @@ class BroadcastPrimitive:
         ]
 
 
-@dataclass
-class VariablePrimitive:
+@dataclass(frozen=True, slots=True)
+class VariablePrimitive(RenderedOnce):
     name: str
     uuid: str
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             3,
             [
@@ -165,12 +194,13 @@ class VariablePrimitive:
         ]
 
 
-@dataclass
-class ListPrimitive:
+@dataclass(frozen=True, slots=True)
+class ListPrimitive(RenderedOnce):
     name: str
     uuid: str
-    
-    def render(self):
+    rendered: list = field(init=False, repr=False, compare=False)
+
+    def render_once(self):
         return [
             3,
             [
@@ -185,7 +215,7 @@ class ListPrimitive:
             ]
         ]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BlockPrimitive:
     uuid: str
     
@@ -195,7 +225,7 @@ class BlockPrimitive:
             self.uuid
         ]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ErrorPrimitive:
     def render(self):
         return [
@@ -218,7 +248,7 @@ BaseExpression: TypeAlias = Union[ReferencePrimitive,
                                   ErrorPrimitive,
                                   None]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Shadow:
     front: BaseExpression 
     back: BaseExpression
@@ -249,7 +279,7 @@ Expression: TypeAlias = Union[ReferencePrimitive,
                               ErrorPrimitive,
                               Shadow]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class VariableField:
     name: str
     uuid: str
@@ -260,7 +290,7 @@ class VariableField:
             self.uuid
         ]
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class InputField:
     name: str
 
@@ -351,7 +381,7 @@ OPERATORS = {
     # Lists
 }
 
-@dataclass
+@dataclass(slots=True)
 class Block:
     opcode: str
     inputs: Dict[str, Expression]
@@ -375,18 +405,16 @@ class Block:
 
     def render(self):
         return {
-            self.uuid: {
-                "opcode": self.opcode,
-                "next": self.next_block,
-                "parent": self.parent,
-                "inputs": {name: item.render() for name, item in self.inputs.items()},
-                "fields": {name: item.render() for name, item in self.fields.items()},
-                "shadow": self.shadow,
-                "topLevel": self.top_level,
-            }
+            "opcode": self.opcode,
+            "next": self.next_block,
+            "parent": self.parent,
+            "inputs": {name: item.render() for name, item in self.inputs.items()},
+            "fields": {name: item.render() for name, item in self.fields.items()},
+            "shadow": self.shadow,
+            "topLevel": self.top_level,
         }
 
-@dataclass
+@dataclass(slots=True)
 class HatBlock(Block):
     top_level: bool = True
     x: int = 0
@@ -407,20 +435,20 @@ class HatBlock(Block):
 
     def render(self):
         return {
-            self.uuid: {
-                "opcode": self.opcode,
-                "next": self.next_block,
-                "parent": self.parent,
-                "inputs": {name: item.render() for name, item in self.inputs.items()},
-                "fields": {name: item.render() for name, item in self.fields.items()},
-                "shadow": self.shadow,
-                "topLevel": self.top_level,
-                "x": self.x,
-                "y": self.y
-            }
+            "opcode": self.opcode,
+            "next": self.next_block,
+            "parent": self.parent,
+            "inputs": {name: item.render() for name, item in self.inputs.items()},
+            "fields": {name: item.render() for name, item in self.fields.items()},
+            "shadow": self.shadow,
+            "topLevel": self.top_level,
+            "x": self.x,
+            "y": self.y
         }
 
 class ProcedurePrototype(Block):
+    __slots__ = ('name', 'argumentids', 'argumentnames', 'argumentdefaults', 'warp')
+
     def __init__(self, name):
         super().__init__('procedures_prototype', {}, {})
         
@@ -431,67 +459,89 @@ class ProcedurePrototype(Block):
         self.argumentdefaults: List[Union[str, bool]] = []
         self.warp: bool = True
 
-    def add_argument(self, name):
-        self.argumentids.append(uid())
+    def add_argument(self, name, uuid):
+        self.argumentids.append(uuid)
         self.argumentnames.append(name)
         self.argumentdefaults.append('')
 
     def render(self):
         #self.argumentdefaults.append("false")
         return {
-            self.uuid: {
-                "opcode": self.opcode,
-                "next": self.next_block,
-                "parent": self.parent,
-                "inputs": {name: item.render() for name, item in self.inputs.items()},
-                "fields": {name: item.render() for name, item in self.fields.items()},
-                "shadow": self.shadow,
-                "topLevel": self.top_level,
-                "mutation": {
-                    "tagName": "mutation",
-                    "children": [],
-                    "proccode": f"{self.name}{''.join((' %s' * len(self.argumentnames)))}",
-                    "argumentids": dumps(self.argumentids, separators=(',', '')),
-                    "argumentnames": dumps(self.argumentnames, separators=(',', '')),
-                    "argumentdefaults": dumps(self.argumentdefaults, separators=(',', '')),
-                    "warp": dumps(self.warp, separators=(',', ''))
-                }
+            "opcode": self.opcode,
+            "next": self.next_block,
+            "parent": self.parent,
+            "inputs": {name: item.render() for name, item in self.inputs.items()},
+            "fields": {name: item.render() for name, item in self.fields.items()},
+            "shadow": self.shadow,
+            "topLevel": self.top_level,
+            "mutation": {
+                "tagName": "mutation",
+                "children": [],
+                "proccode": f"{self.name}{''.join((' %s' * len(self.argumentnames)))}",
+                "argumentids": dumps(self.argumentids, separators=(',', '')),
+                "argumentnames": dumps(self.argumentnames, separators=(',', '')),
+                "argumentdefaults": dumps(self.argumentdefaults, separators=(',', '')),
+                "warp": dumps(self.warp, separators=(',', ''))
             }
         }
 
+def call_mutation(proccode: str, argumentids: List[str], warp: bool) -> Dict:
+    """
+    The rendered mutation of every call to a function. It is built once when the
+    function is declared and shared between its call sites.
+    """
+
+    return {
+        "tagName": "mutation",
+        "children": [],
+        "proccode": proccode,
+        "argumentids": dumps(argumentids, separators=(',', '')),
+        "warp": dumps(warp, separators=(',', ''))
+    }
+
 class ProcedureCall(Block):
+    __slots__ = ('proccode', 'argumentids', 'warp', 'mutation')
+
     def __init__(self, name, inputs):
         super().__init__('procedures_call', inputs, {})
         
         self.proccode: str = ''
         self.argumentids: List[str] = []
         self.warp: bool = True
+        self.mutation: Dict = {}
 
     def mutate(self, mutators: Dict):
         self.proccode = mutators['proccode']
         self.argumentids = mutators['argumentids']
         self.warp = mutators['warp']
+        self.mutation = mutators['mutation']
 
     def render(self):
         return {
-            self.uuid: {
-                "opcode": self.opcode,
-                "next": self.next_block,
-                "parent": self.parent,
-                "inputs": {name: item.render() for name, item in self.inputs.items()},
-                "fields": {name: item.render() for name, item in self.fields.items()},
-                "shadow": self.shadow,
-                "topLevel": self.top_level,
-                "mutation": {
-                    "tagName": "mutation",
-                    "children": [],
-                    "proccode": self.proccode,
-                    "argumentids": dumps(self.argumentids, separators=(',', '')),
-                    "warp": dumps(self.warp, separators=(',', ''))
-                }
-            }
+            "opcode": self.opcode,
+            "next": self.next_block,
+            "parent": self.parent,
+            "inputs": {name: item.render() for name, item in self.inputs.items()},
+            "fields": {name: item.render() for name, item in self.fields.items()},
+            "shadow": self.shadow,
+            "topLevel": self.top_level,
+            "mutation": self.mutation
         }
 
+class RenderedBlock:
+    """
+    A block which is only available in its rendered form, such as one restored from the build cache.
+    """
+
+    __slots__ = ('uuid', 'record')
+
+    def __init__(self, uuid: str, record: dict):
+        self.uuid: str = uuid
+        self.record: dict = record
+
+    def render(self):
+        return self.record
+
 def validate_arg(arg, target_type, target):
     return validate_args((arg,), (target_type,), target)[0]
 
@@ -534,35 +584,35 @@ def cast_arg(arg, target_type, target):
         case 'number':
             try:
                 cast = float(arg) if float(arg) % 1 > 0 else int(arg)
-                return NumberPrimitive(cast)
+                return interned(NumberPrimitive, cast)
             except:
                 cast = ErrorPrimitive()
 
         case 'positive_number':
             try:
                 assert (cast := float(arg) if float(arg) % 1 > 0 else int(arg)) >= 0
-                return PositiveNumberPrimitive(cast)
+                return interned(PositiveNumberPrimitive, cast)
             except:
                 cast = ErrorPrimitive()
 
         case 'integer':
             try:
                 cast = int(arg)
-                return IntegerPrimitive(cast)
+                return interned(IntegerPrimitive, cast)
             except:
                 cast = ErrorPrimitive()
 
         case 'positive_integer':
             try:
                 assert (cast := int(arg)) >= 0
-                return PositiveIntegerPrimitive(cast)
+                return interned(PositiveIntegerPrimitive, cast)
             except:
                 cast = ErrorPrimitive()
 
         case 'angle':
             try:
                 assert 0 <= (cast := int(arg)) <= 360
-                return AnglePrimitive(cast)
+                return interned(AnglePrimitive, cast)
             except:
                 cast = ErrorPrimitive()
 
@@ -583,7 +633,7 @@ def cast_arg(arg, target_type, target):
         case 'string':
             try:
                 cast = str(arg)
-                return StringPrimitive(cast)
+                return interned(StringPrimitive, cast)
             except:
                 cast = ErrorPrimitive()
 
@@ -597,32 +647,23 @@ def cast_arg(arg, target_type, target):
             
     return cast
 
-def generate_default_primitive(target_type):
-    match target_type:
-        case 'number':
-            return NumberPrimitive(0)
-
-        case 'positive_number':
-            return PositiveNumberPrimitive(0)
-
-        case 'integer':
-            return IntegerPrimitive(0)
-
-        case 'positive_integer':
-            return PositiveIntegerPrimitive(0)
-
-        case 'angle':
-            return AnglePrimitive(0)
+DEFAULT_PRIMITIVES = {
+    'number':           NumberPrimitive(0),
+    'positive_number':  PositiveNumberPrimitive(0),
+    'integer':          IntegerPrimitive(0),
+    'positive_integer': PositiveIntegerPrimitive(0),
+    'angle':            AnglePrimitive(0),
+    'string':           StringPrimitive(''),
+}
 
-        case 'string':
-            return StringPrimitive('')
+def generate_default_primitive(target_type):
+    # defaults are frozen, so every input shares the same one
+    if target_type in DEFAULT_PRIMITIVES:
+        return DEFAULT_PRIMITIVES[target_type]
 
-        case _:
-            error_collector.throw(ImpossibleError(
-                f"{repr(target_type)} has no default.", 
-                None
-            ))
+    error_collector.throw(ImpossibleError(
+        f"{repr(target_type)} has no default.", 
+        None
+    ))
 
-            cast = None
-            
-    return cast
+    return None
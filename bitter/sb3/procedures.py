@@ -0,0 +1,54 @@
+from typing import Dict, List, Set, Tuple
+
+from lark import Tree
+
+from .folding import count_blocks
+
+FUNCTION_DECLARATIONS = ('declr_function', 'declr_function_nowarp', 'declr_function_inline')
+
+def declared_functions(tree: Tree) -> Dict[str, Tree]:
+    return {declaration.children[0].value: declaration for declaration in tree.children if declaration.data in FUNCTION_DECLARATIONS}
+
+def called_functions(tree: Tree, functions: Dict[str, Tree]) -> Set[str]:
+    """
+    The names of the functions a script or function calls directly.
+    """
+
+    return {statement.children[0].value for statement in tree.iter_subtrees_topdown() if statement.data == 'block' and statement.children[0] in functions}
+
+def eliminate_dead_procedures(tree: Tree) -> Tuple[int, List[str]]:
+    """
+    Remove every function no hat script can reach through the calls it makes from
+    the tree. Returns the number of blocks which no longer have to be lowered, and
+    the names of the removed functions in declaration order.
+    """
+
+    functions = declared_functions(tree)
+
+    reachable: Set[str] = set()
+    pending: List[str] = []
+    for declaration in tree.children:
+        if declaration.data not in FUNCTION_DECLARATIONS:
+            pending += called_functions(declaration, functions)
+
+    while len(pending) > 0:
+        name = pending.pop()
+        if name not in reachable:
+            reachable.add(name)
+            pending += called_functions(functions[name].children[-1], functions)
+
+    removed_blocks = 0
+    removed_functions = []
+    declarations = []
+    for declaration in tree.children:
+        if declaration.data in FUNCTION_DECLARATIONS and declaration.children[0].value not in reachable:
+            arguments = [argument for argument in declaration.children[1:-1] if argument is not None]
+            # the definition, its prototype and an argument reporter for each argument
+            removed_blocks += 2 + len(arguments) + count_blocks(declaration.children[-1])
+            removed_functions.append(declaration.children[0].value)
+        else:
+            declarations.append(declaration)
+
+    tree.children = declarations
+
+    return removed_blocks, removed_functions
@@ -1,9 +1,13 @@
-from typing import List, Union, Dict, Tuple
+from typing import IO, List, Union, Dict, Tuple
 
 import rich.repr
 
 from io import BytesIO
 
+import os
+
+import time
+
 from random import randint
 
 import zipfile
@@ -12,16 +16,48 @@ import json
 
 from pathlib import Path
 
-from .utils import uid
+from .utils import IdAllocator, SCRATCH_ID_LENGTH, STAGE_LEADER
 
 from .blocks import Blocks
 
-from .costumes import cast_to_costume, Costume, Vector, Bitmap
+from .passes import DEFAULT_PASSES
+
+from .costumes import restore_costume, Asset, Costume, Vector, Bitmap
 
 from .sounds import Sound
 
+from .primitives import RenderedBlock
+
+from .emitter import JsonEmitter, StreamedArray, StreamedObject
+
+from ..trace import tracer
+
+from ..terminal import error_collector
+
 # from rich.console import Console
 
+# the earliest time a zip entry can carry
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+def archive_timestamp() -> Tuple[int, int, int, int, int, int]:
+    """
+    The time every archive entry is stamped with in place of the time of the build.
+    SOURCE_DATE_EPOCH sets it, as for other reproducible builds.
+    """
+
+    source_date_epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if source_date_epoch is None:
+        return ZIP_EPOCH
+
+    return max(ZIP_EPOCH, tuple(time.gmtime(int(source_date_epoch))[:6]))
+
+def archive_entry(name: str) -> zipfile.ZipInfo:
+    entry = zipfile.ZipInfo(name, archive_timestamp())
+    # the platform the archive is built on is otherwise recorded in every entry
+    entry.create_system = 3
+    entry.external_attr = 0o644 << 16
+    return entry
+
 class Project:
     def __init__(self):
         self.targets: List[Target] = []
@@ -29,7 +65,8 @@ class Project:
         self.extensions: List[str] = []
         self.meta: Meta = Meta()
 
-        self.file_buffer = {}
+        self.file_buffer: Dict[str, Asset] = {}
+        self.json_backend: str = "auto"
 
         # self.console = Console()
 
@@ -40,28 +77,54 @@ class Project:
     def add_target(self, target):
         self.targets.append(target)
 
-    def render(self, debug_mode: bool) -> Tuple[Union[None, str], BytesIO]:
-        project = {
-            "targets": [target.render(self.file_buffer) for target in self.targets],
-            "monitors": self.monitors,
-            "extensions": self.extensions,
-            "meta": self.meta.render()
-        }
-
-        json_project = json.dumps(project, indent = 0, separators=(',', ':'))
-
-        output_buffer = BytesIO()
-        with zipfile.ZipFile(output_buffer, 'w') as zip_file:
-            zip_file.writestr("project.json", json_project)
-            for name, data in list(self.file_buffer.items()):
-                zip_file.writestr(name, data)
-
-        if debug_mode:
-            json_debug = json.dumps(project, indent=4)
-        else:
-            json_debug = None
-
-        return json_debug, output_buffer
+    def render(self) -> StreamedObject:
+        """
+        The project.json document, rendered target by target and block by block as it
+        is emitted. Emitting it collects the assets it references in the file buffer.
+        """
+
+        return StreamedObject([
+            ("targets", StreamedArray(StreamedObject(target.render(self.file_buffer).items()) for target in self.targets)),
+            ("monitors", self.monitors),
+            ("extensions", self.extensions),
+            ("meta", self.meta.render())
+        ])
+
+    def emit(self, stream: IO[bytes]):
+        JsonEmitter(stream, self.json_backend).emit_document(self.render())
+
+    def render_debug(self) -> str:
+        buffer = BytesIO()
+        self.emit(buffer)
+        return json.dumps(json.loads(buffer.getvalue()), indent=4)
+
+    def write(self, destination: Path):
+        """
+        Write the project archive. project.json is emitted straight into it and every
+        asset is streamed in from where it is stored. The archive is built in a temporary
+        file beside the destination and moved into place once complete, so a reader
+        never sees a partial project.
+
+        Entries are written in a fixed order with fixed metadata, so the same sources
+        always give the same bytes.
+        """
+
+        temporary = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+        try:
+            with tracer.span("Write archive", "render", file=destination.name), zipfile.ZipFile(temporary, 'w') as zip_file:
+                with tracer.span("Render project.json", "render"), zip_file.open(archive_entry("project.json"), 'w') as entry:
+                    self.emit(entry)
+
+                for name, asset in sorted(self.file_buffer.items()):
+                    with zip_file.open(archive_entry(name), 'w') as entry:
+                        for chunk in asset.chunks():
+                            entry.write(chunk)
+
+            os.replace(temporary, destination)
+
+        finally:
+            if temporary.exists():
+                temporary.unlink()
     
     def __rich_repr__(self) -> rich.repr.Result:
         yield "targets", self.targets
@@ -90,6 +153,7 @@ class Target:
         self.g_variables: Dict[str, gVariable] = {}
         self.g_lists: List[gList] = []
         self.broadcasts: List[Broadcast] = []  
+        self.ids = IdAllocator()
         self.blocks = Blocks(tree, self)
         self.comments: Dict = {}
         self.current_costume: int = 0
@@ -103,9 +167,68 @@ class Target:
         self.text_to_speech_language: Union[None, str] = None
 
         self.working_directory = working_directory
+        self.source_file: Union[None, Path] = None
+        self.costume_sources: List[Path] = []
+        self.restored: bool = False
+
+        # how many blocks each optimisation saved lowering
+        self.blocks_removed: Dict[str, int] = {}
+        # the optimisation passes run on the tree, and what each of them cost and changed
+        self.passes: Tuple[str, ...] = DEFAULT_PASSES
+        self.pass_statistics: Dict[str, Tuple[float, int]] = {}
+        self.removed_procedures: List[str] = []
+        self.inlined_procedures: Dict[str, int] = {}
+        self.invariants_hoisted: int = 0
+        self.evaluations_removed: int = 0
     
     def build(self, parser):
-        self.blocks.build(parser)
+        if self.restored:
+            return
+
+        # targets are lowered after every file is parsed, so diagnostics must be pointed back at this one
+        error_collector.set_file(self.source_file)
+        with tracer.span("Build", "lower", target=self.name):
+            self.blocks.build(parser)
+
+    def freeze(self) -> Dict:
+        """
+        The lowered state of a built target, in a form the build cache can store as json.
+        """
+
+        return {
+            "blocks": dict(self.blocks.records()),
+            "variables": [[name, g_variable.uuid] for name, g_variable in self.g_variables.items()],
+            "costumes": [{"source": str(source), "metadata": costume.render({})} for costume, source in zip(self.costumes, self.costume_sources)]
+        }
+
+    def restore(self, entry: Dict, assets: Dict[str, Path]):
+        """
+        Take over the lowered state of a frozen target instead of building it.
+        """
+
+        self.blocks.arena = [RenderedBlock(uuid, record) for uuid, record in entry["blocks"].items()]
+
+        for name, uuid in entry["variables"]:
+            g_variable = gVariable(name, uuid)
+            self.g_variables.update({name: g_variable})
+
+        for costume in entry["costumes"]:
+            asset = Asset(path=assets[costume["metadata"]["md5ext"]], source=(Path(costume["source"]), self.working_directory))
+            self.costumes.append(restore_costume(costume["metadata"], asset))
+            self.costume_sources.append(Path(costume["source"]))
+
+        self.restored = True
+
+    def id_savings(self) -> int:
+        """
+        How many bytes shorter the target renders with its compact IDs than with the
+        IDs bitter generated before.
+        """
+
+        references = [*self.g_variables.values(), *self.g_lists, *self.broadcasts]
+        saved = sum(SCRATCH_ID_LENGTH - len(reference.uuid) for reference in references)
+
+        return saved + sum(length - len(uuid) for uuid, length in self.blocks.id_references())
 
     # def add_vector(self, vector: Union[Costume, Vector, Bitmap]):
     #     self.costumes.append(vector)
@@ -121,7 +244,7 @@ class Target:
             return self.g_variables[internal_name].uuid
 
         else:
-            variable = gVariable(internal_name)
+            variable = gVariable(internal_name, self.ids.allocate())
             self.g_variables.update({internal_name: variable})
             return variable.uuid
 
@@ -158,8 +281,8 @@ class Target:
             return None
 
     def add_costume(self, path):
-        file = Path(path)
-        self.costumes.append(cast_to_costume(file, self.working_directory))
+        # costumes are only declared while lowering, converting them is a separate stage
+        self.costume_sources.append(Path(path))
 
     def render(self, file_buffer):
         return {
@@ -168,7 +291,7 @@ class Target:
             "variables": {g_variable.uuid: g_variable.render() for g_variable in self.g_variables.values()},
             "lists": {g_list.uuid: g_list.render() for g_list in self.g_lists},
             "broadcasts": {broadcast.uuid: broadcast.render() for broadcast in self.broadcasts},
-            "blocks": self.blocks.project['blocks'],
+            "blocks": StreamedObject(self.blocks.records()),
             "comments": self.comments,
             "current_costume": self.current_costume,
             "costumes": [costume.render(file_buffer) for costume in self.costumes],
@@ -185,6 +308,7 @@ class Stage(Target):
     def __init__(self, tree, working_directory):
         super().__init__('Stage', tree, working_directory)
         self.is_stage = True
+        self.ids = IdAllocator(STAGE_LEADER)
 
     def render(self, file_buffer):
         return {
@@ -193,7 +317,7 @@ class Stage(Target):
             "variables": {g_variable.uuid: g_variable.render() for g_variable in self.g_variables.values()},
             "lists": {g_list.uuid: g_list.render() for g_list in self.g_lists},
             "broadcasts": {broadcast.uuid: broadcast.render() for broadcast in self.broadcasts},
-            "blocks": self.blocks.project['blocks'],
+            "blocks": StreamedObject(self.blocks.records()),
             "comments": self.comments,
             "current_costume": self.current_costume,
             "costumes": [costume.render(file_buffer) for costume in self.costumes],
@@ -241,7 +365,7 @@ class Sprite(Target):
             "variables": {g_variable.uuid: g_variable.render() for g_variable in self.g_variables.values()},
             "lists": {g_list.uuid: g_list.render() for g_list in self.g_lists},
             "broadcasts": {broadcast.uuid: broadcast.render() for broadcast in self.broadcasts},
-            "blocks": self.blocks.project['blocks'],
+            "blocks": StreamedObject(self.blocks.records()),
             "comments": self.comments,
             "current_costume": self.current_costume,
             "costumes": [costume.render(file_buffer) for costume in self.costumes],
@@ -277,9 +401,9 @@ class Sprite(Target):
         yield "rotation_style", self.rotation_style
 
 class gVariable:
-    def __init__(self, name: str):
+    def __init__(self, name: str, uuid: str):
         self.name: str = name
-        self.uuid: str = uid()
+        self.uuid: str = uuid
 
     def render(self):
         return [
@@ -288,9 +412,9 @@ class gVariable:
         ]
 
 class gList:
-    def __init__(self, name: str):
+    def __init__(self, name: str, uuid: str):
         self.name: str = name
-        self.uuid: str = uid()
+        self.uuid: str = uuid
 
     def render(self):
         return {
@@ -299,9 +423,9 @@ class gList:
         }
 
 class Broadcast:
-    def __init__(self, name: str):
+    def __init__(self, name: str, uuid: str):
         self.name: str = name
-        self.uuid: str = uid()
+        self.uuid: str = uuid
 
     def render(self):
         return {
@@ -0,0 +1,223 @@
+from typing import Dict, List, Set, Tuple, Union
+
+from lark import Token, Tree
+
+from .folding import LOWERED_NODES
+
+from .primitives import BLOCKS
+
+from .inlining import YIELDING_BLOCKS
+
+from .hoisting import HOISTABLE, PURE, PURE_REPORTERS, Function, written_variables
+
+from .traversal import Shapes, Task, walk
+
+# nodes which are pure when their children are
+PURE_NODES = {'expr', 'argument', 'var', *PURE}
+
+REPORTERS = {'reporter'}
+
+# where an operator was found: the statement of its run, its parent, its index and itself
+Place = Tuple[int, Tree, int, Tree]
+
+class SubexpressionEliminator:
+    """
+    Evaluates an operator which is repeated in a straight-line run of statements
+    once, into a temporary variable the repetitions read instead. A repetition only
+    reads the temporary while no statement in between has set a variable the
+    operator reads. Sensing and random reporters are never reused.
+
+    A run ends at control flow, at calls and at blocks which wait. Nothing else can
+    run while a temporary is in use, so every run of a function shares the same
+    names, numbered after the temporaries hoisting left in it.
+    """
+
+    def __init__(self, tree: Tree):
+        self.tree: Tree = tree
+
+        self.evaluations: int = 0
+        self.temporaries: List[str] = []
+
+    def eliminate(self) -> Tuple[int, List[str]]:
+        for declaration in self.tree.children:
+            if isinstance(declaration, Tree) and len(declaration.children) > 0 and isinstance(declaration.children[-1], Tree) and declaration.children[-1].data == 'stack':
+                function = Function(declaration)
+                function.live = self.hoisted_temporaries(declaration, function)
+                walk(self.eliminate_stack(declaration.children[-1], function))
+
+        return self.evaluations, self.temporaries
+
+    def hoisted_temporaries(self, declaration: Tree, function: Function) -> int:
+        """
+        How many temporaries hoisting set in a function. They can be read anywhere in
+        the loops they were hoisted from.
+        """
+
+        prefix = function.temporary(0)[:-1]
+        numbers = [int(node.children[0].value[len(prefix):]) for node in declaration.iter_subtrees_topdown() if node.data == 'varset' and node.children[0].value.startswith(prefix)]
+
+        return max(numbers, default=0)
+
+    def eliminate_stack(self, stack: Tree, function: Function) -> Task[None]:
+        statements = []
+        run = []
+        for statement in stack.children:
+            if self.is_straight(statement):
+                run.append(statement)
+                continue
+
+            statements += self.eliminate_run(run, function)
+            run = []
+            statements.append(statement)
+
+            for child in statement.children:
+                if isinstance(child, Tree) and child.data == 'stack':
+                    yield self.eliminate_stack(child, function)
+
+        statements += self.eliminate_run(run, function)
+        stack.children = statements
+
+    def is_straight(self, statement: Tree) -> bool:
+        """
+        Whether a statement can be part of a run: it neither waits nor calls a function.
+        """
+
+        match statement.data:
+            case 'varset' | 'localvar':
+                return True
+
+            case 'block':
+                return statement.children[0] in BLOCKS and statement.children[0] not in YIELDING_BLOCKS
+
+        return False
+
+    def eliminate_run(self, run: List[Tree], function: Function) -> List[Tree]:
+        """
+        Replace the repeated operators of a run with temporaries, and return the
+        run with the statements which set them.
+        """
+
+        shapes = Shapes()
+        sizes: Dict[int, int] = {}
+        occurrences: Dict[int, List[Place]] = {}
+        for position, statement in enumerate(run):
+            self.collect(statement, position, shapes, sizes, occurrences)
+
+        if all(len(places) < 2 for places in occurrences.values()):
+            return run
+
+        written = [written_variables(statement, function) for statement in run]
+
+        # larger operators first, the ones inside them are replaced along with
+        # them except in the statement which sets the temporary
+        groups = sorted(occurrences.values(), key=lambda places: -sizes[id(places[0][3])])
+
+        replaced: Set[int] = set()
+        setters: Dict[int, List[Tree]] = {}
+        for places in groups:
+            # the repetitions inside a larger operator which was replaced are gone
+            places = [place for place in places if id(place[3]) not in replaced]
+            if len(places) < 2:
+                continue
+
+            reads = self.reads(places[0][3], function)
+
+            window: List[Place] = []
+            for place in places:
+                if len(window) > 0 and not all(reads.isdisjoint(written[position]) for position in range(window[0][0], place[0])):
+                    self.replace(window, sizes, setters, replaced, function)
+                    window = []
+
+                window.append(place)
+
+            self.replace(window, sizes, setters, replaced, function)
+
+        statements = []
+        for position, statement in enumerate(run):
+            statements += setters.get(position, [])
+            statements.append(statement)
+
+        return statements
+
+    def replace(self, window: List[Place], sizes: Dict[int, int], setters: Dict[int, List[Tree]], replaced: Set[int], function: Function):
+        """
+        Read the operators of a window from a temporary, if it evaluates fewer blocks.
+        """
+
+        cost = sizes[id(window[0][3])] if len(window) > 0 else 0
+
+        # the temporary costs the block which sets it
+        saved = (len(window) - 1) * cost - 1
+        if saved <= 0:
+            return
+
+        position = window[0][0]
+        temporary = function.temporary(function.live + sum(len(statements) for statements in setters.values()) + 1)
+        if temporary not in self.temporaries:
+            self.temporaries.append(temporary)
+
+        # the operators inside this one are set before it
+        setters.setdefault(position, []).insert(0, Tree('varset', [Token('NAME', temporary), window[0][3]]))
+
+        for index, (_, parent, child_index, node) in enumerate(window):
+            if index > 0:
+                replaced.update(id(subtree) for subtree in node.iter_subtrees())
+            parent.children[child_index] = Tree('var', [Token('NAME', temporary)])
+
+        self.evaluations += saved
+
+    def collect(self, statement: Tree, position: int, shapes: Shapes, sizes: Dict[int, int], occurrences: Dict[int, List[Place]]):
+        """
+        Find every pure operator below a statement, grouped by what they compute, and
+        record how many blocks every node lowers to into sizes.
+        """
+
+        # every node with its parent and index, parents first and the last child first,
+        # so that backwards a node comes after its children and the first child first
+        order: List[Tuple[Union[None, Tree], int, Tree]] = []
+        pending: List[Tuple[Union[None, Tree], int, Tree]] = [(None, 0, statement)]
+        while len(pending) > 0:
+            place = pending.pop()
+            order.append(place)
+            pending += [(place[2], index, child) for index, child in enumerate(place[2].children) if isinstance(child, Tree)]
+
+        pure: Set[int] = set()
+        for parent, index, node in reversed(order):
+            data = node.data
+            size = data in LOWERED_NODES
+            is_pure = data in PURE_NODES or (data in REPORTERS and node.children[0] in PURE_REPORTERS)
+            for child in node.children:
+                if isinstance(child, Tree):
+                    size += sizes[id(child)]
+                    is_pure = is_pure and id(child) in pure
+
+            sizes[id(node)] = size
+            if not is_pure:
+                continue
+
+            # only pure nodes are compared, and their children are pure too
+            pure.add(id(node))
+            number = shapes.add(node)
+            if parent is not None and data in HOISTABLE:
+                occurrences.setdefault(number, []).append((position, parent, index, node))
+
+    def reads(self, expression: Tree, function: Function) -> Set[str]:
+        """
+        The variables an operator reads, as they are written.
+        """
+
+        read = set()
+        for subtree in expression.iter_subtrees_topdown():
+            if subtree.data == 'var':
+                read |= function.variables(subtree.children[0].value)
+
+        return read
+
+def eliminate_common_subexpressions(tree: Tree) -> Tuple[int, List[str]]:
+    """
+    Reuse the repeated operators of the straight-line runs of a target's tree in
+    place. Returns how many fewer blocks are lowered, which is also how many fewer
+    are evaluated, and the temporaries which hold them.
+    """
+
+    return SubexpressionEliminator(tree).eliminate()
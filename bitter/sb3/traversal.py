@@ -0,0 +1,89 @@
+from typing import Any, Dict, Generator, List, Tuple, TypeVar, Union
+
+from lark import Token, Tree
+
+T = TypeVar('T')
+
+# a step of a traversal, which yields the steps it needs the results of and returns its own
+Task = Generator['Task', Any, T]
+
+def walk(task: Task[T]) -> T:
+    """
+    Run a traversal to its result. A step waiting for another is kept on a stack
+    instead of Python's, so there is no limit to how deep a tree can be.
+    """
+
+    pending: List[Task] = [task]
+    result: Any = None
+    while True:
+        try:
+            step = pending[-1].send(result)
+        except StopIteration as stop:
+            pending.pop()
+            if len(pending) == 0:
+                return stop.value
+
+            result = stop.value
+            continue
+
+        pending.append(step)
+        result = None
+
+def copy_tree(tree: Tree) -> Tree:
+    """
+    A copy of a tree and all its subtrees, the tokens are shared.
+    """
+
+    copies: Dict[int, Tree] = {}
+    for subtree in tree.iter_subtrees():
+        copies[id(subtree)] = Tree(subtree.data, [copies[id(child)] if isinstance(child, Tree) else child for child in subtree.children], subtree._meta)
+
+    return copies[id(tree)]
+
+class Shapes:
+    """
+    Numbers subtrees by what they contain, equal subtrees get the same number. Hashing
+    a Tree walks it recursively, which along a chain of operators is quadratic and
+    deeper than Python allows, while every subtree is numbered once here from the
+    numbers of its children.
+
+    A subtree is only numbered once, so the numbers hold for as long as no subtree
+    numbered is changed.
+    """
+
+    def __init__(self):
+        self.numbers: Dict[Tuple, int] = {}
+
+        # keyed by id, each number is kept with its node so the id can't be reused
+        self.nodes: Dict[int, Tuple[Tree, int]] = {}
+
+    def number(self, node: Tree) -> int:
+        # the subtrees which aren't numbered yet, parents before their children
+        unnumbered = []
+        pending = [node]
+        while len(pending) > 0:
+            subtree = pending.pop()
+            if id(subtree) not in self.nodes:
+                unnumbered.append(subtree)
+                pending += [child for child in subtree.children if isinstance(child, Tree)]
+
+        for subtree in reversed(unnumbered):
+            self.add(subtree)
+
+        return self.nodes[id(node)][1]
+
+    def add(self, node: Tree) -> int:
+        """
+        Number a subtree whose children are numbered already.
+        """
+
+        shape = (node.data, *[self.nodes[id(child)][1] if isinstance(child, Tree) else self.part(child) for child in node.children])
+        number = self.nodes[id(node)] = (node, self.numbers.setdefault(shape, len(self.numbers)))
+
+        return number[1]
+
+    def part(self, child: Union[None, Token]) -> Union[None, Tuple[str, str]]:
+        if isinstance(child, Token):
+            return child.type, child.value
+
+        return child
@@ -1,10 +1,45 @@
-from random import randint
+# the characters Scratch itself draws IDs from, none of which need escaping in json or xml
+SOUP = '!#%()*+,-./0123456789:;=?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[]^_`abcdefghijklmnopqrstuvwxyz{|}~'
 
-def uid():
-    soup = '!#%()*+,-./0123456789:;=?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[]^_`abcdefghijklmnopqrstuvwxyz{|}~'
+# only the IDs of the stage start with this character, so a sprite's variables can
+# never take the ID of one of the stage's, which the editor shows beside them
+STAGE_LEADER = '~'
 
-    chunks = []
-    for char in range(20):
-        chunks.append(soup[randint(0, len(soup) - 1)])
+SPRITE_LEADERS = SOUP.replace(STAGE_LEADER, '')
 
-    return "".join(chunks)
\ No newline at end of file
+# the lengths of the IDs bitter generated before compact IDs, which their saving is
+# measured against: uuid4 hex IDs for blocks, and random IDs from the soup as long as
+# the ones Scratch generates for variables, lists, broadcasts and arguments
+BLOCK_ID_LENGTH = 32
+SCRATCH_ID_LENGTH = 20
+
+class IdAllocator:
+    """
+    Issues a target's block, variable and argument IDs in order, each the shortest
+    one not yet issued. The first character is drawn from leaders, the rest from
+    the whole soup.
+    """
+
+    def __init__(self, leaders: str = SPRITE_LEADERS):
+        self.leaders: str = leaders
+        self.issued: int = 0
+
+    def allocate(self) -> str:
+        index = self.issued
+        self.issued += 1
+
+        length = 1
+        count = len(self.leaders)
+        while index >= count:
+            index -= count
+            count *= len(SOUP)
+            length += 1
+
+        leader, index = divmod(index, count // len(self.leaders))
+
+        chunks = []
+        for _ in range(length - 1):
+            index, digit = divmod(index, len(SOUP))
+            chunks.append(SOUP[digit])
+
+        return self.leaders[leader] + "".join(reversed(chunks))
@@ -0,0 +1,112 @@
+from typing import Dict, List, Tuple, Union
+
+from pathlib import Path
+
+from bisect import bisect_right
+
+import mmap
+
+class Source:
+    """
+    The text of one source file, mapped into memory rather than read. Where each line
+    starts is only worked out the first time a line is asked for, so a file without
+    diagnostics costs nothing beyond the mapping.
+    """
+
+    def __init__(self, file: Path):
+        self.file: Path = file
+        self.stamp: Tuple[int, int] = Source.stamp_of(file)
+
+        with file.open("rb") as file_object:
+            # an empty file can't be mapped
+            self.data: Union[bytes, mmap.mmap] = mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ) if self.stamp[1] > 0 else b''
+
+        # the byte offset every line starts at
+        self.offsets: Union[None, List[int]] = None
+
+    @staticmethod
+    def stamp_of(file: Path) -> Tuple[int, int]:
+        status = file.stat()
+        return status.st_mtime_ns, status.st_size
+
+    def line_offsets(self) -> List[int]:
+        if self.offsets is None:
+            offsets = [0]
+            position = self.data.find(b'\n')
+            while position != -1:
+                offsets.append(position + 1)
+                position = self.data.find(b'\n', position + 1)
+
+            self.offsets = offsets
+
+        return self.offsets
+
+    def line_count(self) -> int:
+        return len(self.line_offsets())
+
+    def line(self, number: int) -> str:
+        """
+        The text of a line, counting from 1, without its line break. Empty past the end of the file.
+        """
+
+        offsets = self.line_offsets()
+        if number < 1 or number > len(offsets):
+            return ''
+
+        end = offsets[number] - 1 if number < len(offsets) else len(self.data)
+        return self.data[offsets[number - 1]:end].decode('utf-8', errors='replace').rstrip('\r')
+
+    def lines(self, first: int, last: int) -> List[str]:
+        return [self.line(number) for number in range(first, last + 1)]
+
+    def location(self, offset: int) -> Tuple[int, int]:
+        """
+        The line and byte column of a byte offset into the file, the line counting from 1 and the column from 0.
+        """
+
+        offsets = self.line_offsets()
+        line = bisect_right(offsets, offset)
+
+        return line, offset - offsets[line - 1]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+class SourceRegistry:
+    """
+    The source of every file diagnostics are reported for, so that each diagnostic
+    can show the lines of its own file whichever target was built last. A file is
+    mapped when it's first asked for, and mapped again if it changed since.
+    """
+
+    def __init__(self):
+        self.sources: Dict[Path, Source] = {}
+
+    def get(self, file: Path) -> Union[None, Source]:
+        """
+        The source of a file, or None if it can't be read.
+        """
+
+        source = self.sources.get(file)
+        try:
+            if source is not None and source.stamp == Source.stamp_of(file):
+                return source
+
+            self.forget(file)
+            source = self.sources[file] = Source(file)
+        except OSError:
+            return None
+
+        return source
+
+    def forget(self, file: Path):
+        source = self.sources.pop(file, None)
+        if source is not None:
+            source.close()
+
+    def close(self):
+        for file in list(self.sources):
+            self.forget(file)
+
+source_registry = SourceRegistry()
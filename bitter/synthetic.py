@@ -0,0 +1,162 @@
+from typing import Dict, List
+
+from pathlib import Path
+
+from PIL import Image
+
+import random
+
+# global variables the generated functions read and set
+VARIABLES = [f"v{index}" for index in range(8)]
+
+class Workload:
+    """
+    The shape of a synthetic project. The same workload and seed always give
+    the same project.
+    """
+
+    def __init__(self, sprites: int = 4, functions: int = 8, statements: int = 40, depth: int = 3, costumes: int = 2, seed: int = 0):
+        self.sprites: int = sprites
+        self.functions: int = functions
+        self.statements: int = statements
+        self.depth: int = depth
+        self.costumes: int = costumes
+        self.seed: int = seed
+
+    def scaled(self, factor: float) -> 'Workload':
+        """
+        The same workload with factor times as many statements in every function.
+        """
+
+        return Workload(self.sprites, self.functions, max(1, round(self.statements * factor)), self.depth, self.costumes, self.seed)
+
+    def total_statements(self) -> int:
+        return self.sprites * self.functions * self.statements
+
+    def describe(self) -> Dict[str, int]:
+        return {
+            "sprites": self.sprites,
+            "functions": self.functions,
+            "statements": self.statements,
+            "depth": self.depth,
+            "costumes": self.costumes,
+            "seed": self.seed
+        }
+
+class ProjectGenerator:
+    """
+    Writes a GoboScript project of a workload's shape. Every function is called
+    from the flag script, so none are removed as unused, and only calls functions
+    declared before it, so none recurse.
+    """
+
+    def __init__(self, workload: Workload):
+        self.workload: Workload = workload
+        self.rng: random.Random = random.Random(workload.seed)
+
+    def generate(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.write_costume(directory / "backdrop.png")
+        (directory / "stage.gs").write_text("costumes \"backdrop.png\";\n")
+
+        for sprite in range(self.workload.sprites):
+            costumes = [f"sprite{sprite}_{index}.png" for index in range(self.workload.costumes)]
+            for costume in costumes:
+                self.write_costume(directory / costume)
+
+            (directory / f"sprite{sprite}.gs").write_text(self.sprite(costumes))
+
+    def write_costume(self, file: Path):
+        # noise, so that compressing the image is real work
+        size = self.rng.choice([32, 48, 64])
+        image = Image.new('RGBA', (size, size))
+        image.putdata([(self.rng.randrange(256), self.rng.randrange(256), self.rng.randrange(256), 255) for _ in range(size * size)])
+        image.save(file, 'PNG')
+
+    def sprite(self, costumes: List[str]) -> str:
+        lines = []
+        if len(costumes) > 0:
+            quoted = ', '.join(f'"{costume}"' for costume in costumes)
+            lines += [f"costumes {quoted};", ""]
+
+        for index in range(self.workload.functions):
+            lines += [f"def f{index} a, b {{", *self.statements(self.workload.statements, index, 1), "}", ""]
+
+        lines.append("onflag {")
+        lines += [f"    {variable} = {self.rng.randint(0, 9)};" for variable in VARIABLES]
+        lines += [f"    f{index} {self.rng.randint(-50, 50)}, {self.rng.randint(1, 9)};" for index in range(self.workload.functions)]
+        lines.append("}")
+
+        return "\n".join(lines) + "\n"
+
+    def statements(self, count: int, function: int, indent: int) -> List[str]:
+        lines = []
+        for _ in range(count):
+            lines += self.statement(function, indent)
+
+        return lines
+
+    def statement(self, function: int, indent: int) -> List[str]:
+        prefix = "    " * indent
+        choice = self.rng.random()
+
+        # nested statements only at the top of a function, so that the statement count holds
+        if indent == 1 and choice < 0.1:
+            return [f"{prefix}if {self.expression(self.workload.depth)} < {self.expression(self.workload.depth)} {{", *self.statements(2, function, indent + 1), f"{prefix}}} else {{", *self.statements(1, function, indent + 1), f"{prefix}}}"]
+
+        if indent == 1 and choice < 0.2:
+            return [f"{prefix}repeat {self.rng.randint(2, 8)} {{", *self.statements(2, function, indent + 1), f"{prefix}}}"]
+
+        if function > 0 and choice < 0.3:
+            return [f"{prefix}f{self.rng.randrange(function)} {self.expression(self.workload.depth)}, {self.expression(self.workload.depth)};"]
+
+        if choice < 0.55:
+            return [f"{prefix}{self.rng.choice(VARIABLES)} = {self.expression(self.workload.depth)};"]
+
+        if choice < 0.65:
+            return [f"{prefix}local l{self.rng.randrange(4)} = {self.expression(self.workload.depth)};"]
+
+        match self.rng.choice(['move', 'turnright', 'goto', 'setpensize', 'pendown']):
+            case 'goto':
+                return [f"{prefix}goto {self.expression(self.workload.depth)}, {self.expression(self.workload.depth)};"]
+
+            case 'pendown':
+                return [f"{prefix}pendown;"]
+
+            case block:
+                return [f"{prefix}{block} {self.expression(self.workload.depth)};"]
+
+    def expression(self, depth: int) -> str:
+        if depth == 0 or self.rng.random() < 0.2:
+            return self.operand()
+
+        # decided first, so no operand is generated only to be thrown away
+        if self.rng.random() < 0.1:
+            return f"sin({self.expression(depth - 1)})"
+
+        left = self.expression(depth - 1)
+        right = self.expression(depth - 1)
+
+        return f"({left} {self.rng.choice(['+', '-', '*', '/'])} {right})"
+
+    def operand(self) -> str:
+        match self.rng.choice(['argument', 'argument', 'variable', 'variable', 'number', 'sensing']):
+            case 'argument':
+                return self.rng.choice(["$a", "$b"])
+
+            case 'variable':
+                return self.rng.choice(VARIABLES)
+
+            case 'number':
+                return str(self.rng.randint(1, 100))
+
+            case _:
+                return self.rng.choice(["mousex()", "mousey()"])
+
+def generate_project(directory: Path, workload: Workload):
+    """
+    Write a synthetic project of the given shape into directory.
+    """
+
+    ProjectGenerator(workload).generate(directory)
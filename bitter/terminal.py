@@ -1,9 +1,11 @@
 from typing import List, Tuple, Union
 
-from lark import Token, Lark, UnexpectedEOF
+from pathlib import Path
 
 import shutil
 
+from .sources import source_registry
+
 class ANSI:
     # Text color
     fg_black: str = '\033[30m'
@@ -67,29 +69,42 @@ class ANSI:
 class ErrorCollector:
     def __init__(self):
         self.errors = []
+
+        # the file diagnostics are thrown for, they point into its source
+        self.file: Union[None, Path] = None
+
         self.width, self.height = shutil.get_terminal_size((80, 20))
         self.content_width, self.content_height = max(self.width - 10, 10), max(self.height, 10)
 
     def throw(self, error):
+        if error.file is None:
+            error.file = self.file
         self.errors.append(error)
 
-    def set_source(self, source: str):
-        self.source = str(source).split('\n')
+    def set_file(self, file: Union[None, Path]):
+        self.file = file
 
     def render(self):
         for error in self.errors:
             print(f"{ANSI.fg_red + ANSI.bold}Error: {ANSI.reset + ANSI.bg_red}{error.error_type}{ANSI.reset}")
 
-            if error.reference is not None:
+            source = source_registry.get(error.file) if error.file is not None else None
+            if error.reference is not None and error.file is not None:
+                print(f"{ANSI.fg_bright_black}{error.file}:{error.reference[0]}:{error.reference[1]}{ANSI.reset}")
+            elif error.file is not None:
+                print(f"{ANSI.fg_bright_black}{error.file}{ANSI.reset}")
+
+            if error.reference is not None and source is not None:
                 line = error.reference[0]
                 column = error.reference[1]
-                
-                for y in range(max(0, line - 5), line, 1):
-                    if y == line - 1:
-                        line_number = f"{1 + y:02}{ANSI.reset}"
+
+                first = max(1, line - 4)
+                for number, text in enumerate(source.lines(first, line), first):
+                    if number == line:
+                        line_number = f"{number:02}{ANSI.reset}"
                     else:
-                        line_number = f"{ANSI.fg_bright_black}{1 + y:02}{ANSI.reset}"
-                    print(f"{line_number} {repr(self.source[y])[1:-1]}")
+                        line_number = f"{ANSI.fg_bright_black}{number:02}{ANSI.reset}"
+                    print(f"{line_number} {repr(text)[1:-1]}")
 
                 print(f"{' ' * (len(f'{column:02}') + column)}{ANSI.fg_red + ANSI.reverse + ANSI.bold}^{ANSI.reset}")
 
@@ -99,48 +114,37 @@ class ErrorCollector:
                 print(f"{ANSI.fg_blue + ANSI.bold}Hint:{ANSI.reset}")
                 print(f"{error.solution}\n")
 
-    def patch_after(self, line, column, value, parser: Lark):
-        rebuilt_source = self.source[:line - 1]
-        rebuilt_source.append(f'{self.source[line - 1][:column + len(value)]};')
-
-        try:
-            parsed = parser.parse("\n".join(rebuilt_source))
+    def missing_semicolon(self, line: int, column: int) -> Union[None, str]:
+        """
+        The hint for a semicolon missing after the given column of a line of the current file.
+        The line counts from 1 and the column from 0.
+        """
 
-        except UnexpectedEOF as e:
-            return self.render_missing_semicolon(rebuilt_source)
-        
-        except Exception as e:
+        source = source_registry.get(self.file) if self.file is not None else None
+        if source is None:
             return None
 
-    def patch_before(self, line, column, parser: Lark):
-        rebuilt_source = self.source[:line]
-        rebuilt_last = self.source[line][:column]
+        first = max(1, line - 4)
+        lines = source.lines(first, line)
+        lines[-1] = f'{lines[-1][:column]};'
 
-        if len(rebuilt_last.rstrip()) > 0:
-            rebuilt_source.append(rebuilt_last)
+        return self.render_missing_semicolon(lines, first)
 
-        rebuilt_source[-1] += ';'
+    def render_missing_semicolon(self, lines: List[str], first: int) -> str:
+        """
+        The last lines up to a missing semicolon, the first of them numbered first.
+        """
 
-        try:
-            parsed = parser.parse("\n".join(rebuilt_source))
-
-        except UnexpectedEOF as e:
-            return self.render_missing_semicolon(rebuilt_source)
-        
-        except Exception as e:
-            return None
-
-    def render_missing_semicolon(self, source: List[str]) -> str:
-        line = len(source)
-        column = len(repr(source[-1])[1:-1])
+        line = first + len(lines) - 1
+        column = len(repr(lines[-1])[1:-1])
 
         patch = []
-        for y in range(max(0, line - 5), line, 1):
-            if y == line - 1:
-                line_number = f"{1 + y:02}{ANSI.reset}"
+        for number, text in enumerate(lines, first):
+            if number == line:
+                line_number = f"{number:02}{ANSI.reset}"
             else:
-                line_number = f"{ANSI.fg_bright_black}{1 + y:02}{ANSI.reset}"
-            patch.append(f"{line_number} {repr(source[y])[1:-1]}")
+                line_number = f"{ANSI.fg_bright_black}{number:02}{ANSI.reset}"
+            patch.append(f"{line_number} {repr(text)[1:-1]}")
 
 
         patch.append(f"{' ' * (len(f'{line:02}') + column)}{ANSI.fg_blue + ANSI.reverse + ANSI.bold}^{ANSI.reset}")
@@ -157,6 +161,9 @@ class Error:
         self.solution: Union[None, str] = solution
         self.reference: Union[None, Tuple[int, int]] = reference
 
+        # the source file the error was found in, filled in when it's thrown
+        self.file: Union[None, Path] = None
+
 class gSyntaxError(Error):
     def __init__(self, description: str, solution: Union[None, str] = None, reference: Union[None, Tuple[int, int]] = None):
         super().__init__("SyntaxError", description, solution, reference)
@@ -178,9 +185,12 @@ class gTypeError(Error):
         super().__init__("TypeError", description, solution, reference)
 
 def pretty_join(items: List, separator: str = ' and '):
-    return '' if len(items) == 0 else (', '.join(items[:-1])) + (separator if len(items) > 2 else '') + (items[-1])
+    return '' if len(items) == 0 else (', '.join(items[:-1])) + (separator if len(items) > 1 else '') + (items[-1])
 
 def pretty_repr_join(items: List, separator: str = ' and '):
-    return '' if len(items) == 0 else (', '.join([repr(item) for item in items[:-1]])) + (separator if len(items) > 2 else '') + (repr(items[-1]))
+    return '' if len(items) == 0 else (', '.join([repr(item) for item in items[:-1]])) + (separator if len(items) > 1 else '') + (repr(items[-1]))
+
+def pretty_count(count: int, noun: str, plural: Union[None, str] = None):
+    return f"{count} {noun if count == 1 else (plural if plural is not None else noun + 's')}"
 
 error_collector = ErrorCollector()
\ No newline at end of file
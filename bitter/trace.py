@@ -0,0 +1,71 @@
+from typing import Dict, Iterator, List
+
+from contextlib import contextmanager
+
+from pathlib import Path
+
+from time import perf_counter_ns
+
+import json
+
+import os
+
+import threading
+
+class Tracer:
+    """
+    Records how long the phases of a build take as spans in Chrome's trace event
+    format, which chrome://tracing and Perfetto display as a timeline. Every process
+    and thread gets its own track.
+
+    A span costs two clock reads and an append, and nothing while tracing is off.
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.events: List[Dict] = []
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            # the monotonic clock is shared by every process, so worker spans line up
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": (perf_counter_ns() - start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args
+            })
+
+    def take(self) -> List[Dict]:
+        """
+        Remove and return the recorded spans, for a worker to hand them to the main process.
+        """
+
+        events, self.events = self.events, []
+        return events
+
+    def write(self, destination: Path):
+        main = os.getpid()
+
+        # name the tracks, the main process first
+        processes = sorted({event["pid"] for event in self.events}, key=lambda pid: (pid != main, pid))
+        metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "bitter" if pid == main else f"worker {index}"}} for index, pid in enumerate(processes)]
+
+        with destination.open("w") as file:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, file)
+
+tracer = Tracer()
@@ -0,0 +1,176 @@
+from typing import Dict, List, Tuple, Union
+
+from pathlib import Path
+
+from time import perf_counter, sleep
+
+from .cache import BuildCache, costume_cache, DEFAULT_COSTUME_CACHE_SIZE
+
+from .compiler import load_parser, read_grammar, read_source, parse_source, create_target, target_files, process_costumes
+
+from .sb3.project import Project, Target
+
+from .sb3.passes import DEFAULT_PASSES
+
+from .terminal import ANSI, Error, error_collector
+
+from .sources import source_registry
+
+class WatchedTarget:
+    def __init__(self, file: Path, target: Union[None, Target], errors: List[Error]):
+        self.file: Path = file
+        self.target: Union[None, Target] = target
+        self.errors: List[Error] = errors
+
+    def dependencies(self) -> List[Path]:
+        if self.target is None:
+            return [self.file]
+
+        return [self.file, *(self.target.working_directory / source for source in self.target.costume_sources)]
+
+class ProjectWatcher:
+    """
+    Keeps a project's parser and built targets in memory, and rebuilds only the
+    targets whose source file or costumes changed since the previous build.
+    """
+
+    def __init__(self, path: Path, parser_backend: str = "lalr", use_cache: bool = True, costume_cache_size: int = DEFAULT_COSTUME_CACHE_SIZE, json_backend: str = "auto", passes: Tuple[str, ...] = DEFAULT_PASSES):
+        self.path: Path = path
+        self.passes: Tuple[str, ...] = passes
+        self.json_backend: str = json_backend
+        self.output: Path = Path(f"{path.stem}.sb3")
+
+        self.parser, _ = load_parser(parser_backend, use_cache)
+        costume_cache.configure(use_cache, costume_cache_size)
+        self.build_cache = BuildCache(path, read_grammar(), (f"passes={','.join(passes)}",)) if use_cache else None
+
+        self.targets: Dict[Path, WatchedTarget] = {}
+        self.stamps: Dict[Path, Union[None, Tuple[int, int]]] = {}
+
+    def stamp(self, file: Path) -> Union[None, Tuple[int, int]]:
+        try:
+            status = file.stat()
+        except OSError:
+            return None
+
+        return status.st_mtime_ns, status.st_size
+
+    def build_target(self, file: Path, layer_order: int) -> WatchedTarget:
+        source = read_source(file)
+        error_collector.errors = []
+
+        entry = self.build_cache.load(file, source, self.path) if self.build_cache is not None else None
+        if entry is not None:
+            assert self.build_cache is not None
+            target = create_target(file, None, self.path, layer_order, self.passes)
+            target.restore(entry, self.build_cache.assets(entry))
+
+            return WatchedTarget(file, target, [])
+
+        error_collector.set_file(file)
+        tree = parse_source(self.parser, source)
+        if tree is None:
+            return WatchedTarget(file, None, error_collector.errors)
+
+        target = create_target(file, tree, self.path, layer_order, self.passes)
+        target.build(self.parser)
+        process_costumes([target])
+
+        if self.build_cache is not None and len(error_collector.errors) == 0:
+            self.build_cache.store(file, source, target)
+
+        return WatchedTarget(file, target, error_collector.errors)
+
+    def changed_files(self, files: List[Tuple[Path, int]]) -> List[Path]:
+        changed = []
+        for file, _ in files:
+            watched = self.targets.get(file)
+            if watched is None or any(self.stamp(dependency) != self.stamps.get(dependency) for dependency in watched.dependencies()):
+                changed.append(file)
+
+        return changed
+
+    def rebuild(self) -> Union[None, List[Path]]:
+        """
+        Rebuild the changed targets and rewrite the project file.
+        Returns the rebuilt files, or None if nothing changed.
+        """
+
+        files = target_files(self.path)
+        changed = self.changed_files(files)
+        removed = [file for file in self.targets if file not in dict(files)]
+
+        if len(changed) == 0 and len(removed) == 0:
+            return None
+
+        for file in removed:
+            self.targets.pop(file)
+            source_registry.forget(file)
+
+        for file, layer_order in files:
+            if file in changed:
+                # stamp the source before reading it, so an edit made while building is picked up next time
+                source_stamp = self.stamp(file)
+                self.targets[file] = self.build_target(file, layer_order)
+                self.stamps.update({dependency: self.stamp(dependency) for dependency in self.targets[file].dependencies()})
+                self.stamps[file] = source_stamp
+
+            elif (target := self.targets[file].target) is not None:
+                target.layer_order = layer_order
+
+        self.write([file for file, _ in files])
+
+        return changed
+
+    def write(self, files: List[Path]):
+        watched = [self.targets[file] for file in files]
+
+        error_collector.errors = []
+        for watched_target in watched:
+            if len(watched_target.errors) > 0:
+                error_collector.errors = watched_target.errors
+                error_collector.render()
+
+        error_collector.errors = []
+        if any(len(watched_target.errors) > 0 for watched_target in watched):
+            return
+
+        project = Project()
+        for watched_target in watched:
+            assert watched_target.target is not None
+            project.add_target(watched_target.target)
+
+        project.json_backend = self.json_backend
+
+        # the project is replaced in one step, so an editor never loads a half written file
+        project.write(self.output)
+
+        # the targets stay resident between rebuilds and stream their costumes out of the
+        # cache on every write, so the entries they hold can't be evicted
+        resident = {costume.asset.path for watched_target in watched for costume in watched_target.target.costumes if costume.asset.path is not None}
+        costume_cache.prune(protected=resident)
+
+    def watch(self, interval: float):
+        print(f"{ANSI.fg_bright_black}Watching {self.path} for changes. Press Ctrl+C to stop.{ANSI.reset}")
+
+        try:
+            while True:
+                start = perf_counter()
+                rebuilt = self.rebuild()
+
+                if rebuilt is not None:
+                    names = ', '.join(file.name for file in rebuilt) or 'no targets'
+                    latency = (perf_counter() - start) * 1000
+
+                    if any(len(watched.errors) > 0 for watched in self.targets.values()):
+                        print(f"{ANSI.fg_bright_black}Rebuilt {names} in {latency:.1f} ms, {self.output} was left unchanged because of errors.{ANSI.reset}")
+                    else:
+                        print(f"{ANSI.fg_bright_black}Rebuilt {names} and wrote {self.output} in {latency:.1f} ms.{ANSI.reset}")
+
+                sleep(interval)
+
+        except KeyboardInterrupt:
+            pass
+
+def watch_project(path: Path, parser_backend: str = "lalr", use_cache: bool = True, interval: float = 0.5, costume_cache_size: int = DEFAULT_COSTUME_CACHE_SIZE, json_backend: str = "auto", passes: Tuple[str, ...] = DEFAULT_PASSES):
+    ProjectWatcher(path, parser_backend, use_cache, costume_cache_size, json_backend, passes).watch(interval)
@@ -0,0 +1,87 @@
+from typing import Callable, List, Tuple, Union
+
+from pathlib import Path
+
+import pytest
+
+from bitter.compiler import load_parser, create_target
+
+from bitter.sb3.passes import select_passes
+
+from bitter.terminal import error_collector
+
+Lowered = Tuple[List, List]
+
+def lowered_scripts(target) -> List:
+    """
+    The scripts of a built target as nested lists, without the IDs which differ between
+    builds. A block is its opcode, its inputs, its fields and, for a call, its proccode.
+    """
+
+    records = dict(target.blocks.records())
+
+    def stack(uuid: str) -> List:
+        blocks = []
+        while uuid is not None:
+            record = records[uuid]
+            block = [record["opcode"], {name: value(primitive) for name, primitive in record["inputs"].items()}, {name: field[0] for name, field in record["fields"].items()}]
+            if "mutation" in record and record["opcode"] == 'procedures_call':
+                block.append(record["mutation"]["proccode"])
+            blocks.append(block)
+            uuid = record["next"]
+
+        return blocks
+
+    def value(primitive: List) -> Union[None, str, List]:
+        # an input lowering rejected
+        if len(primitive) < 2:
+            return None
+
+        front = primitive[1]
+        if isinstance(front, str):
+            return stack(front)
+
+        # a variable is told apart from a literal by its name
+        if front[0] == 12:
+            return ['var', front[1]]
+
+        return front[1]
+
+    return [stack(uuid) for uuid, record in records.items() if record["topLevel"]]
+
+@pytest.fixture(scope="session")
+def parser():
+    return load_parser("lalr", use_cache=False)[0]
+
+@pytest.fixture
+def build(parser) -> Callable:
+    """
+    Build a source as a sprite at an optimisation level, returning the target. Its
+    errors are left in the error collector.
+    """
+
+    def build(source: str, level: int = 2, enabled: Tuple[str, ...] = (), disabled: Tuple[str, ...] = ()):
+        error_collector.errors = []
+        target = create_target(Path("test.gs"), parser.parse(source), Path("."), 1, select_passes(level, enabled, disabled))
+        target.build(parser)
+
+        return target
+
+    return build
+
+@pytest.fixture
+def lower(build) -> Callable[..., Lowered]:
+    """
+    Build a source as a sprite at an optimisation level, returning its scripts and
+    the descriptions of the errors it raised.
+    """
+
+    def lower(source: str, level: int = 2, enabled: Tuple[str, ...] = (), disabled: Tuple[str, ...] = ()) -> Lowered:
+        target = build(source, level, enabled, disabled)
+
+        errors = [error.description for error in error_collector.errors]
+        error_collector.errors = []
+
+        return lowered_scripts(target), errors
+
+    return lower
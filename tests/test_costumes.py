@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from PIL import Image
+
+from bitter.cache import costume_cache
+
+from bitter.sb3.costumes import cast_to_costume
+
+def test_costume_evicted_before_writing_is_converted_again(tmp_path, monkeypatch):
+    monkeypatch.setenv("BITTER_CACHE_DIR", str(tmp_path / "cache"))
+    costume_cache.configure(True)
+
+    Image.new("RGB", (3, 2), "green").save(tmp_path / "c.png")
+    costume = cast_to_costume(Path("c.png"), tmp_path)
+    assert costume.asset.path is not None
+    written = b''.join(costume.asset.chunks())
+
+    # as another build pruning the shared cache would
+    costume.asset.path.unlink()
+
+    assert b''.join(costume.asset.chunks()) == written
+    assert costume.asset.md5() == costume.asset_id
+
+    costume_cache.configure(False)
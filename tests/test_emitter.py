@@ -0,0 +1,24 @@
+import json
+
+from io import BytesIO
+
+import pytest
+
+from bitter.sb3.emitter import JsonEmitter, StreamedArray, StreamedObject
+
+DOCUMENT = {"名前": ["café", "ｓｃｒａｔｃｈ", "😀", 1.5, 7, True, None], "say": {"MESSAGE": [1, [10, "héllo\n\"wörld\""]]}}
+
+def emitted(backend: str) -> bytes:
+    stream = BytesIO()
+    streamed = StreamedObject((key, StreamedArray(value) if isinstance(value, list) else value) for key, value in DOCUMENT.items())
+    JsonEmitter(stream, backend).emit_document(streamed)
+
+    return stream.getvalue()
+
+def test_json_backend_escapes_non_ascii_as_json_dumps_does():
+    assert emitted("json") == json.dumps(DOCUMENT, separators=(',', ':')).encode()
+
+def test_backends_write_the_same_bytes_for_non_ascii_text():
+    pytest.importorskip("orjson")
+
+    assert emitted("orjson") == emitted("json")
@@ -0,0 +1,46 @@
+from bitter.sb3.folding import js_string
+
+def test_boolean_operand_of_a_comparison_is_not_folded_to_text(lower):
+    source = "onflag {\nx = 1;\nsay (1 < 2) < x;\n}\n"
+
+    unoptimised, errors = lower(source, 0)
+    assert errors == []
+
+    optimised, errors = lower(source, 2)
+    assert errors == []
+
+    # operator_lt reads a boolean block as 1, but "true" as a string
+    assert optimised == unoptimised
+    comparison = optimised[0][2][1]["MESSAGE"][0]
+    assert comparison[0] == 'operator_lt'
+    assert comparison[1]["OPERAND1"][0][0] == 'operator_lt'
+
+def test_boolean_is_folded_to_text_where_it_is_displayed(lower):
+    scripts, errors = lower("onflag {\nsay 1 < 2;\n}\n")
+
+    assert errors == []
+    assert scripts[0][1] == ['looks_say', {"MESSAGE": "true"}, {}]
+
+def test_operands_lowering_rejects_are_not_folded(lower):
+    source = "onflag {\nsay (\"abc\" = \"ABC\");\n}\n"
+
+    _, unoptimised = lower(source, 0)
+    _, optimised = lower(source, 2)
+
+    assert len(unoptimised) > 0
+    assert optimised == unoptimised
+
+def test_nested_constant_operators_fold(lower):
+    scripts, errors = lower("onflag {\nx = 1;\nmove (2 * 3) + (1 - 1);\n}\n")
+
+    assert errors == []
+    assert scripts[0][2] == ['motion_movesteps', {"STEPS": "6"}, {}]
+
+def test_large_integers_are_written_as_javascript_does():
+    assert js_string(float(2 ** 60)) == "1152921504606847000"
+    assert js_string(-float(2 ** 60)) == "-1152921504606847000"
+    assert js_string(float(2 ** 53)) == "9007199254740992"
+    assert js_string(1e20) == "100000000000000000000"
+    assert js_string(1e21) is None
+    assert js_string(-0.0) == "0"
+    assert js_string(0.5) == "0.5"
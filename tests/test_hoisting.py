@@ -0,0 +1,50 @@
+SOURCE = """
+def f n {
+    repeat 3 {
+        x = x + 1;
+        move $n * 2;
+        turnright x * 3;
+    }
+}
+
+onflag {
+    x = 1;
+    f 2;
+    f 3;
+}
+"""
+
+def test_invariant_operator_is_hoisted_out_of_a_warp_loop(lower):
+    scripts, errors = lower(SOURCE)
+    assert errors == []
+
+    definition = scripts[0]
+    assert definition[1][0] == 'data_setvariableto'
+    assert definition[1][2] == {"VARIABLE": "f.#1"}
+    assert definition[1][1]["VALUE"][0][0] == 'operator_multiply'
+
+    loop = definition[2][1]["SUBSTACK"]
+    assert loop[1] == ['motion_movesteps', {"STEPS": ['var', 'f.#1']}, {}]
+
+def test_operators_of_variables_the_loop_writes_stay_in_it(lower):
+    unoptimised, errors = lower(SOURCE, 0)
+    assert errors == []
+
+    optimised, errors = lower(SOURCE, 2)
+    assert errors == []
+
+    # x is set in the loop, so x + 1 and x * 3 change every iteration
+    unoptimised_loop = unoptimised[0][1][1]["SUBSTACK"]
+    optimised_loop = optimised[0][2][1]["SUBSTACK"]
+    assert optimised_loop[0] == unoptimised_loop[0]
+    assert optimised_loop[2] == unoptimised_loop[2]
+
+def test_loops_of_scripts_are_left_alone(lower):
+    # another script may change y between two iterations of a script's loop
+    source = "onflag {\ny = 2;\nrepeat 3 { move y * 2; }\n}\n"
+
+    unoptimised, _ = lower(source, 0)
+    optimised, errors = lower(source, 2)
+
+    assert errors == []
+    assert optimised == unoptimised
@@ -0,0 +1,11 @@
+def test_id_savings_are_measured_against_the_previous_id_lengths(build):
+    target = build("onflag {\nx = 1;\n}\n")
+
+    # the hat and the set block, each written as its ID and as the other's parent or next
+    block_ids = 4 * (32 - 1)
+
+    # the variable, declared on the target and read by the set block's field
+    variable_ids = 2 * (20 - 1)
+
+    assert target.ids.issued == 3
+    assert target.id_savings() == block_ids + variable_ids
@@ -0,0 +1,46 @@
+def calls(scripts):
+    return [block[3] for script in scripts for block in script if block[0] == 'procedures_call']
+
+def test_function_which_yields_is_not_inlined_into_a_script(lower):
+    # a script has screen refresh, the function runs to its end without it
+    scripts, errors = lower("def pause k {\nwait $k;\n}\nonflag {\npause 1;\n}\n")
+
+    assert errors == []
+    assert calls(scripts) == ['pause %s']
+
+def test_function_which_yields_is_inlined_into_a_warp_function(lower):
+    source = "def pause k {\nwait $k;\n}\ndef outer k {\npause 1;\nmove $k;\n}\nonflag {\nouter mousex();\nouter mousey();\n}\n"
+    scripts, errors = lower(source)
+
+    assert errors == []
+    assert calls(scripts) == ['outer %s', 'outer %s']
+    assert ['control_wait', {"DURATION": "1"}, {}] in [block for script in scripts for block in script]
+
+def test_nowarp_function_is_inlined_with_literal_arguments(lower):
+    scripts, errors = lower("nowarp def pause k {\nwait $k;\n}\nonflag {\npause 2;\n}\n")
+
+    assert errors == []
+    assert calls(scripts) == []
+    assert scripts[-1][1] == ['control_wait', {"DURATION": "2"}, {}]
+
+def test_nowarp_function_which_yields_keeps_its_call_for_a_temporary(lower):
+    # the temporary holding the argument could be overwritten by another script while waiting
+    scripts, errors = lower("nowarp def pause k {\nwait $k;\n}\nonflag {\npause mousex();\n}\n")
+
+    assert errors == []
+    assert calls(scripts) == ['pause %s']
+
+def test_inlined_body_does_what_the_call_did(lower):
+    source = "def step a {\nmove $a;\nturnright $a;\n}\nonflag {\nstep 5;\n}\n"
+
+    unoptimised, errors = lower(source, 0)
+    assert errors == []
+    assert calls(unoptimised) == ['step %s']
+
+    optimised, errors = lower(source, 2)
+    assert errors == []
+    assert optimised == [[
+        ['event_whenflagclicked', {}, {}],
+        ['motion_movesteps', {"STEPS": "5"}, {}],
+        ['motion_turnright', {"DEGREES": "5"}, {}]
+    ]]
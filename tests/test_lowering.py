@@ -0,0 +1,44 @@
+import sys
+
+import pytest
+
+from bitter.terminal import error_collector
+
+# deeper than Python's recursion limit
+DEPTH = sys.getrecursionlimit() * 3
+
+@pytest.mark.parametrize("level", [0, 2])
+def test_deep_chain_of_operators_lowers(build, level):
+    source = f"onflag {{\nx = 1;\ny = {' + '.join(['x'] * (DEPTH + 1))};\n}}\n"
+    target = build(source, level)
+
+    assert error_collector.errors == []
+
+    records = dict(target.blocks.records())
+    assert sum(1 for record in records.values() if record["opcode"] == 'operator_add') == DEPTH
+
+@pytest.mark.parametrize("level", [0, 2])
+def test_deep_parentheses_lower(build, level):
+    source = f"onflag {{\nx = 1;\ny = {'(x * ' * DEPTH}x{')' * DEPTH};\n}}\n"
+    target = build(source, level)
+
+    assert error_collector.errors == []
+
+    # every operator is the second operand of the one before it
+    records = dict(target.blocks.records())
+    chain = 0
+    operand = next(record for record in records.values() if record["opcode"] == 'data_setvariableto' and record["fields"]["VARIABLE"][0] == 'y')["inputs"]["VALUE"]
+    while isinstance(operand[1], str):
+        chain += 1
+        operand = records[operand[1]]["inputs"]["NUM2"]
+
+    assert chain == DEPTH
+
+def test_deeply_nested_statements_lower(build):
+    lines = ["onflag {", "x = 1;"] + ["repeat 2 {"] * DEPTH + ["x = x + 1;"] + ["}"] * DEPTH + ["}"]
+    target = build("\n".join(lines) + "\n", 0)
+
+    assert error_collector.errors == []
+
+    records = dict(target.blocks.records())
+    assert sum(1 for record in records.values() if record["opcode"] == 'control_repeat') == DEPTH
@@ -0,0 +1,56 @@
+from bitter.sb3.passes import PASS_NAMES, select_passes
+
+SOURCE = """
+def step a {
+    move $a;
+    turnright $a * 2;
+}
+
+def unused n {
+    move $n;
+}
+
+onflag {
+    x = 1 + 2;
+    step 3;
+    step 4;
+}
+"""
+
+def test_levels_select_passes_in_pipeline_order():
+    assert select_passes(0) == ()
+    assert select_passes(1) == ('fold', 'dead-procedures')
+    assert select_passes(2) == tuple(PASS_NAMES)
+
+def test_passes_are_enabled_and_disabled():
+    assert select_passes(0, enabled=('cse',)) == ('cse',)
+    assert select_passes(2, disabled=('inline', 'licm')) == ('fold', 'refold', 'dead-procedures', 'cse')
+
+    # disabling wins
+    assert select_passes(0, enabled=('fold',), disabled=('fold',)) == ()
+
+def test_level_zero_lowers_the_tree_as_parsed(lower):
+    unoptimised, errors = lower(SOURCE, 0)
+    assert errors == []
+
+    disabled, errors = lower(SOURCE, 2, disabled=tuple(PASS_NAMES))
+    assert errors == []
+
+    assert disabled == unoptimised
+    assert unoptimised[-1][1] == ['data_setvariableto', {"VALUE": [['operator_add', {"NUM1": "1", "NUM2": "2"}, {}]]}, {"VARIABLE": "x"}]
+
+def test_statistics_are_recorded_for_every_pass_which_ran(build):
+    target = build(SOURCE, 2)
+
+    assert list(target.pass_statistics) == PASS_NAMES
+    assert all(elapsed >= 0 for elapsed, _ in target.pass_statistics.values())
+
+    # 1 + 2 is one operator and two literals less, the copies of step's body are more nodes
+    assert target.pass_statistics['fold'][1] == -2
+    assert target.pass_statistics['inline'][1] > 0
+    assert target.pass_statistics['dead-procedures'][1] < 0
+
+def test_no_statistics_without_passes(build):
+    target = build(SOURCE, 0)
+
+    assert target.pass_statistics == {}
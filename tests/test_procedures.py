@@ -0,0 +1,39 @@
+def calls(script):
+    return [block[3] for block in script if block[0] == 'procedures_call']
+
+SOURCE = """
+def used n {
+    move $n;
+}
+
+def helper n {
+    turnright $n;
+}
+
+def unused n {
+    helper $n;
+}
+
+onflag {
+    used mousex();
+    used mousey();
+}
+"""
+
+def test_unreachable_procedures_are_removed(lower):
+    unoptimised, errors = lower(SOURCE, 0)
+    assert errors == []
+    assert len(unoptimised) == 4
+
+    optimised, errors = lower(SOURCE, 1)
+    assert errors == []
+
+    # helper is only called by unused, which nothing calls
+    assert len(optimised) == 2
+    assert calls(optimised[-1]) == ['used %s', 'used %s']
+
+def test_procedures_are_kept_when_the_pass_is_disabled(lower):
+    scripts, errors = lower(SOURCE, 2, disabled=('dead-procedures',))
+
+    assert errors == []
+    assert len(scripts) == 4
@@ -0,0 +1,48 @@
+def test_repeated_operator_is_evaluated_once(lower):
+    scripts, errors = lower("onflag {\ny = 2;\nmove y * 2 + 1;\nturnright y * 2 + 1;\nmove y * 2 + 1;\n}\n")
+    assert errors == []
+
+    script = scripts[0]
+    assert script[2][0] == 'data_setvariableto'
+    temporary = script[2][2]["VARIABLE"]
+    assert script[3:] == [
+        ['motion_movesteps', {"STEPS": ['var', temporary]}, {}],
+        ['motion_turnright', {"DEGREES": ['var', temporary]}, {}],
+        ['motion_movesteps', {"STEPS": ['var', temporary]}, {}]
+    ]
+
+def test_operator_is_evaluated_again_after_a_write(lower):
+    source = "onflag {\ny = 2;\nmove y * 2 + 1;\nturnright y * 2 + 1;\nmove y * 2 + 1;\ny = 5;\nturnright y * 2 + 1;\n}\n"
+
+    unoptimised, errors = lower(source, 0)
+    assert errors == []
+
+    optimised, errors = lower(source, 2)
+    assert errors == []
+
+    # y changed, so the last read can't use the value from before
+    assert optimised[0][-2] == ['data_setvariableto', {"VALUE": "5"}, {"VARIABLE": "y"}]
+    assert optimised[0][-1] == unoptimised[0][-1]
+
+def test_operators_are_not_reused_across_a_wait(lower):
+    # other scripts run during the wait and may change y
+    source = "onflag {\ny = 2;\nmove y * 2 + 1;\nwait 1;\nmove y * 2 + 1;\nturnright y * 2 + 1;\n}\n"
+
+    unoptimised, _ = lower(source, 0)
+    optimised, errors = lower(source, 2)
+
+    assert errors == []
+    assert optimised[0][:4] == unoptimised[0][:4]
+
+def test_temporaries_are_named_after_the_hoisted_ones_of_their_function(lower):
+    source = "def f n {\nrepeat 3 {\nx = x + 1;\nmove $n * 2;\nturnright x * 3 + 1;\nmove x * 3 + 1;\nturnright x * 3 + 1;\n}\n}\n\nonflag {\nx = 1;\nf 2;\n}\n"
+    scripts, errors = lower(source)
+    assert errors == []
+
+    definition = scripts[0]
+    assert definition[1][2] == {"VARIABLE": "f.#1"}
+
+    # set in the loop the hoisted temporary is read in, so it can't share its name
+    loop = definition[2][1]["SUBSTACK"]
+    assert loop[2] == ['data_setvariableto', loop[2][1], {"VARIABLE": "f.#2"}]
+    assert loop[3] == ['motion_turnright', {"DEGREES": ['var', 'f.#2']}, {}]
@@ -0,0 +1,41 @@
+import pytest
+
+from bitter.compiler import parse_source
+
+from bitter.terminal import error_collector
+
+@pytest.fixture
+def syntax_errors(parser, tmp_path):
+    def syntax_errors(source: str):
+        # hints show the lines of the file the source was read from
+        file = tmp_path / "stage.gs"
+        file.write_text(source)
+
+        error_collector.errors = []
+        error_collector.set_file(file)
+        tree = parse_source(parser, source)
+        errors, error_collector.errors = error_collector.errors, []
+        error_collector.set_file(None)
+
+        assert tree is None
+        return errors
+
+    return syntax_errors
+
+def test_missing_semicolon_is_hinted(syntax_errors):
+    errors = syntax_errors("onflag {\nsay \"ok\"\nmove 1;\n}\n")
+
+    assert len(errors) == 1
+    assert errors[0].solution is not None and "semicolon" in errors[0].solution
+
+def test_unexpected_character_has_no_semicolon_hint(syntax_errors):
+    # a semicolon would be inserted before the character, not replace it
+    errors = syntax_errors("onflag {\nsay \"ok\" @;\n}\n")
+
+    assert len(errors) == 1
+    assert "'@'" in errors[0].description
+    assert errors[0].solution is None
+
+def test_end_of_file_is_only_hinted_when_a_semicolon_ends_it(syntax_errors):
+    assert syntax_errors("costumes \"a.svg\"")[0].solution is not None
+    assert syntax_errors("onflag {\nsay \"ok\"")[0].solution is None
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from zipfile import ZipFile
+
+from PIL import Image
+
+from bitter.cache import costume_cache
+
+from bitter.watch import ProjectWatcher
+
+def write_sprite(project: Path, name: str, colour: str, body: str):
+    Image.new("RGB", (4, 4), colour).save(project / f"{name}.png")
+    (project / f"{name}.gs").write_text(f"costumes \"{name}.png\";\n{body}\n")
+
+def test_rebuilds_keep_the_costumes_of_resident_targets(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    monkeypatch.setenv("BITTER_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+
+    write_sprite(project, "a", "red", "onflag { clear; }")
+    write_sprite(project, "b", "blue", "onflag { clear; }")
+
+    # a limit smaller than any entry, so every write would evict everything it may
+    watcher = ProjectWatcher(project, costume_cache_size=10)
+    assert watcher.rebuild() is not None
+
+    (project / "a.gs").write_text("costumes \"a.png\";\nonflag { stamp; clear; }\n")
+    assert watcher.rebuild() == [project / "a.gs"]
+
+    # b wasn't rebuilt, its costume is still streamed from the entry the first build stored
+    (project / "a.gs").write_text("costumes \"a.png\";\nonflag { clear; }\n")
+    assert watcher.rebuild() == [project / "a.gs"]
+
+    with ZipFile(tmp_path / "project.sb3") as archive:
+        assets = [name for name in archive.namelist() if name.endswith(".png")]
+    assert len(assets) == 2
+
+    costume_cache.configure(False)